@@ -13,4 +13,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'apiReciclagem.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Importado depois do setup do Django feito por get_asgi_application()
+from core.eventos import PREFIXO_URL, aplicacao_sse, verificar_broker_asgi  # noqa: E402
+
+verificar_broker_asgi()
+
+
+async def application(scope, receive, send):
+    # O fluxo SSE dos painéis é servido direto pelo ASGI, sem passar pelas
+    # views síncronas do Django, para manter uma conexão aberta por painel
+    if scope['type'] == 'http' and scope['path'].startswith(PREFIXO_URL):
+        await aplicacao_sse(scope, receive, send)
+        return
+    await django_application(scope, receive, send)
@@ -176,6 +176,79 @@ DATABASES = {
     }
 }
 
+# PostgreSQL opcional (ex.: instância local para testar o particionamento)
+if os.environ.get('POSTGRES_DB'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ['POSTGRES_DB'],
+        'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+    }
+
+# Sharding das coletas por condomínio: SHARDS lista os aliases de DATABASES que
+# guardam coletas (o default deve ser o primeiro). SHARDS_SQLITE=N adiciona N
+# bancos SQLite locais para testes. Execute preparar_shards antes de cadastrar
+# condomínios, tipos de resíduo ou parâmetros (e para ressincronizar réplicas).
+SHARDS = ['default']
+for _indice in range(1, int(os.environ.get('SHARDS_SQLITE', '0')) + 1):
+    DATABASES[f'shard_{_indice}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'db_shard_{_indice}.sqlite3',
+    }
+    SHARDS.append(f'shard_{_indice}')
+
+DATABASE_ROUTERS = ['core.shards.RoteadorShards']
+
+# Particionamento mensal de core_calculocredito por data_coleta (apenas PostgreSQL).
+# A conversão e a manutenção das partições são feitas pelo comando manter_particoes.
+CALCULO_CREDITO_PARTICIONADO = os.environ.get('CALCULO_CREDITO_PARTICIONADO', '0') == '1'
+CALCULO_CREDITO_MESES_FUTUROS = 3
+CALCULO_CREDITO_ESQUEMA_ARQUIVO = 'arquivo'
+
+# Arquivo frio colunar das coletas antigas (comando arquivar_calculos)
+ARQUIVO_FRIO_DIR = os.environ.get('ARQUIVO_FRIO_DIR', os.path.join(BASE_DIR, 'arquivo_frio'))
+ARQUIVO_FRIO_MESES_QUENTES = 24  # meses mantidos no banco
+
+# Ingestão assíncrona das coletas: o POST grava em um log local (com fsync em
+# grupo) e responde 202; o comando drenar_ingestao grava no banco em lotes
+INGESTAO_ASSINCRONA = os.environ.get('INGESTAO_ASSINCRONA', '0') == '1'
+INGESTAO_DIR = os.environ.get('INGESTAO_DIR', os.path.join(BASE_DIR, 'ingestao'))
+INGESTAO_TAMANHO_LOTE = 1000
+
+# Exclusão de condomínios/tipos de resíduo em segundo plano, em lotes de coletas.
+# Com EXCLUSAO_EM_THREAD desligado as tarefas ficam para o comando processar_exclusoes
+EXCLUSAO_EM_THREAD = os.environ.get('EXCLUSAO_EM_THREAD', '1') == '1'
+EXCLUSAO_TAMANHO_LOTE = 5000
+# Tarefa 'excluindo' sem progresso por esse tempo é considerada interrompida
+# e pode ser retomada pelo processar_exclusoes
+EXCLUSAO_ABANDONO_SEGUNDOS = 600
+
+# Detecção de pesos suspeitos por condomínio/tipo de resíduo
+ESTATISTICA_MIN_AMOSTRAS = 30
+ESTATISTICA_LIMITE_Z = 4
+ESTATISTICA_FATOR_MEDIANA = 10
+
+# Preço do crédito de carbono (USD/t) para dias sem PrecoCarbono cadastrado e
+# tempo de cache das vigências em memória
+PRECO_CARBONO_PADRAO_USD = float(os.environ.get('PRECO_CARBONO_PADRAO_USD', '60'))
+PRECO_CARBONO_CACHE_SEGUNDOS = 300
+
+# Benchmarks entre condomínios usados nas recomendações (comando calcular_benchmarks)
+BENCHMARK_JANELA_DIAS = 365
+BENCHMARK_MIN_CONDOMINIOS = 5
+BENCHMARK_CACHE_SEGUNDOS = 300
+# Máximo de condomínios com a data da primeira coleta em cache por processo
+BENCHMARK_PRIMEIRAS_CACHE = 10000
+
+# Broker dos eventos em tempo real (SSE em /api/v1/eventos/condominios/<id>/ no ASGI).
+# O broker em memória só entrega eventos publicados no mesmo processo; com
+# INGESTAO_ASSINCRONA ou vários workers, use core.eventos.BrokerPostgres
+EVENTOS_BROKER = os.environ.get('EVENTOS_BROKER', 'core.eventos.BrokerMemoria')
+# Intervalo mínimo entre dois recálculos dos totais de um condomínio nos painéis
+EVENTOS_INTERVALO_TOTAIS = float(os.environ.get('EVENTOS_INTERVALO_TOTAIS', '1'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
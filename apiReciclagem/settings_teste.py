@@ -0,0 +1,9 @@
+"""
+Configurações usadas por `manage.py test`: as de produção mais um segundo
+shard SQLite (SHARDS_SQLITE=1), exigido pelos testes de sharding
+"""
+import os
+
+os.environ.setdefault('SHARDS_SQLITE', '1')
+
+from .settings import *  # noqa: E402,F401,F403
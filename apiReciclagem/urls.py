@@ -28,6 +28,7 @@ router.register(r'tipos-residuos', views.TipoResiduoViewSet)
 router.register(r'condominios', views.CondominioViewSet)
 router.register(r'parametros-calculo', views.ParametroCalculoViewSet)
 router.register(r'calculos-credito', views.CalculoCreditoViewSet)
+router.register(r'tarefas-exclusao', views.TarefaExclusaoViewSet)
 
 
 urlpatterns = [
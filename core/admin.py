@@ -1,13 +1,38 @@
 from django.contrib import admin
-from .models import TipoResiduo, CalculoCredito, Condominio, ParametroCalculo
+from django.contrib import messages
+from .models import TipoResiduo, CalculoCredito, Condominio, ParametroCalculo, PrecoCarbono, TarefaExclusao
+from . import exclusao
+
+class ExclusaoEmSegundoPlanoAdmin(admin.ModelAdmin):
+    """
+    Exclui via TarefaExclusao em vez do CASCADE do Django, que carregaria
+    todas as coletas na confirmação e na exclusão
+    """
+    def get_deleted_objects(self, objs, request):
+        # Não lista as coletas dependentes na página de confirmação
+        objetos = list(objs)
+        contagem = {self.model._meta.verbose_name_plural: len(objetos)}
+        return [str(obj) for obj in objetos], contagem, set(), []
+    
+    def delete_model(self, request, obj):
+        tarefa = exclusao.agendar_exclusao(obj)
+        self.message_user(
+            request,
+            f'Exclusão de "{obj}" agendada; acompanhe em Tarefas de Exclusão (#{tarefa.pk}).',
+            messages.INFO
+        )
+    
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            self.delete_model(request, obj)
 
 @admin.register(TipoResiduo)
-class TipoResiduoAdmin(admin.ModelAdmin):
+class TipoResiduoAdmin(ExclusaoEmSegundoPlanoAdmin):
     list_display = ['nome', 'descricao']
     search_fields = ['nome']
 
 @admin.register(Condominio)
-class CondominioAdmin(admin.ModelAdmin):
+class CondominioAdmin(ExclusaoEmSegundoPlanoAdmin):
     list_display = ['nome', 'endereco', 'numero_apartamentos']
     search_fields = ['nome', 'endereco']
 
@@ -16,6 +41,11 @@ class ParametroCalculoAdmin(admin.ModelAdmin):
     list_display = ['tipo_residuo', 'fator_emissao_padrao', 'eficiencia_reciclagem']
     list_select_related = ['tipo_residuo']
 
+@admin.register(PrecoCarbono)
+class PrecoCarbonoAdmin(admin.ModelAdmin):
+    list_display = ['vigente_de', 'vigente_ate', 'preco_tonelada_usd']
+    date_hierarchy = 'vigente_de'
+
 @admin.register(CalculoCredito)
 class CalculoCreditoAdmin(admin.ModelAdmin):
     list_display = ['condominio', 'tipo_residuo', 'data_coleta', 'peso_residuo', 
@@ -35,4 +65,14 @@ class CalculoCreditoAdmin(admin.ModelAdmin):
             'fields': ('custo_descarte_atual', 'custo_reciclagem'),
             'classes': ('collapse',),
         }),
-    )
\ No newline at end of file
+    )
+
+@admin.register(TarefaExclusao)
+class TarefaExclusaoAdmin(admin.ModelAdmin):
+    list_display = ['descricao', 'modelo', 'status', 'excluidos', 'total', 'progresso', 'atualizado_em']
+    list_filter = ['status', 'modelo']
+    readonly_fields = ['modelo', 'objeto_id', 'descricao', 'status', 'total', 'excluidos',
+                       'erro', 'criado_em', 'atualizado_em']
+    
+    def has_add_permission(self, request):
+        return False
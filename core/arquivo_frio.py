@@ -0,0 +1,420 @@
+"""
+Arquivo frio colunar de CalculoCredito
+
+Cada mês fechado é gravado em uma pasta AAAA-MM dentro de ARQUIVO_FRIO_DIR, com
+um arquivo binário por coluna (valores de tamanho fixo) e um manifesto JSON.
+As linhas ficam ordenadas por (condominio_id, data_coleta) e o manifesto guarda
+a faixa de linhas de cada condomínio e os totais do mês por (condomínio, tipo),
+então a leitura mapeia em memória (mmap) só as colunas necessárias e só percorre
+as linhas dos meses parcialmente cobertos pelo período consultado.
+"""
+import heapq
+import json
+import math
+import mmap
+import os
+import shutil
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+
+from . import precos, shards
+from .ingestao import sincronizar_diretorio
+from .models import CalculoCredito
+
+EPOCA = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+NULO_INTEIRO = -2 ** 63
+
+# coluna -> código de tipo do módulo array ('q' = int64, 'd' = float64, 'b' = int8)
+COLUNAS = {
+    'id': 'q',
+    'condominio_id': 'q',
+    'tipo_residuo_id': 'q',
+    'data_coleta': 'q',  # microssegundos desde a época (UTC)
+    'peso_residuo': 'd',
+    'emissao_carbono_atual': 'd',
+    'emissao_carbono_reciclagem': 'd',
+    'economia_carbono': 'd',
+    'custo_descarte_atual': 'q',  # centavos
+    'custo_reciclagem': 'q',  # centavos
+    'suspeito': 'b',  # 1 = peso suspeito, fora dos totais
+}
+
+INDICE = {coluna: indice for indice, coluna in enumerate(COLUNAS)}
+
+# Linhas acumuladas por coluna antes de cada escrita em disco
+TAMANHO_BUFFER = 65536
+
+# nome do total no relatório -> coluna somada
+TOTAIS = {
+    'peso_total': 'peso_residuo',
+    'emissao_total': 'emissao_carbono_atual',
+    'emissao_reciclagem_total': 'emissao_carbono_reciclagem',
+    'economia_total': 'economia_carbono',
+}
+
+
+def diretorio_padrao():
+    return Path(settings.ARQUIVO_FRIO_DIR)
+
+
+def para_microssegundos(data):
+    return (data - EPOCA) // timedelta(microseconds=1)
+
+
+def limites_mes(mes):
+    """Retorna (início, início do mês seguinte) em UTC para uma data qualquer do mês"""
+    inicio = datetime(mes.year, mes.month, 1, tzinfo=dt_timezone.utc)
+    if mes.month == 12:
+        return inicio, inicio.replace(year=mes.year + 1, month=1)
+    return inicio, inicio.replace(month=mes.month + 1)
+
+
+def somar(atual, valor):
+    """Soma ignorando nulos, como o SUM do banco"""
+    if valor is None:
+        return atual
+    return valor if atual is None else atual + valor
+
+
+# total da economia valorada pelo preço do carbono do dia de cada coleta (USD)
+VALOR = 'valor_economia_usd'
+
+# coletas com peso suspeito: ficam fora dos totais e são apenas contadas
+SUSPEITOS = 'suspeitos'
+
+
+def totais_vazios():
+    return dict.fromkeys(TOTAIS)
+
+
+def _decimal_para_centavos(valor):
+    return NULO_INTEIRO if valor is None else int(round(valor * 100))
+
+
+def _float_ou_nan(valor):
+    return math.nan if valor is None else valor
+
+
+def _nan_para_none(valor):
+    return None if math.isnan(valor) else valor
+
+
+class MesArquivado:
+    """Acesso somente leitura às colunas de um mês arquivado via mmap"""
+
+    def __init__(self, pasta):
+        self.pasta = Path(pasta)
+        with open(self.pasta / 'manifesto.json', encoding='utf-8') as arquivo:
+            self.manifesto = json.load(arquivo)
+        if self.manifesto['byteorder'] != sys.byteorder:
+            raise ValueError(f'Arquivo {self.pasta} gravado com outra ordem de bytes')
+        ano, mes = map(int, self.manifesto['mes'].split('-'))
+        self.inicio, self.fim = limites_mes(datetime(ano, mes, 1))
+        self._mapas = []
+        self._colunas = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+    def coluna(self, nome):
+        if nome not in self._colunas and nome not in self.manifesto['colunas']:
+            # Coluna criada depois que o mês foi arquivado: todas as linhas valem zero
+            tipo = COLUNAS[nome]
+            vazia = bytes(self.manifesto['linhas'] * array(tipo).itemsize)
+            self._colunas[nome] = memoryview(vazia).cast(tipo)
+        if nome not in self._colunas:
+            with open(self.pasta / f'{nome}.bin', 'rb') as arquivo:
+                mapa = mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapas.append(mapa)
+            self._colunas[nome] = memoryview(mapa).cast(COLUNAS[nome])
+        return self._colunas[nome]
+
+    def fechar(self):
+        for visao in self._colunas.values():
+            visao.release()
+        for mapa in self._mapas:
+            mapa.close()
+        self._colunas, self._mapas = {}, []
+
+    def faixa_condominio(self, condominio_id):
+        return self.manifesto['condominios'].get(str(condominio_id))
+
+    def tuplas(self):
+        """Linhas do mês, na ordem gravada, como tuplas na ordem de COLUNAS"""
+        colunas = [self.coluna(nome) for nome in COLUNAS]
+        for i in range(self.manifesto['linhas']):
+            yield tuple(valores[i] for valores in colunas)
+
+
+def meses_arquivados(diretorio=None, inicio=None, fim=None):
+    """Pastas dos meses arquivados que se sobrepõem ao período [inicio, fim]"""
+    diretorio = Path(diretorio or diretorio_padrao())
+    if not diretorio.is_dir():
+        return []
+    pastas = []
+    for pasta in sorted(diretorio.iterdir()):
+        if pasta.name.startswith('.') or not (pasta / 'manifesto.json').exists():
+            continue
+        ano, mes = pasta.name.split('-')
+        mes_inicio, mes_fim = limites_mes(datetime(int(ano), int(mes), 1))
+        if inicio is not None and mes_fim <= inicio:
+            continue
+        if fim is not None and mes_inicio > fim:
+            continue
+        pastas.append(pasta)
+    return pastas
+
+
+def agregar(condominio_ids=None, inicio=None, fim=None, diretorio=None, valorar=False):
+    """
+    Totais arquivados por (condominio_id, tipo_residuo_id) no período
+    [inicio, fim]. `condominio_ids` None considera todos os condomínios.
+    Com `valorar`, inclui também VALOR (economia a preço de cada dia).
+    Coletas suspeitas não entram nos totais, só na contagem SUSPEITOS.
+    """
+    resultado = {}
+    filtro = None if condominio_ids is None else {str(c) for c in condominio_ids}
+    intervalos = precos.obter_intervalos() if valorar else None
+
+    def acumular(chave, valores):
+        totais = resultado.setdefault(chave, totais_vazios())
+        for nome, valor in valores.items():
+            totais[nome] = somar(totais.get(nome), valor)
+
+    for pasta in meses_arquivados(diretorio, inicio, fim):
+        with MesArquivado(pasta) as mes:
+            mes_completo = (inicio is None or inicio <= mes.inicio) and (fim is None or fim >= mes.fim)
+            preco_mes = intervalos.preco_constante(mes.inicio, mes.fim) if valorar else None
+            if mes_completo and (not valorar or preco_mes is not None):
+                # Mês inteiro dentro do período (e com um só preço): usa os totais do manifesto
+                for item in mes.manifesto['agregados']:
+                    if filtro is None or str(item['condominio_id']) in filtro:
+                        valores = {nome: item[nome] for nome in TOTAIS}
+                        valores[SUSPEITOS] = item.get(SUSPEITOS, 0)
+                        if valorar and item['economia_total'] is not None:
+                            valores[VALOR] = item['economia_total'] / 1000 * preco_mes
+                        acumular((item['condominio_id'], item['tipo_residuo_id']), valores)
+                continue
+
+            datas = mes.coluna('data_coleta')
+            tipos = mes.coluna('tipo_residuo_id')
+            suspeitos = mes.coluna('suspeito')
+            medidas = {nome: mes.coluna(coluna) for nome, coluna in TOTAIS.items()}
+            inicio_us = para_microssegundos(inicio) if inicio is not None else None
+            fim_us = para_microssegundos(fim) if fim is not None else None
+            chaves = filtro if filtro is not None else mes.manifesto['condominios'].keys()
+            for chave in chaves:
+                faixa = mes.faixa_condominio(chave)
+                if faixa is None:
+                    continue
+                primeira, ultima = faixa
+                if inicio_us is not None:
+                    primeira = bisect_left(datas, inicio_us, primeira, ultima)
+                if fim_us is not None:
+                    ultima = bisect_right(datas, fim_us, primeira, ultima)
+                for i in range(primeira, ultima):
+                    if suspeitos[i]:
+                        acumular((int(chave), tipos[i]), {SUSPEITOS: 1})
+                        continue
+                    valores = {nome: _nan_para_none(medida[i]) for nome, medida in medidas.items()}
+                    if valorar and valores['economia_total'] is not None:
+                        instante = EPOCA + timedelta(microseconds=datas[i])
+                        valores[VALOR] = valores['economia_total'] / 1000 * intervalos.preco_em(instante)
+                    acumular((int(chave), tipos[i]), valores)
+    return resultado
+
+
+def primeiras_coletas(condominio_ids, diretorio=None):
+    """Data da coleta arquivada mais antiga de cada condomínio"""
+    pendentes = {str(c) for c in condominio_ids}
+    resultado = {}
+    for pasta in meses_arquivados(diretorio):
+        if not pendentes:
+            break
+        with MesArquivado(pasta) as mes:
+            # As linhas de cada condomínio estão ordenadas por data
+            for chave in [chave for chave in pendentes if mes.faixa_condominio(chave)]:
+                primeira, _ = mes.faixa_condominio(chave)
+                resultado[int(chave)] = EPOCA + timedelta(microseconds=mes.coluna('data_coleta')[primeira])
+                pendentes.discard(chave)
+    return resultado
+
+
+class _EscritorColunas:
+    """
+    Grava as colunas de um mês incrementalmente, acumulando cada uma em um
+    array de tamanho limitado, e calcula as faixas por condomínio e os
+    agregados do manifesto durante a gravação
+    """
+
+    def __init__(self, pasta, mes):
+        self.pasta = pasta
+        self.mes = mes
+        self.arquivos = {nome: open(pasta / f'{nome}.bin', 'wb') for nome in COLUNAS}
+        self.buffers = [array(tipo) for tipo in COLUNAS.values()]
+        self.linhas = 0
+        self.condominios = {}
+        self.agregados = {}
+
+    def anexar(self, linha):
+        for buffer, valor in zip(self.buffers, linha):
+            buffer.append(valor)
+        condominio_id, tipo_residuo_id = linha[INDICE['condominio_id']], linha[INDICE['tipo_residuo_id']]
+        faixa = self.condominios.setdefault(str(condominio_id), [self.linhas, self.linhas])
+        self.linhas += 1
+        faixa[1] = self.linhas
+        totais = self.agregados.setdefault((condominio_id, tipo_residuo_id), {**totais_vazios(), SUSPEITOS: 0})
+        if linha[INDICE['suspeito']]:
+            totais[SUSPEITOS] += 1
+        else:
+            for nome, coluna in TOTAIS.items():
+                totais[nome] = somar(totais[nome], _nan_para_none(linha[INDICE[coluna]]))
+        if len(self.buffers[0]) >= TAMANHO_BUFFER:
+            self.descarregar()
+
+    def descarregar(self):
+        for buffer, arquivo in zip(self.buffers, self.arquivos.values()):
+            buffer.tofile(arquivo)
+            del buffer[:]
+
+    def fechar(self):
+        self.descarregar()
+        for arquivo in self.arquivos.values():
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+            arquivo.close()
+
+    def gravar_manifesto(self):
+        manifesto = {
+            'mes': self.mes,
+            'linhas': self.linhas,
+            'byteorder': sys.byteorder,
+            'colunas': COLUNAS,
+            'condominios': self.condominios,
+            'agregados': [
+                {'condominio_id': condominio_id, 'tipo_residuo_id': tipo_residuo_id, **totais}
+                for (condominio_id, tipo_residuo_id), totais in self.agregados.items()
+            ],
+        }
+        with open(self.pasta / 'manifesto.json', 'w', encoding='utf-8') as arquivo:
+            json.dump(manifesto, arquivo)
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+
+
+def _linhas_do_banco(alias, inicio, fim, ids, tamanho_lote):
+    """
+    Coletas do mês no shard, ordenadas como no arquivo, convertidas para as
+    colunas; os ids lidos são anotados em `ids` para a exclusão posterior
+    """
+    consulta = CalculoCredito.objects.using(alias).filter(
+        data_coleta__gte=inicio, data_coleta__lt=fim
+    ).order_by('condominio_id', 'data_coleta', 'id').values_list(*COLUNAS)
+    for valores in consulta.iterator(chunk_size=tamanho_lote):
+        linha = []
+        for (coluna, tipo), valor in zip(COLUNAS.items(), valores):
+            if coluna == 'data_coleta':
+                valor = para_microssegundos(valor)
+            elif coluna.startswith('custo_'):
+                valor = _decimal_para_centavos(valor)
+            elif tipo == 'd':
+                valor = _float_ou_nan(valor)
+            elif tipo == 'b':
+                valor = int(valor)
+            linha.append(valor)
+        ids.append(linha[INDICE['id']])
+        yield tuple(linha)
+
+
+def _chave_ordem(linha):
+    return linha[INDICE['condominio_id']], linha[INDICE['data_coleta']], linha[INDICE['id']]
+
+
+def _publicar(temporaria, pasta_final):
+    # As entradas das colunas na pasta temporária e a troca de nome na pasta
+    # pai precisam estar no disco antes de as linhas saírem do banco
+    sincronizar_diretorio(temporaria)
+    antiga = pasta_final.with_name(f'.{pasta_final.name}.old')
+    if pasta_final.exists():
+        pasta_final.rename(antiga)
+    temporaria.rename(pasta_final)
+    sincronizar_diretorio(pasta_final.parent)
+    if antiga.exists():
+        shutil.rmtree(antiga, ignore_errors=True)
+        sincronizar_diretorio(pasta_final.parent)
+
+
+def arquivar_mes(mes, diretorio=None, tamanho_lote=5000):
+    """
+    Move as coletas do mês de `mes` para o arquivo frio e as remove do banco.
+    Se o mês já estiver arquivado, as linhas novas são mescladas ao arquivo;
+    linhas já arquivadas (ex.: execução interrompida antes da exclusão) não
+    são duplicadas. Retorna a quantidade de linhas removidas do banco.
+
+    As linhas de cada shard e as já arquivadas chegam ordenadas e são
+    intercaladas direto para os arquivos das colunas, sem carregar o mês
+    inteiro em memória; só os ids lidos de cada shard são guardados (int64).
+    """
+    diretorio = Path(diretorio or diretorio_padrao())
+    inicio, fim = limites_mes(mes)
+    pasta = diretorio / f'{inicio:%Y-%m}'
+    aliases = shards.aliases()
+    if not any(
+        CalculoCredito.objects.using(alias).filter(data_coleta__gte=inicio, data_coleta__lt=fim).exists()
+        for alias in aliases
+    ):
+        return 0
+
+    temporaria = pasta.with_name(f'.{pasta.name}.tmp')
+    if not diretorio.exists():
+        diretorio.mkdir(parents=True, exist_ok=True)
+        sincronizar_diretorio(diretorio.parent)
+    shutil.rmtree(temporaria, ignore_errors=True)
+    temporaria.mkdir()
+
+    # Os ids são únicos entre os shards (faixas separadas), então as linhas de
+    # todos eles vão para o mesmo mês do arquivo
+    ids_por_shard = {alias: array('q') for alias in aliases}
+    existente = MesArquivado(pasta) if (pasta / 'manifesto.json').exists() else None
+    escritor = _EscritorColunas(temporaria, pasta.name)
+    try:
+        fontes = [
+            _linhas_do_banco(alias, inicio, fim, ids, tamanho_lote)
+            for alias, ids in ids_por_shard.items()
+        ]
+        if existente is not None:
+            fontes.append(existente.tuplas())
+        ultimo_id = None
+        for linha in heapq.merge(*fontes, key=_chave_ordem):
+            # A mesma coleta no banco e no arquivo aparece em sequência
+            if linha[INDICE['id']] != ultimo_id:
+                escritor.anexar(linha)
+                ultimo_id = linha[INDICE['id']]
+    finally:
+        escritor.fechar()
+        if existente is not None:
+            existente.fechar()
+
+    linhas_existentes = existente.manifesto['linhas'] if existente is not None else 0
+    lidas = sum(len(ids) for ids in ids_por_shard.values())
+    if escritor.linhas > linhas_existentes:
+        escritor.gravar_manifesto()
+        _publicar(temporaria, pasta)
+    else:
+        # Nada novo: as linhas do banco já estavam todas arquivadas
+        shutil.rmtree(temporaria, ignore_errors=True)
+
+    for alias, ids in ids_por_shard.items():
+        with transaction.atomic(using=alias):
+            for i in range(0, len(ids), tamanho_lote):
+                CalculoCredito.objects.using(alias).filter(id__in=ids[i:i + tamanho_lote].tolist()).delete()
+    return lidas
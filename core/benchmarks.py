@@ -0,0 +1,182 @@
+"""
+Benchmarks da economia de carbono por tipo de resíduo entre condomínios
+
+calcular() agrega a janela BENCHMARK_JANELA_DIAS de todos os condomínios
+(consultas agrupadas em paralelo nos shards mais o arquivo frio), normaliza a
+economia por apartamento a cada 30 dias e grava, por tipo, os valores nos
+percentis 0, 5, ..., 100. As recomendações consultam esses pontos em memória
+com bisect, sem agregar os demais condomínios a cada relatório.
+
+O cálculo também grava a primeira coleta de cada condomínio (PrimeiraColeta),
+que os relatórios sem data_inicio leem do cache em vez de consultar os shards
+e o arquivo frio. Os relatórios só leem: condomínios ainda sem registro são
+consultados e ficam apenas no cache do processo até o próximo cálculo.
+"""
+import threading
+import time as relogio
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import relatorios
+from .models import BenchmarkResiduo, Condominio, PrimeiraColeta
+
+PASSO_PERCENTIL = 5
+
+_cache = None
+_cache_trava = threading.Lock()
+
+# condominio_id -> data da primeira coleta, limitado a BENCHMARK_PRIMEIRAS_CACHE
+# entradas (as menos usadas recentemente saem primeiro)
+_primeiras = OrderedDict()
+
+
+def metrica(economia_kg, numero_apartamentos, dias):
+    """Economia (kg CO2) por apartamento a cada 30 dias"""
+    return (economia_kg or 0) / numero_apartamentos / dias * 30
+
+
+def pontos_percentis(valores):
+    """Valores nos percentis 0, PASSO_PERCENTIL, ..., 100 (interpolação linear)"""
+    ordenados = sorted(valores)
+    ultimo = len(ordenados) - 1
+    pontos = []
+    for percentil in range(0, 101, PASSO_PERCENTIL):
+        posicao = percentil / 100 * ultimo
+        indice = int(posicao)
+        proximo = ordenados[min(indice + 1, ultimo)]
+        pontos.append(ordenados[indice] + (proximo - ordenados[indice]) * (posicao - indice))
+    return pontos
+
+
+class Benchmark:
+    """Distribuição de um tipo de resíduo, consultada por bisect"""
+
+    def __init__(self, pontos, condominios):
+        self.pontos = pontos
+        self.condominios = condominios
+
+    @property
+    def mediana(self):
+        return self.pontos[len(self.pontos) // 2]
+
+    def percentil(self, valor):
+        """Percentil (0 a 100) em que `valor` fica na distribuição"""
+        indice = bisect_right(self.pontos, valor)
+        if indice == 0:
+            return 0.0
+        if indice == len(self.pontos):
+            return 100.0
+        anterior, seguinte = self.pontos[indice - 1], self.pontos[indice]
+        fracao = (valor - anterior) / (seguinte - anterior) if seguinte > anterior else 0
+        return (indice - 1 + fracao) * PASSO_PERCENTIL
+
+
+def calcular(janela_dias=None, fim=None):
+    """
+    Recalcula e grava os benchmarks de todos os tipos de resíduo. Entram os
+    condomínios com coletas na janela; um tipo que o condomínio não recicla
+    conta como economia zero.
+    """
+    janela_dias = janela_dias or settings.BENCHMARK_JANELA_DIAS
+    fim = fim or timezone.now()
+    inicio = fim - timedelta(days=janela_dias)
+
+    apartamentos = dict(
+        Condominio.objects.filter(numero_apartamentos__gte=1).values_list('id', 'numero_apartamentos')
+    )
+    agregados = relatorios.agregar_por_tipo(list(apartamentos), inicio, fim)
+    ativos = {condominio_id for condominio_id, _ in agregados}
+    # Condomínios que começaram a coletar dentro da janela são normalizados
+    # pelo tempo desde a primeira coleta
+    primeiras = relatorios.primeiras_coletas(ativos)
+    dias = {
+        condominio_id: relatorios.dias_do_periodo(max(inicio, primeiras.get(condominio_id, inicio)), fim)
+        for condominio_id in ativos
+    }
+
+    benchmarks = []
+    for tipo_residuo_id in {tipo for _, tipo in agregados}:
+        valores = [
+            metrica(
+                agregados.get((condominio_id, tipo_residuo_id), {}).get('economia_total'),
+                apartamentos[condominio_id],
+                dias[condominio_id],
+            )
+            for condominio_id in ativos
+        ]
+        if len(valores) < settings.BENCHMARK_MIN_CONDOMINIOS:
+            continue
+        benchmarks.append(BenchmarkResiduo(
+            tipo_residuo_id=tipo_residuo_id,
+            percentis=pontos_percentis(valores),
+            condominios=len(valores),
+            periodo_inicio=inicio,
+            periodo_fim=fim,
+        ))
+
+    with transaction.atomic():
+        BenchmarkResiduo.objects.all().delete()
+        BenchmarkResiduo.objects.bulk_create(benchmarks)
+        _gravar_primeiras(primeiras)
+    invalidar()
+    return benchmarks
+
+
+def obter():
+    """{nome do tipo de resíduo: Benchmark}, em cache por BENCHMARK_CACHE_SEGUNDOS"""
+    global _cache
+    with _cache_trava:
+        if _cache is None or relogio.monotonic() - _cache[0] > settings.BENCHMARK_CACHE_SEGUNDOS:
+            _cache = (relogio.monotonic(), {
+                benchmark.tipo_residuo.nome: Benchmark(benchmark.percentis, benchmark.condominios)
+                for benchmark in BenchmarkResiduo.objects.using('default').select_related('tipo_residuo')
+            })
+        return _cache[1]
+
+
+def _gravar_primeiras(primeiras):
+    PrimeiraColeta.objects.using('default').bulk_create(
+        [PrimeiraColeta(condominio_id=condominio_id, data=data) for condominio_id, data in primeiras.items()],
+        update_conflicts=True, unique_fields=['condominio'], update_fields=['data'],
+    )
+
+
+def primeiras_coletas(condominio_ids):
+    """
+    Data da primeira coleta de cada condomínio, em cache. Os que não estão no
+    cache são lidos de PrimeiraColeta; os que ainda não têm registro (começaram
+    a coletar depois do último calcular()) são consultados nos shards e no
+    arquivo frio, sem gravar: só calcular() grava PrimeiraColeta.
+    """
+    resultado = {}
+    with _cache_trava:
+        for condominio_id in condominio_ids:
+            if condominio_id in _primeiras:
+                _primeiras.move_to_end(condominio_id)
+                resultado[condominio_id] = _primeiras[condominio_id]
+    faltantes = [c for c in condominio_ids if c not in resultado]
+    if faltantes:
+        encontradas = dict(
+            PrimeiraColeta.objects.using('default').filter(condominio_id__in=faltantes).values_list('condominio_id', 'data')
+        )
+        sem_registro = [c for c in faltantes if c not in encontradas]
+        if sem_registro:
+            encontradas.update(relatorios.primeiras_coletas(sem_registro))
+        with _cache_trava:
+            _primeiras.update(encontradas)
+            while len(_primeiras) > settings.BENCHMARK_PRIMEIRAS_CACHE:
+                _primeiras.popitem(last=False)
+        resultado.update(encontradas)
+    return resultado
+
+
+def invalidar():
+    global _cache
+    with _cache_trava:
+        _cache = None
+        _primeiras.clear()
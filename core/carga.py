@@ -0,0 +1,319 @@
+"""
+Teste de carga HTTP de ponta a ponta (usado pelo comando teste_carga)
+
+Cada usuário virtual é uma thread com a própria conexão HTTP: faz login JWT e
+repete operações sorteadas conforme os pesos do perfil de tráfego (coletas dos
+caminhões, logins, relatórios e listagens). As latências são guardadas por
+endpoint para o cálculo de p50/p95/p99, vazão e taxa de erros. Só usa a
+biblioteca padrão, para rodar em qualquer máquina de deploy.
+"""
+import http.client
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+PERFIL_PADRAO = {
+    'coleta': 60,
+    'relatorio': 15,
+    'listagem': 15,
+    'login': 5,
+    'relatorio_lote': 5,
+}
+
+URL_LOGIN = '/api/auth/login/'
+
+
+class Resultados:
+    """Latências (ms), erros e códigos de status por endpoint"""
+
+    def __init__(self):
+        self._trava = threading.Lock()
+        self.latencias = {}
+        self.erros = {}
+        self.status = {}
+
+    def registrar(self, endpoint, latencia_ms, codigo):
+        erro = codigo is None or codigo >= 400
+        with self._trava:
+            self.latencias.setdefault(endpoint, []).append(latencia_ms)
+            self.erros[endpoint] = self.erros.get(endpoint, 0) + erro
+            contagem = self.status.setdefault(endpoint, {})
+            chave = str(codigo) if codigo is not None else 'falha'
+            contagem[chave] = contagem.get(chave, 0) + 1
+
+    def resumo(self, duracao):
+        """Métricas por endpoint, mais a linha 'total'"""
+        linhas = {}
+        todas = []
+        for endpoint in sorted(self.latencias):
+            latencias = self.latencias[endpoint]
+            todas.extend(latencias)
+            linhas[endpoint] = _metricas(latencias, self.erros[endpoint], duracao)
+            linhas[endpoint]['status'] = self.status[endpoint]
+        if todas:
+            linhas['total'] = _metricas(todas, sum(self.erros.values()), duracao)
+        return linhas
+
+
+def percentil(ordenados, p):
+    """Percentil pelo método do posto mais próximo"""
+    if not ordenados:
+        return None
+    posto = max(1, -(-len(ordenados) * p // 100))
+    return ordenados[int(posto) - 1]
+
+
+def _metricas(latencias, erros, duracao):
+    ordenados = sorted(latencias)
+    return {
+        'requisicoes': len(ordenados),
+        'erros': erros,
+        'taxa_erros': erros / len(ordenados),
+        'vazao': len(ordenados) / duracao,
+        'p50': percentil(ordenados, 50),
+        'p95': percentil(ordenados, 95),
+        'p99': percentil(ordenados, 99),
+        'max': ordenados[-1],
+    }
+
+
+class Cliente:
+    """Conexão HTTP (keep-alive quando o servidor permite) de um usuário virtual"""
+
+    def __init__(self, url_base, timeout=30):
+        partes = urlsplit(url_base)
+        classe = http.client.HTTPSConnection if partes.scheme == 'https' else http.client.HTTPConnection
+        self.prefixo = partes.path.rstrip('/')
+        self.conexao = classe(partes.hostname, partes.port, timeout=timeout)
+        self.token = None
+
+    def requisitar(self, metodo, caminho, corpo=None):
+        """Retorna (status, dados, latência em ms); status None em falha de conexão"""
+        cabecalhos = {'Accept': 'application/json'}
+        if corpo is not None:
+            corpo = json.dumps(corpo).encode()
+            cabecalhos['Content-Type'] = 'application/json'
+        if self.token:
+            cabecalhos['Authorization'] = f'Bearer {self.token}'
+        inicio = time.perf_counter()
+        try:
+            self.conexao.request(metodo, self.prefixo + caminho, body=corpo, headers=cabecalhos)
+            resposta = self.conexao.getresponse()
+            conteudo = resposta.read()
+        except (OSError, http.client.HTTPException):
+            self.conexao.close()
+            return None, None, (time.perf_counter() - inicio) * 1000
+        latencia = (time.perf_counter() - inicio) * 1000
+        try:
+            dados = json.loads(conteudo) if conteudo else None
+        except ValueError:
+            dados = None
+        return resposta.status, dados, latencia
+
+    def fechar(self):
+        self.conexao.close()
+
+
+class UsuarioVirtual(threading.Thread):
+    """Executa o perfil de tráfego até `fim` (relógio monotônico)"""
+
+    def __init__(self, carga, numero):
+        super().__init__(name=f'carga-{numero}', daemon=True)
+        self.carga = carga
+        self.aleatorio = random.Random(numero)
+        self.cliente = Cliente(carga.url_base)
+
+    def chamar(self, endpoint, metodo, caminho, corpo=None):
+        codigo, dados, latencia = self.cliente.requisitar(metodo, caminho, corpo)
+        self.carga.resultados.registrar(endpoint, latencia, codigo)
+        return codigo, dados
+
+    def login(self):
+        self.cliente.token = None
+        codigo, dados = self.chamar('POST api/auth/login/', 'POST', URL_LOGIN, {
+            'username': self.carga.usuario,
+            'password': self.carga.senha,
+        })
+        if codigo == 200 and dados:
+            self.cliente.token = dados.get('access')
+
+    def coleta(self):
+        self.chamar('POST calculos-credito/', 'POST', '/api/v1/calculos-credito/', {
+            'condominio': self.aleatorio.choice(self.carga.condominios),
+            'tipo_residuo': self.aleatorio.choice(self.carga.tipos_residuo),
+            'peso_residuo': round(self.aleatorio.lognormvariate(3.5, 0.5), 2),
+        })
+
+    def relatorio(self):
+        condominio = self.aleatorio.choice(self.carga.condominios)
+        self.chamar('GET relatorio-economia/', 'GET', f'/api/v1/relatorio-economia/?condominio_id={condominio}')
+
+    def relatorio_lote(self):
+        self.chamar('GET relatorio-economia/lote/', 'GET', '/api/v1/relatorio-economia/lote/')
+
+    def listagem(self):
+        condominio = self.aleatorio.choice(self.carga.condominios)
+        self.chamar('GET calculos-credito/', 'GET', f'/api/v1/calculos-credito/?condominio={condominio}')
+
+    def run(self):
+        operacoes = list(self.carga.perfil)
+        pesos = [self.carga.perfil[operacao] for operacao in operacoes]
+        try:
+            self.login()
+            while time.monotonic() < self.carga.fim:
+                operacao = self.aleatorio.choices(operacoes, pesos)[0]
+                if operacao != 'login' and not self.cliente.token:
+                    operacao = 'login'
+                getattr(self, operacao)()
+                if self.carga.pausa:
+                    time.sleep(self.carga.pausa)
+        finally:
+            self.cliente.fechar()
+
+
+class Carga:
+    """Configuração e execução de uma rodada de carga"""
+
+    def __init__(self, url_base, usuario, senha, perfil=None, usuarios=8, duracao=30, pausa=0):
+        self.url_base = url_base
+        self.usuario = usuario
+        self.senha = senha
+        self.perfil = perfil or PERFIL_PADRAO
+        self.usuarios = usuarios
+        self.duracao = duracao
+        self.pausa = pausa
+        self.resultados = Resultados()
+        self.condominios = []
+        self.tipos_residuo = []
+        self.fim = None
+
+    def descobrir_dados(self):
+        """Condomínios e tipos de resíduo (com parâmetros de cálculo) usados nas requisições"""
+        cliente = Cliente(self.url_base)
+        try:
+            codigo, dados, _ = cliente.requisitar('POST', URL_LOGIN, {'username': self.usuario, 'password': self.senha})
+            if codigo != 200 or not dados or not dados.get('access'):
+                raise RuntimeError(f'Login de {self.usuario} falhou (status {codigo}).')
+            cliente.token = dados['access']
+            _, condominios, _ = cliente.requisitar('GET', '/api/v1/condominios/')
+            _, parametros, _ = cliente.requisitar('GET', '/api/v1/parametros-calculo/')
+        finally:
+            cliente.fechar()
+        self.condominios = [condominio['id'] for condominio in condominios or []]
+        self.tipos_residuo = [parametro['tipo_residuo'] for parametro in parametros or []]
+        if not self.condominios or not self.tipos_residuo:
+            raise RuntimeError('É preciso ao menos um condomínio e um tipo de resíduo com parâmetros de cálculo.')
+
+    def executar(self):
+        self.descobrir_dados()
+        inicio = time.monotonic()
+        self.fim = inicio + self.duracao
+        usuarios = [UsuarioVirtual(self, numero) for numero in range(self.usuarios)]
+        for usuario in usuarios:
+            usuario.start()
+        for usuario in usuarios:
+            usuario.join()
+        return self.resultados.resumo(time.monotonic() - inicio)
+
+
+def porta_livre():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def comando_servidor(servidor, porta, workers):
+    """Linha de comando para subir o servidor local escolhido"""
+    endereco = f'127.0.0.1:{porta}'
+    if servidor == 'runserver':
+        return [sys.executable, 'manage.py', 'runserver', endereco, '--noreload']
+    if servidor == 'gunicorn':
+        return [sys.executable, '-m', 'gunicorn', 'apiReciclagem.wsgi:application',
+                '--bind', endereco, '--workers', str(workers)]
+    if servidor == 'uvicorn':
+        return [sys.executable, '-m', 'uvicorn', 'apiReciclagem.asgi:application',
+                '--host', '127.0.0.1', '--port', str(porta), '--workers', str(workers),
+                '--no-access-log']
+    raise ValueError(f'Servidor desconhecido: {servidor}')
+
+
+def iniciar_servidor(servidor, porta, workers=1, log=None, timeout=60):
+    """Sobe o servidor local e espera a porta aceitar conexões"""
+    processo = subprocess.Popen(
+        comando_servidor(servidor, porta, workers),
+        cwd=settings.BASE_DIR,
+        env=os.environ.copy(),
+        stdout=log or subprocess.DEVNULL,
+        stderr=subprocess.STDOUT if log else subprocess.DEVNULL,
+    )
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f'{servidor} encerrou com código {processo.returncode} ao iniciar.')
+        try:
+            socket.create_connection(('127.0.0.1', porta), timeout=1).close()
+            return processo
+        except OSError:
+            time.sleep(0.2)
+    parar_servidor(processo)
+    raise RuntimeError(f'{servidor} não respondeu em {timeout}s.')
+
+
+def parar_servidor(processo):
+    processo.terminate()
+    try:
+        processo.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        processo.kill()
+        processo.wait()
+
+
+CODIGO_INICIALIZACAO = (
+    "import time; inicio = time.perf_counter(); import apiReciclagem.wsgi; "
+    "print(time.perf_counter() - inicio)"
+)
+
+
+def medir_inicializacao(repeticoes=5):
+    """
+    Tempo de importação de apiReciclagem.wsgi (o que cada worker paga ao
+    subir) e do processo inteiro, em processos novos. Retorna segundos.
+    Se a importação falhar, levanta RuntimeError com o stderr do processo.
+    """
+    ambiente = os.environ.copy()
+    ambiente.setdefault('DJANGO_SETTINGS_MODULE', 'apiReciclagem.settings')
+    importacao, processo = [], []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        try:
+            saida = subprocess.run(
+                [sys.executable, '-c', CODIGO_INICIALIZACAO],
+                cwd=settings.BASE_DIR, env=ambiente, capture_output=True, text=True, check=True,
+            )
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(
+                f'A importação de apiReciclagem.wsgi falhou (código {e.returncode}):\n{(e.stderr or "").strip()}'
+            )
+        processo.append(time.perf_counter() - inicio)
+        importacao.append(float(saida.stdout.strip().splitlines()[-1]))
+    return {
+        'importacao_wsgi': _resumo_tempos(importacao),
+        'processo': _resumo_tempos(processo),
+    }
+
+
+def _resumo_tempos(tempos):
+    return {
+        'min': min(tempos),
+        'mediana': statistics.median(tempos),
+        'max': max(tempos),
+    }
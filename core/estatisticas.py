@@ -0,0 +1,270 @@
+"""
+Estatísticas incrementais do peso das coletas por (condomínio, tipo de resíduo)
+
+Cada par guarda contagem, média e soma dos quadrados dos desvios (Welford) e um
+esboço de quantis com erro relativo limitado (buckets logarítmicos, no estilo
+DDSketch). Tudo é atualizado em O(1) por coleta e pode ser mesclado, o que
+permite aplicar os lotes da ingestão assíncrona e reconstruir em uma passada.
+Uma coleta editada tem o peso antigo retirado (Welford invertido) antes de o
+novo ser avaliado.
+
+Pesos muito fora da distribuição do par (ex.: 5000 kg digitado no lugar de
+50 kg) são marcados como suspeitos e não entram nas estatísticas.
+"""
+import math
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+
+from . import shards
+from .models import EstatisticaResiduo
+
+
+class EsbocoQuantis:
+    """Esboço mesclável de quantis com erro relativo `precisao`"""
+
+    def __init__(self, precisao=0.01, buckets=None, zeros=0):
+        self.precisao = precisao
+        self.gamma = (1 + precisao) / (1 - precisao)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets = buckets or {}
+        self.zeros = zeros
+
+    @property
+    def contagem(self):
+        return self.zeros + sum(self.buckets.values())
+
+    def adicionar(self, valor, quantidade=1):
+        if valor <= 0:
+            self.zeros += quantidade
+            return
+        indice = math.ceil(math.log(valor) / self._log_gamma)
+        self.buckets[indice] = self.buckets.get(indice, 0) + quantidade
+
+    def remover(self, valor, quantidade=1):
+        if valor <= 0:
+            self.zeros = max(self.zeros - quantidade, 0)
+            return
+        indice = math.ceil(math.log(valor) / self._log_gamma)
+        restante = self.buckets.get(indice, 0) - quantidade
+        if restante > 0:
+            self.buckets[indice] = restante
+        else:
+            self.buckets.pop(indice, None)
+
+    def mesclar(self, outro):
+        self.zeros += outro.zeros
+        for indice, quantidade in outro.buckets.items():
+            self.buckets[indice] = self.buckets.get(indice, 0) + quantidade
+
+    def quantil(self, q):
+        total = self.contagem
+        if not total:
+            return None
+        posicao = q * (total - 1)
+        acumulado = self.zeros
+        if posicao < acumulado:
+            return 0.0
+        for indice in sorted(self.buckets):
+            acumulado += self.buckets[indice]
+            if posicao < acumulado:
+                return 2 * self.gamma ** indice / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def para_dict(self):
+        return {
+            'precisao': self.precisao,
+            'zeros': self.zeros,
+            'buckets': {str(indice): quantidade for indice, quantidade in self.buckets.items()},
+        }
+
+    @classmethod
+    def de_dict(cls, dados):
+        if not dados:
+            return cls()
+        return cls(
+            precisao=dados['precisao'],
+            buckets={int(indice): quantidade for indice, quantidade in dados['buckets'].items()},
+            zeros=dados['zeros'],
+        )
+
+
+class Acumulador:
+    """Estado em memória das estatísticas de um par (condomínio, tipo)"""
+
+    def __init__(self, contagem=0, media=0.0, m2=0.0, esboco=None):
+        self.contagem = contagem
+        self.media = media
+        self.m2 = m2
+        self.esboco = esboco or EsbocoQuantis()
+
+    @classmethod
+    def de_modelo(cls, estatistica):
+        return cls(
+            estatistica.contagem,
+            estatistica.media,
+            estatistica.m2,
+            EsbocoQuantis.de_dict(estatistica.esboco),
+        )
+
+    def aplicar_em(self, estatistica):
+        estatistica.contagem = self.contagem
+        estatistica.media = self.media
+        estatistica.m2 = self.m2
+        estatistica.esboco = self.esboco.para_dict()
+
+    @property
+    def desvio_padrao(self):
+        if self.contagem < 2:
+            return 0.0
+        return math.sqrt(self.m2 / (self.contagem - 1))
+
+    def adicionar(self, valor):
+        self.contagem += 1
+        delta = valor - self.media
+        self.media += delta / self.contagem
+        self.m2 += delta * (valor - self.media)
+        self.esboco.adicionar(valor)
+
+    def remover(self, valor):
+        """Desfaz adicionar(valor)"""
+        if self.contagem <= 1:
+            self.contagem, self.media, self.m2 = 0, 0.0, 0.0
+        else:
+            media = (self.contagem * self.media - valor) / (self.contagem - 1)
+            self.m2 = max(self.m2 - (valor - media) * (valor - self.media), 0.0)
+            self.media = media
+            self.contagem -= 1
+        self.esboco.remover(valor)
+
+    def suspeito(self, valor):
+        """
+        Um peso é suspeito quando, com amostras suficientes, está a mais de
+        ESTATISTICA_LIMITE_Z desvios da média e a mais de
+        ESTATISTICA_FATOR_MEDIANA vezes (para cima ou para baixo) da mediana
+        """
+        if self.contagem < settings.ESTATISTICA_MIN_AMOSTRAS:
+            return False
+        desvio = self.desvio_padrao
+        if desvio and abs(valor - self.media) / desvio <= settings.ESTATISTICA_LIMITE_Z:
+            return False
+        mediana = self.esboco.quantil(0.5)
+        if not mediana:
+            return valor > 0
+        fator = settings.ESTATISTICA_FATOR_MEDIANA
+        return valor > mediana * fator or valor < mediana / fator
+
+
+def avaliar_peso(condominio_id, tipo_residuo_id, peso):
+    """Indica se o peso é suspeito sem alterar as estatísticas"""
+    alias = shards.shard_do_condominio(condominio_id)
+    estatistica = EstatisticaResiduo.objects.using(alias).filter(
+        condominio_id=condominio_id, tipo_residuo_id=tipo_residuo_id
+    ).first()
+    return estatistica is not None and Acumulador.de_modelo(estatistica).suspeito(peso)
+
+
+def registrar_peso(condominio_id, tipo_residuo_id, peso):
+    """
+    Avalia o peso e, se não for suspeito, o acrescenta às estatísticas do par.
+    Retorna True quando o peso é suspeito.
+    """
+    alias = shards.atribuir_shard(condominio_id)
+    with transaction.atomic(using=alias):
+        estatistica, _ = EstatisticaResiduo.objects.using(alias).select_for_update().get_or_create(
+            condominio_id=condominio_id, tipo_residuo_id=tipo_residuo_id
+        )
+        acumulador = Acumulador.de_modelo(estatistica)
+        if acumulador.suspeito(peso):
+            EstatisticaResiduo.objects.using(alias).filter(pk=estatistica.pk).update(suspeitos=F('suspeitos') + 1)
+            return True
+        acumulador.adicionar(peso)
+        acumulador.aplicar_em(estatistica)
+        estatistica.save(using=alias)
+        return False
+
+
+def corrigir_peso(anterior, condominio_id, tipo_residuo_id, peso):
+    """
+    Corrige as estatísticas de uma coleta editada: retira do par antigo o
+    peso anterior (ou a contagem de suspeito) e avalia o novo peso no par
+    atual. `anterior` é (condominio_id, tipo_residuo_id, peso, suspeito);
+    os dois pares ficam no mesmo shard. Retorna True quando o novo peso é suspeito.
+    """
+    condominio_anterior, tipo_anterior, peso_anterior, suspeito_anterior = anterior
+    par_anterior, par = (condominio_anterior, tipo_anterior), (condominio_id, tipo_residuo_id)
+    alias = shards.atribuir_shard(condominio_id)
+    with transaction.atomic(using=alias):
+        EstatisticaResiduo.objects.using(alias).get_or_create(
+            condominio_id=condominio_id, tipo_residuo_id=tipo_residuo_id
+        )
+        filtro = Q()
+        for condominio, tipo in {par_anterior, par}:
+            filtro |= Q(condominio_id=condominio, tipo_residuo_id=tipo)
+        # Trava os pares sempre na mesma ordem
+        linhas = {
+            (estatistica.condominio_id, estatistica.tipo_residuo_id): estatistica
+            for estatistica in EstatisticaResiduo.objects.using(alias).select_for_update().filter(filtro).order_by('pk')
+        }
+        acumuladores = {chave: Acumulador.de_modelo(estatistica) for chave, estatistica in linhas.items()}
+
+        if par_anterior in linhas:
+            if suspeito_anterior:
+                linhas[par_anterior].suspeitos = max(linhas[par_anterior].suspeitos - 1, 0)
+            else:
+                acumuladores[par_anterior].remover(peso_anterior)
+
+        suspeito = acumuladores[par].suspeito(peso)
+        if suspeito:
+            linhas[par].suspeitos += 1
+        else:
+            acumuladores[par].adicionar(peso)
+
+        for chave, estatistica in linhas.items():
+            acumuladores[chave].aplicar_em(estatistica)
+            estatistica.save(using=alias)
+        return suspeito
+
+
+def registrar_lote(calculos):
+    """
+    Acrescenta às estatísticas um lote de coletas já avaliadas (campo suspeito
+    preenchido), com uma leitura e uma gravação por par, no shard de cada condomínio
+    """
+    por_par = {}
+    for calculo in calculos:
+        por_par.setdefault((calculo.condominio_id, calculo.tipo_residuo_id), []).append(calculo)
+
+    for (condominio_id, tipo_residuo_id), coletas in por_par.items():
+        alias = shards.atribuir_shard(condominio_id)
+        with transaction.atomic(using=alias):
+            estatistica, _ = EstatisticaResiduo.objects.using(alias).select_for_update().get_or_create(
+                condominio_id=condominio_id, tipo_residuo_id=tipo_residuo_id
+            )
+            acumulador = Acumulador.de_modelo(estatistica)
+            for calculo in coletas:
+                if calculo.suspeito:
+                    estatistica.suspeitos += 1
+                else:
+                    acumulador.adicionar(calculo.peso_residuo)
+            acumulador.aplicar_em(estatistica)
+            estatistica.save(using=alias)
+
+
+def resumo(estatistica):
+    """Representação da estatística para a API"""
+    acumulador = Acumulador.de_modelo(estatistica)
+    return {
+        'condominio': estatistica.condominio_id,
+        'tipo_residuo': estatistica.tipo_residuo_id,
+        'tipo_residuo_nome': estatistica.tipo_residuo.nome,
+        'contagem': acumulador.contagem,
+        'media': acumulador.media,
+        'desvio_padrao': acumulador.desvio_padrao,
+        'p50': acumulador.esboco.quantil(0.5),
+        'p90': acumulador.esboco.quantil(0.9),
+        'p99': acumulador.esboco.quantil(0.99),
+        'suspeitos': estatistica.suspeitos,
+        'atualizado_em': estatistica.atualizado_em,
+    }
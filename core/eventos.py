@@ -0,0 +1,374 @@
+"""
+Eventos em tempo real (Server-Sent Events) para os painéis dos condomínios
+
+As gravações de coletas publicam eventos em um broker; o endpoint SSE servido
+pelo app ASGI mantém uma fila por assinante e repassa os eventos do canal do
+condomínio. Assim uma gravação chega a todos os painéis abertos sem que cada
+um consulte o banco.
+
+O broker padrão (BrokerMemoria) faz a distribuição dentro do processo ASGI.
+Quando as coletas são gravadas em outro processo (drenar_ingestao com
+INGESTAO_ASSINCRONA, vários workers do uvicorn), EVENTOS_BROKER deve apontar
+para BrokerPostgres, que repassa os eventos entre processos com LISTEN/NOTIFY.
+
+Os totais do condomínio não são recalculados a cada gravação: o processo com
+assinantes agrupa as coletas recebidas e recalcula cada condomínio no máximo
+uma vez a cada EVENTOS_INTERVALO_TOTAIS segundos.
+"""
+import asyncio
+import json
+import logging
+import os
+import select
+import threading
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+
+logger = logging.getLogger(__name__)
+
+PREFIXO_URL = '/api/v1/eventos/condominios/'
+INTERVALO_PING = 15
+
+
+def canal_condominio(condominio_id):
+    return f'condominio:{condominio_id}'
+
+
+def condominio_do_canal(canal):
+    return int(canal.split(':', 1)[1])
+
+
+class Assinatura:
+    """Fila de eventos de um assinante, consumida no event loop dele"""
+
+    def __init__(self, broker, canal, tamanho_fila):
+        self.broker = broker
+        self.canal = canal
+        self.loop = asyncio.get_running_loop()
+        self.fila = asyncio.Queue(maxsize=tamanho_fila)
+
+    def entregar(self, evento):
+        # Assinante lento: descarta o evento mais antigo em vez de crescer sem limite
+        if self.fila.full():
+            self.fila.get_nowait()
+        self.fila.put_nowait(evento)
+
+    async def proximo(self, timeout):
+        return await asyncio.wait_for(self.fila.get(), timeout)
+
+    def cancelar(self):
+        self.broker.cancelar(self)
+
+
+class ColetorTotais:
+    """
+    Agrupa os pedidos de totais por condomínio. O primeiro pedido agenda o
+    cálculo para daqui a `intervalo` segundos e os seguintes, até lá, só
+    entram no mesmo lote; os totais publicados sempre incluem a última coleta.
+    """
+
+    def __init__(self, broker, intervalo):
+        self.broker = broker
+        self.intervalo = intervalo
+        self._pendentes = set()
+        self._timer = None
+        self._trava = threading.Lock()
+
+    def agendar(self, condominio_id):
+        with self._trava:
+            self._pendentes.add(condominio_id)
+            if self._timer is None:
+                self._timer = threading.Timer(self.intervalo, self._descarregar_em_thread)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _descarregar_em_thread(self):
+        try:
+            self.descarregar()
+        finally:
+            # Conexões abertas por esta thread do Timer
+            connections.close_all()
+
+    def descarregar(self):
+        """Calcula e publica, com uma só agregação, os totais dos condomínios pendentes"""
+        from . import relatorios
+
+        with self._trava:
+            pendentes, self._pendentes = self._pendentes, set()
+            self._timer = None
+        pendentes = [
+            condominio_id for condominio_id in pendentes
+            if self.broker.tem_assinantes_locais(canal_condominio(condominio_id))
+        ]
+        if not pendentes:
+            return
+        try:
+            resumos = relatorios.resumir(relatorios.agregar_por_tipo(pendentes))
+        except Exception:
+            logger.exception('Falha ao calcular os totais dos condomínios %s', pendentes)
+            return
+        for condominio_id in pendentes:
+            if condominio_id in resumos:
+                self.broker.entregar(
+                    canal_condominio(condominio_id), 'totais',
+                    {'condominio': condominio_id, **resumos[condominio_id]}
+                )
+
+
+class BrokerMemoria:
+    """Distribuição de eventos dentro do processo"""
+
+    # Entrega eventos publicados por outros processos
+    entre_processos = False
+
+    def __init__(self, tamanho_fila=100):
+        self.tamanho_fila = tamanho_fila
+        self.totais = ColetorTotais(self, settings.EVENTOS_INTERVALO_TOTAIS)
+        self._assinaturas = {}
+        self._trava = threading.Lock()
+
+    def assinar(self, canal):
+        assinatura = Assinatura(self, canal, self.tamanho_fila)
+        with self._trava:
+            self._assinaturas.setdefault(canal, set()).add(assinatura)
+        return assinatura
+
+    def cancelar(self, assinatura):
+        with self._trava:
+            assinaturas = self._assinaturas.get(assinatura.canal, set())
+            assinaturas.discard(assinatura)
+            if not assinaturas:
+                self._assinaturas.pop(assinatura.canal, None)
+
+    def tem_assinantes_locais(self, canal):
+        return bool(self._assinaturas.get(canal))
+
+    def tem_assinantes(self, canal):
+        """Se vale a pena publicar no canal (no processo ou, conforme o broker, fora dele)"""
+        return self.tem_assinantes_locais(canal)
+
+    def publicar(self, canal, tipo, dados):
+        """Pode ser chamado de qualquer thread"""
+        self.entregar(canal, tipo, dados)
+
+    def entregar(self, canal, tipo, dados):
+        """Repassa o evento aos assinantes deste processo"""
+        with self._trava:
+            assinaturas = list(self._assinaturas.get(canal, ()))
+        if not assinaturas:
+            return
+        evento = (tipo, json.dumps(dados, cls=DjangoJSONEncoder))
+        for assinatura in assinaturas:
+            try:
+                assinatura.loop.call_soon_threadsafe(assinatura.entregar, evento)
+            except RuntimeError:
+                # Loop já encerrado: a assinatura será cancelada pelo próprio handler
+                pass
+        if tipo == 'coleta':
+            self.totais.agendar(condominio_do_canal(canal))
+
+
+class BrokerPostgres(BrokerMemoria):
+    """
+    Distribuição entre processos pelo LISTEN/NOTIFY do PostgreSQL. Qualquer
+    processo publica com pg_notify; cada processo com assinantes mantém uma
+    thread escutando o canal e entrega os eventos aos assinantes locais.
+    """
+
+    entre_processos = True
+    CANAL = 'core_eventos'
+
+    def __init__(self, tamanho_fila=100, alias='default'):
+        super().__init__(tamanho_fila)
+        self.alias = alias
+        self._ouvinte = None
+
+    def tem_assinantes(self, canal):
+        # Os assinantes podem estar em qualquer processo
+        return True
+
+    def assinar(self, canal):
+        with self._trava:
+            if self._ouvinte is None:
+                self._ouvinte = threading.Thread(target=self._ouvir, name='eventos-postgres', daemon=True)
+                self._ouvinte.start()
+        return super().assinar(canal)
+
+    def publicar(self, canal, tipo, dados):
+        # Dentro de uma transação o aviso só sai no commit; o savepoint evita
+        # que uma falha (ex.: payload acima de 8000 bytes) aborte a transação
+        mensagem = json.dumps({'canal': canal, 'tipo': tipo, 'dados': dados}, cls=DjangoJSONEncoder)
+        with transaction.atomic(using=self.alias), connections[self.alias].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.CANAL, mensagem])
+
+    def _ouvir(self):
+        banco = connections[self.alias]
+        while True:
+            conexao = None
+            try:
+                conexao = banco.get_new_connection(banco.get_connection_params())
+                conexao.autocommit = True
+                with conexao.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.CANAL}')
+                while True:
+                    if select.select([conexao], [], [], INTERVALO_PING) == ([], [], []):
+                        continue
+                    conexao.poll()
+                    while conexao.notifies:
+                        mensagem = json.loads(conexao.notifies.pop(0).payload)
+                        self.entregar(mensagem['canal'], mensagem['tipo'], mensagem['dados'])
+            except Exception:
+                logger.exception('Conexão do LISTEN de eventos perdida; reconectando')
+                time.sleep(1)
+            finally:
+                if conexao is not None:
+                    conexao.close()
+
+
+_broker = None
+_broker_trava = threading.Lock()
+
+
+def obter_broker():
+    global _broker
+    with _broker_trava:
+        if _broker is None:
+            _broker = import_string(settings.EVENTOS_BROKER)()
+        return _broker
+
+
+def avisar_broker_local(origem):
+    """
+    Avisa quando os eventos são gravados fora do processo dos assinantes e o
+    broker não os entrega entre processos (os painéis ficariam sem eventos)
+    """
+    if obter_broker().entre_processos:
+        return False
+    logger.warning(
+        '%s: EVENTOS_BROKER=%s só entrega eventos dentro do processo; as coletas gravadas aqui '
+        'não chegam aos painéis SSE. Use core.eventos.BrokerPostgres.',
+        origem, settings.EVENTOS_BROKER
+    )
+    return True
+
+
+def verificar_broker_asgi():
+    """Chamado na inicialização do ASGI"""
+    if settings.INGESTAO_ASSINCRONA:
+        avisar_broker_local('INGESTAO_ASSINCRONA (as coletas são gravadas por drenar_ingestao)')
+    elif int(os.environ.get('WEB_CONCURRENCY') or 1) > 1:
+        avisar_broker_local('WEB_CONCURRENCY > 1 (cada worker tem seus próprios assinantes)')
+
+
+def publicar_coletas(condominio_id, coletas):
+    """
+    Publica as coletas gravadas de um condomínio. Os totais atualizados são
+    publicados depois, agrupados, pelo processo que tem os assinantes.
+    """
+    broker = obter_broker()
+    canal = canal_condominio(condominio_id)
+    if not broker.tem_assinantes(canal):
+        return
+    try:
+        for coleta in coletas:
+            broker.publicar(canal, 'coleta', coleta)
+    except Exception:
+        # A gravação já foi confirmada; só os painéis perdem o evento
+        logger.exception('Falha ao publicar as coletas do condomínio %s', condominio_id)
+
+
+def _token(scope):
+    """Token JWT do header Authorization, do parâmetro ?token= ou do cookie do dj-rest-auth"""
+    headers = dict(scope.get('headers') or [])
+    autorizacao = headers.get(b'authorization', b'').decode('latin-1')
+    if autorizacao.lower().startswith('bearer '):
+        return autorizacao[7:].strip()
+    parametros = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    if parametros.get('token'):
+        return parametros['token'][0]
+    cookies = SimpleCookie(headers.get(b'cookie', b'').decode('latin-1'))
+    nome_cookie = settings.REST_AUTH.get('JWT_AUTH_COOKIE')
+    if nome_cookie in cookies:
+        return cookies[nome_cookie].value
+    return None
+
+
+def _autenticado(scope):
+    token = _token(scope)
+    if not token:
+        return False
+    try:
+        AccessToken(token)
+    except TokenError:
+        return False
+    return True
+
+
+async def _responder(send, codigo, mensagem):
+    corpo = json.dumps({'erro': mensagem}).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': codigo,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(corpo)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': corpo})
+
+
+async def aplicacao_sse(scope, receive, send):
+    """
+    GET /api/v1/eventos/condominios/<id>/ — fluxo text/event-stream com os
+    eventos `coleta` e `totais` do condomínio
+    """
+    condominio_id = scope['path'][len(PREFIXO_URL):].strip('/')
+    if scope['method'] != 'GET' or not condominio_id.isdigit():
+        await _responder(send, 404, 'Não encontrado.')
+        return
+    if not _autenticado(scope):
+        await _responder(send, 401, 'Token de acesso ausente ou inválido.')
+        return
+
+    assinatura = obter_broker().assinar(canal_condominio(int(condominio_id)))
+    desconectado = asyncio.ensure_future(_aguardar_desconexao(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b': conectado\n\n', 'more_body': True})
+        while not desconectado.done():
+            proximo = asyncio.ensure_future(assinatura.proximo(INTERVALO_PING))
+            await asyncio.wait({proximo, desconectado}, return_when=asyncio.FIRST_COMPLETED)
+            if desconectado.done():
+                proximo.cancel()
+                break
+            try:
+                tipo, dados = proximo.result()
+                mensagem = f'event: {tipo}\ndata: {dados}\n\n'
+            except asyncio.TimeoutError:
+                mensagem = ': ping\n\n'
+            await send({'type': 'http.response.body', 'body': mensagem.encode(), 'more_body': True})
+    except OSError:
+        logger.debug('Cliente SSE desconectado durante o envio')
+    finally:
+        assinatura.cancelar()
+        desconectado.cancel()
+
+
+async def _aguardar_desconexao(receive):
+    while True:
+        mensagem = await receive()
+        if mensagem['type'] == 'http.disconnect':
+            return
@@ -0,0 +1,162 @@
+"""
+Exclusão rápida de Condominio e TipoResiduo
+
+O CASCADE do Django carrega cada coleta dependente antes de excluí-la. Aqui as
+coletas são removidas em lotes com DELETE por conjunto de ids (sem carregar
+objetos), fora da requisição, e o progresso fica registrado em TarefaExclusao.
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from . import shards
+from .models import CalculoCredito, Condominio, TarefaExclusao, TipoResiduo
+
+logger = logging.getLogger(__name__)
+
+MODELOS = {
+    'condominio': Condominio,
+    'tipo_residuo': TipoResiduo,
+}
+ATIVAS = ['pendente', 'excluindo']
+
+
+def _nome_modelo(objeto):
+    for nome, modelo in MODELOS.items():
+        if isinstance(objeto, modelo):
+            return nome
+    raise ValueError(f'Exclusão em segundo plano não suportada para {type(objeto).__name__}')
+
+
+def tarefas_ativas():
+    return TarefaExclusao.objects.filter(status__in=ATIVAS)
+
+
+def status_exclusao(objeto):
+    """Status da tarefa de exclusão ativa do objeto, ou None"""
+    return tarefas_ativas().filter(
+        modelo=_nome_modelo(objeto), objeto_id=objeto.pk
+    ).values_list('status', flat=True).first()
+
+
+def anotar_status_exclusao(queryset, modelo):
+    """Anota em cada objeto o status_exclusao, com uma subconsulta"""
+    return queryset.annotate(status_exclusao=Subquery(
+        tarefas_ativas().filter(modelo=modelo, objeto_id=OuterRef('pk')).values('status')[:1]
+    ))
+
+
+def em_exclusao(**objetos):
+    """
+    Nomes dos campos (condominio, tipo_residuo) cujo objeto tem exclusão
+    agendada ou em andamento, em uma consulta
+    """
+    filtro = Q(pk__in=[])
+    for modelo, objeto in objetos.items():
+        if objeto is not None:
+            filtro |= Q(modelo=modelo, objeto_id=objeto.pk)
+    return set(tarefas_ativas().filter(filtro).values_list('modelo', flat=True))
+
+
+def _shards_da_tarefa(modelo, objeto_id):
+    """Um condomínio tem coletas só no shard dele; um tipo, em todos"""
+    if modelo == 'condominio':
+        return [shards.shard_do_condominio(objeto_id)]
+    return shards.aliases()
+
+
+def agendar_exclusao(objeto):
+    """
+    Cria (ou reaproveita) a tarefa de exclusão do objeto e a inicia em
+    segundo plano após o commit
+    """
+    modelo = _nome_modelo(objeto)
+    tarefa = tarefas_ativas().filter(modelo=modelo, objeto_id=objeto.pk).first()
+    if tarefa:
+        return tarefa
+
+    tarefa = TarefaExclusao.objects.create(
+        modelo=modelo,
+        objeto_id=objeto.pk,
+        descricao=str(objeto)[:200],
+        total=sum(
+            CalculoCredito.objects.using(alias).filter(**{f'{modelo}_id': objeto.pk}).count()
+            for alias in _shards_da_tarefa(modelo, objeto.pk)
+        ),
+    )
+    if settings.EXCLUSAO_EM_THREAD:
+        transaction.on_commit(lambda: iniciar_em_thread(tarefa.pk))
+    return tarefa
+
+
+def iniciar_em_thread(tarefa_id):
+    def executar_e_fechar():
+        try:
+            executar(tarefa_id)
+        finally:
+            connections.close_all()
+
+    threading.Thread(target=executar_e_fechar, name=f'exclusao-{tarefa_id}', daemon=True).start()
+
+
+def _reivindicar(tarefa_id, retomar):
+    """
+    Passa a tarefa para 'excluindo' com um UPDATE condicionado ao status, de
+    modo que só um executor a assuma. Com `retomar`, também assume tarefas
+    'excluindo' sem progresso há EXCLUSAO_ABANDONO_SEGUNDOS (executor
+    interrompido); cada lote excluído renova atualizado_em.
+    """
+    agora = timezone.now()
+    disponivel = Q(status='pendente')
+    if retomar:
+        abandono = agora - timedelta(seconds=settings.EXCLUSAO_ABANDONO_SEGUNDOS)
+        disponivel |= Q(status='excluindo', atualizado_em__lt=abandono)
+    return TarefaExclusao.objects.filter(disponivel, pk=tarefa_id).update(status='excluindo', atualizado_em=agora)
+
+
+def executar(tarefa_id, tamanho_lote=None, retomar=False):
+    """
+    Exclui as coletas do objeto em lotes e depois o próprio objeto.
+    Pode ser reexecutada com segurança após uma interrupção. Se a tarefa já
+    estiver com outro executor, retorna sem fazer nada.
+    """
+    tamanho_lote = tamanho_lote or settings.EXCLUSAO_TAMANHO_LOTE
+    if not _reivindicar(tarefa_id, retomar):
+        return TarefaExclusao.objects.get(pk=tarefa_id)
+    tarefa = TarefaExclusao.objects.get(pk=tarefa_id)
+
+    try:
+        for alias in _shards_da_tarefa(tarefa.modelo, tarefa.objeto_id):
+            _excluir_coletas(tarefa, alias, tamanho_lote)
+
+        with transaction.atomic():
+            MODELOS[tarefa.modelo].objects.filter(pk=tarefa.objeto_id).delete()
+            TarefaExclusao.objects.filter(pk=tarefa.pk).update(status='concluida', atualizado_em=timezone.now())
+    except Exception as e:
+        logger.exception('Falha na tarefa de exclusão %s', tarefa.pk)
+        TarefaExclusao.objects.filter(pk=tarefa.pk).update(
+            status='erro', erro=str(e), atualizado_em=timezone.now()
+        )
+
+    tarefa.refresh_from_db()
+    return tarefa
+
+
+def _excluir_coletas(tarefa, alias, tamanho_lote):
+    coletas = CalculoCredito.objects.using(alias).filter(**{f'{tarefa.modelo}_id': tarefa.objeto_id})
+    while True:
+        ids = list(coletas.values_list('pk', flat=True)[:tamanho_lote])
+        if not ids:
+            break
+        # CalculoCredito não tem dependentes nem sinais, então o delete do
+        # queryset vira um único DELETE ... WHERE id IN (...)
+        with transaction.atomic(using=alias):
+            excluidas, _ = CalculoCredito.objects.using(alias).filter(pk__in=ids).delete()
+        TarefaExclusao.objects.filter(pk=tarefa.pk).update(
+            excluidos=F('excluidos') + excluidas, atualizado_em=timezone.now()
+        )
@@ -0,0 +1,344 @@
+"""
+Ingestão assíncrona (write-behind) de CalculoCredito
+
+O POST de coletas anexa o registro já validado e calculado a um log local
+(uma linha JSON por coleta) e só responde depois do fsync do arquivo e, se o
+log acabou de ser recriado, também do diretório. As gravações
+concorrentes do mesmo processo compartilham o mesmo fsync (commit em grupo).
+O comando drenar_ingestao rotaciona o log e grava os registros no banco com
+bulk_create em lotes grandes; como cada registro carrega um id_ingestao único,
+reprocessar um arquivo após uma falha não duplica coletas. Registros que o
+banco recusa são anexados a ingestao.rejeitados (com o erro) e registrados no log.
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DataError, IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import estatisticas, eventos, shards
+from .models import CalculoCredito
+
+logger = logging.getLogger(__name__)
+
+NOME_LOG = 'ingestao.log'
+SUFIXO_DRENAGEM = '.drenar'
+NOME_REJEITADOS = 'ingestao.rejeitados'
+
+
+def sincronizar_diretorio(diretorio):
+    """
+    fsync do diretório: sem ele, um arquivo recém-criado ou renomeado pode
+    sumir numa queda de energia mesmo com o conteúdo já sincronizado
+    """
+    descritor = os.open(diretorio, os.O_RDONLY)
+    try:
+        os.fsync(descritor)
+    finally:
+        os.close(descritor)
+
+
+def _abrir_log_atual(caminho):
+    """
+    Abre o log para anexação com lock exclusivo, garantindo que o arquivo
+    aberto ainda é o do caminho (e não um já rotacionado pela drenagem)
+    """
+    while True:
+        descritor = os.open(caminho, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        fcntl.flock(descritor, fcntl.LOCK_EX)
+        try:
+            if os.fstat(descritor).st_ino == os.stat(caminho).st_ino:
+                return descritor
+        except FileNotFoundError:
+            pass
+        os.close(descritor)
+
+
+class LogIngestao:
+    """Log local somente-anexação com fsync em grupo"""
+
+    def __init__(self, diretorio):
+        self.diretorio = Path(diretorio)
+        self.caminho = self.diretorio / NOME_LOG
+        self._condicao = threading.Condition()
+        self._pendentes = []
+        self._proximo = 1
+        self._gravado = 0
+        self._gravando = False
+        self._falhas = {}
+        # inode do log cuja entrada no diretório já foi sincronizada
+        self._inode_sincronizado = None
+
+    def anexar(self, registro):
+        """Anexa o registro e retorna depois que ele estiver em disco"""
+        linha = json.dumps(registro, cls=DjangoJSONEncoder, separators=(',', ':')).encode() + b'\n'
+        with self._condicao:
+            sequencia = self._proximo
+            self._proximo += 1
+            self._pendentes.append(linha)
+
+            while self._gravado < sequencia:
+                if self._gravando:
+                    self._condicao.wait()
+                    continue
+
+                # Esta thread grava tudo o que acumulou durante o fsync anterior
+                self._gravando = True
+                lote, self._pendentes = self._pendentes, []
+                primeira, ultima = self._gravado + 1, self._proximo - 1
+                self._condicao.release()
+                erro = None
+                try:
+                    self._gravar(lote)
+                except OSError as e:
+                    erro = e
+                finally:
+                    self._condicao.acquire()
+                    self._gravando = False
+                if erro is not None:
+                    for falha in range(primeira, ultima + 1):
+                        self._falhas[falha] = erro
+                self._gravado = ultima
+                self._condicao.notify_all()
+
+            erro = self._falhas.pop(sequencia, None)
+        if erro is not None:
+            raise erro
+
+    def _gravar(self, linhas):
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        descritor = _abrir_log_atual(self.caminho)
+        try:
+            os.write(descritor, b''.join(linhas))
+            os.fsync(descritor)
+            # O log é recriado a cada rotação (por este ou outro processo):
+            # a entrada do arquivo novo também precisa estar em disco antes
+            # de confirmar a coleta
+            inode = os.fstat(descritor).st_ino
+            if inode != self._inode_sincronizado:
+                sincronizar_diretorio(self.diretorio)
+                self._inode_sincronizado = inode
+        finally:
+            os.close(descritor)
+
+
+_log = None
+_log_pid = None
+_log_trava = threading.Lock()
+
+
+def obter_log():
+    """Log do processo atual (recriado após fork dos workers)"""
+    global _log, _log_pid
+    with _log_trava:
+        if _log is None or _log_pid != os.getpid():
+            _log = LogIngestao(settings.INGESTAO_DIR)
+            _log_pid = os.getpid()
+        return _log
+
+
+def registrar(dados):
+    """
+    Grava a coleta validada no log e retorna o registro com id_ingestao e
+    data_coleta definidos
+    """
+    data_coleta = dados.get('data_coleta') or CalculoCredito._meta.get_field('data_coleta').get_default()
+    registro = {
+        'id_ingestao': str(uuid.uuid4()),
+        'data_coleta': data_coleta.isoformat(),
+        'condominio_id': dados['condominio'].id,
+        'tipo_residuo_id': dados['tipo_residuo'].id,
+        'peso_residuo': dados['peso_residuo'],
+        'emissao_carbono_atual': dados.get('emissao_carbono_atual'),
+        'emissao_carbono_reciclagem': dados.get('emissao_carbono_reciclagem'),
+        'custo_descarte_atual': dados.get('custo_descarte_atual'),
+        'custo_reciclagem': dados.get('custo_reciclagem'),
+        'suspeito': dados.get('suspeito', False),
+    }
+    obter_log().anexar(registro)
+    return registro
+
+
+def _para_calculo(registro):
+    calculo = CalculoCredito(
+        id_ingestao=uuid.UUID(registro['id_ingestao']),
+        data_coleta=parse_datetime(registro['data_coleta']),
+        condominio_id=registro['condominio_id'],
+        tipo_residuo_id=registro['tipo_residuo_id'],
+        peso_residuo=registro['peso_residuo'],
+        emissao_carbono_atual=registro['emissao_carbono_atual'],
+        emissao_carbono_reciclagem=registro['emissao_carbono_reciclagem'],
+        custo_descarte_atual=_decimal(registro['custo_descarte_atual']),
+        custo_reciclagem=_decimal(registro['custo_reciclagem']),
+        suspeito=registro.get('suspeito', False),
+    )
+    # bulk_create não chama save(), então a economia é calculada aqui
+    calculo.economia_carbono = calculo.emissao_carbono_atual - calculo.emissao_carbono_reciclagem
+    return calculo
+
+
+def _decimal(valor):
+    return None if valor is None else Decimal(valor)
+
+
+def _ler_registros(caminho):
+    with open(caminho, 'rb') as arquivo:
+        # Espera uma gravação em andamento terminar antes de ler
+        fcntl.flock(arquivo.fileno(), fcntl.LOCK_SH)
+        conteudo = arquivo.read()
+    for numero, linha in enumerate(conteudo.split(b'\n'), start=1):
+        if not linha:
+            continue
+        try:
+            yield json.loads(linha)
+        except ValueError:
+            # Última linha incompleta de uma gravação interrompida: não foi
+            # confirmada ao cliente, então pode ser descartada
+            logger.warning('Linha %s inválida em %s descartada', numero, caminho)
+
+
+def rotacionar(diretorio=None):
+    """Renomeia o log atual para um arquivo de drenagem, se houver registros"""
+    diretorio = Path(diretorio or settings.INGESTAO_DIR)
+    caminho = diretorio / NOME_LOG
+    try:
+        if caminho.stat().st_size == 0:
+            return None
+    except FileNotFoundError:
+        return None
+    destino = diretorio / f'{NOME_LOG}.{time.time_ns()}{SUFIXO_DRENAGEM}'
+    os.rename(caminho, destino)
+    sincronizar_diretorio(diretorio)
+    return destino
+
+
+def drenar(diretorio=None, tamanho_lote=None):
+    """
+    Grava no banco os registros do log em lotes. Arquivos de drenagem que
+    sobraram de uma execução interrompida são reprocessados primeiro.
+    Registros que o banco recusa (ex.: condomínio excluído) vão para o
+    arquivo de rejeitados em vez de travar a drenagem.
+    Retorna a quantidade de coletas gravadas.
+    """
+    diretorio = Path(diretorio or settings.INGESTAO_DIR)
+    tamanho_lote = tamanho_lote or settings.INGESTAO_TAMANHO_LOTE
+    if not diretorio.is_dir():
+        return 0
+
+    with open(diretorio / 'drenagem.lock', 'w') as trava:
+        try:
+            fcntl.flock(trava.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info('Outra drenagem já está em andamento')
+            return 0
+
+        rotacionar(diretorio)
+        total = 0
+        for arquivo in sorted(diretorio.glob(f'{NOME_LOG}.*{SUFIXO_DRENAGEM}')):
+            lote, rejeitados = [], []
+            for registro in _ler_registros(arquivo):
+                try:
+                    lote.append((registro, _para_calculo(registro)))
+                except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+                    rejeitados.append((registro, e))
+                if len(lote) >= tamanho_lote:
+                    total += _gravar_lote(lote, rejeitados)
+                    lote = []
+            if lote:
+                total += _gravar_lote(lote, rejeitados)
+            if rejeitados:
+                _gravar_rejeitados(diretorio, arquivo, rejeitados)
+            os.remove(arquivo)
+        return total
+
+
+def _gravar_rejeitados(diretorio, arquivo, rejeitados):
+    """Anexa os registros recusados ao arquivo de rejeitados (com fsync)"""
+    agora = timezone.now().isoformat()
+    linhas = b''.join(
+        json.dumps(
+            {'registro': registro, 'erro': str(erro), 'arquivo': arquivo.name, 'rejeitado_em': agora},
+            cls=DjangoJSONEncoder, separators=(',', ':')
+        ).encode() + b'\n'
+        for registro, erro in rejeitados
+    )
+    descritor = os.open(diretorio / NOME_REJEITADOS, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descritor, linhas)
+        os.fsync(descritor)
+    finally:
+        os.close(descritor)
+    # Antes de o arquivo de drenagem ser removido
+    sincronizar_diretorio(diretorio)
+    for registro, erro in rejeitados:
+        logger.error(
+            'Coleta %s (condomínio %s) recusada na drenagem de %s: %s',
+            registro.get('id_ingestao'), registro.get('condominio_id'), arquivo.name, erro
+        )
+
+
+def _inserir(alias, calculos):
+    """Insere no shard as coletas ainda não gravadas e atualiza as estatísticas"""
+    with transaction.atomic(using=alias):
+        # Registros já gravados antes de uma falha não entram de novo nem
+        # nas estatísticas (id_ingestao único)
+        existentes = set(CalculoCredito.objects.using(alias).filter(
+            id_ingestao__in=[calculo.id_ingestao for calculo in calculos]
+        ).values_list('id_ingestao', flat=True))
+        novos = [calculo for calculo in calculos if calculo.id_ingestao not in existentes]
+        CalculoCredito.objects.using(alias).bulk_create(novos)
+        estatisticas.registrar_lote(novos)
+    return novos
+
+
+def _gravar_lote(lote, rejeitados):
+    """
+    Grava o lote [(registro, calculo)] por shard. Se o lote de um shard for
+    recusado, os registros são regravados um a um e os que falharem vão para
+    `rejeitados`. Erros que não são do registro (ex.: banco fora do ar) sobem,
+    e o arquivo de drenagem é mantido para a próxima execução.
+    """
+    por_shard = {}
+    for registro, calculo in lote:
+        try:
+            alias = shards.atribuir_shard(calculo.condominio_id)
+        except IntegrityError as e:
+            rejeitados.append((registro, e))
+            continue
+        por_shard.setdefault(alias, []).append((registro, calculo))
+
+    novos = []
+    for alias, itens in por_shard.items():
+        try:
+            novos.extend(_inserir(alias, [calculo for _, calculo in itens]))
+        except (IntegrityError, DataError):
+            for registro, calculo in itens:
+                try:
+                    novos.extend(_inserir(alias, [calculo]))
+                except (IntegrityError, DataError) as e:
+                    rejeitados.append((registro, e))
+
+    por_condominio = {}
+    for calculo in novos:
+        por_condominio.setdefault(calculo.condominio_id, []).append({
+            'id_ingestao': calculo.id_ingestao,
+            'condominio': calculo.condominio_id,
+            'tipo_residuo': calculo.tipo_residuo_id,
+            'peso_residuo': calculo.peso_residuo,
+            'data_coleta': calculo.data_coleta,
+            'economia_carbono': calculo.economia_carbono,
+            'suspeito': calculo.suspeito,
+        })
+    for condominio_id, coletas in por_condominio.items():
+        eventos.publicar_coletas(condominio_id, coletas)
+    return len(novos)
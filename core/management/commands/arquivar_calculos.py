@@ -0,0 +1,57 @@
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+
+from core import arquivo_frio, shards
+from core.models import CalculoCredito
+from core.particionamento import inicio_mes, somar_meses
+
+
+class Command(BaseCommand):
+    help = (
+        "Move as coletas de meses fechados para o arquivo frio colunar "
+        "(ARQUIVO_FRIO_DIR) e as remove do banco"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ate',
+            help='Arquiva os meses anteriores a este (AAAA-MM). '
+                 'Padrão: mantém ARQUIVO_FRIO_MESES_QUENTES meses no banco'
+        )
+        parser.add_argument('--diretorio', help='Diretório do arquivo frio (padrão: ARQUIVO_FRIO_DIR)')
+
+    def handle(self, *args, **options):
+        mes_atual = inicio_mes(date.today())
+        if options['ate']:
+            try:
+                ano, mes = map(int, options['ate'].split('-'))
+                limite = date(ano, mes, 1)
+            except ValueError:
+                raise CommandError('--ate deve estar no formato AAAA-MM.')
+        else:
+            limite = somar_meses(mes_atual, -settings.ARQUIVO_FRIO_MESES_QUENTES)
+        # Só meses fechados vão para o arquivo
+        limite = min(limite, mes_atual)
+
+        datas = [
+            CalculoCredito.objects.using(alias).aggregate(Min('data_coleta'))['data_coleta__min']
+            for alias in shards.aliases()
+        ]
+        datas = [data for data in datas if data is not None]
+        if not datas:
+            self.stdout.write('Nenhuma coleta no banco.')
+            return
+
+        mes = inicio_mes(min(datas))
+        total = 0
+        while mes < limite:
+            removidas = arquivo_frio.arquivar_mes(mes, options['diretorio'])
+            if removidas:
+                self.stdout.write(f'{mes:%Y-%m}: {removidas} coletas arquivadas')
+            total += removidas
+            mes = somar_meses(mes, 1)
+
+        self.stdout.write(self.style.SUCCESS(f'{total} coletas movidas para o arquivo frio.'))
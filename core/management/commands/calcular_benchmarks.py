@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from core import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula os percentis da economia de carbono por apartamento de cada "
+        "tipo de resíduo entre os condomínios (executar periodicamente)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--janela-dias', type=int,
+            help='Dias de histórico considerados (padrão: BENCHMARK_JANELA_DIAS)'
+        )
+
+    def handle(self, *args, **options):
+        calculados = benchmarks.calcular(options['janela_dias'])
+        for benchmark in calculados:
+            self.stdout.write(
+                f'{benchmark.tipo_residuo}: {benchmark.condominios} condomínios, '
+                f'mediana {benchmark.percentis[len(benchmark.percentis) // 2]:.2f} kg CO2/apartamento/30 dias'
+            )
+        self.stdout.write(self.style.SUCCESS(f'{len(calculados)} benchmarks calculados.'))
@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import eventos, ingestao
+
+
+class Command(BaseCommand):
+    help = "Grava no banco, em lotes, as coletas recebidas pela ingestão assíncrona"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--continuo', action='store_true',
+            help='Continua drenando o log em intervalos até ser interrompido'
+        )
+        parser.add_argument(
+            '--intervalo', type=float, default=1.0,
+            help='Segundos entre drenagens no modo contínuo'
+        )
+        parser.add_argument(
+            '--tamanho-lote', type=int, default=settings.INGESTAO_TAMANHO_LOTE,
+            help='Quantidade de coletas por bulk_create'
+        )
+
+    def handle(self, *args, **options):
+        eventos.avisar_broker_local('drenar_ingestao')
+        while True:
+            total = ingestao.drenar(tamanho_lote=options['tamanho_lote'])
+            if total or not options['continuo']:
+                self.stdout.write(self.style.SUCCESS(f'{total} coletas gravadas no banco.'))
+            if not options['continuo']:
+                return
+            time.sleep(options['intervalo'])
@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core import particionamento
+
+
+class Command(BaseCommand):
+    help = (
+        "Mantém as partições mensais de CalculoCredito no PostgreSQL: converte a tabela, "
+        "cria as partições dos próximos meses e desanexa/arquiva as antigas"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--converter', action='store_true',
+            help='Converte a tabela atual em tabela particionada (executar uma única vez)'
+        )
+        parser.add_argument(
+            '--meses-futuros', type=int, default=settings.CALCULO_CREDITO_MESES_FUTUROS,
+            help='Quantidade de meses à frente com partição pré-criada'
+        )
+        parser.add_argument(
+            '--retencao-meses', type=int,
+            help='Desanexa as partições anteriores a esta quantidade de meses'
+        )
+        parser.add_argument(
+            '--esquema-arquivo', default=settings.CALCULO_CREDITO_ESQUEMA_ARQUIVO,
+            help='Esquema para onde as partições desanexadas são movidas'
+        )
+        parser.add_argument(
+            '--excluir', action='store_true',
+            help='Exclui as partições desanexadas em vez de movê-las para o esquema de arquivo'
+        )
+        parser.add_argument(
+            '--arquivar', action='store_true',
+            help='Move as coletas das partições antigas para o arquivo frio antes de desanexá-las'
+        )
+
+    def handle(self, *args, **options):
+        if not particionamento.particionamento_disponivel():
+            raise CommandError(
+                'O particionamento exige PostgreSQL e CALCULO_CREDITO_PARTICIONADO=1.'
+            )
+
+        if options['converter']:
+            criadas = particionamento.converter_tabela(options['meses_futuros'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Tabela convertida com {len(criadas)} partições mensais.'
+            ))
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if not particionamento.tabela_particionada(cursor):
+                raise CommandError(
+                    f'{particionamento.TABELA} ainda não é particionada; execute com --converter.'
+                )
+
+            for nome in particionamento.criar_particoes_futuras(cursor, options['meses_futuros']):
+                self.stdout.write(f'Partição criada: {nome}')
+
+            if options['retencao_meses'] is not None:
+                removidas, pendentes = particionamento.desanexar_particoes_antigas(
+                    cursor,
+                    options['retencao_meses'],
+                    options['esquema_arquivo'],
+                    excluir=options['excluir'],
+                    arquivar=options['arquivar'],
+                )
+                destino = 'excluída' if options['excluir'] else f"movida para {options['esquema_arquivo']}"
+                for nome in removidas:
+                    self.stdout.write(f'Partição desanexada e {destino}: {nome}')
+                for nome in pendentes:
+                    self.stderr.write(self.style.WARNING(
+                        f'Partição mantida: {nome} tem coletas fora do arquivo frio '
+                        f'(execute arquivar_calculos ou use --arquivar).'
+                    ))
+
+        self.stdout.write(self.style.SUCCESS('Manutenção de partições concluída.'))
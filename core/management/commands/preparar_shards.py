@@ -0,0 +1,35 @@
+from django.apps import apps
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from core import shards
+
+
+class Command(BaseCommand):
+    help = (
+        "Prepara os shards configurados em SHARDS: aplica as migrations, reserva a "
+        "faixa de ids de cada shard e copia as tabelas de referência do default"
+    )
+
+    def handle(self, *args, **options):
+        if not shards.sharding_ativo():
+            raise CommandError('Configure mais de um banco em SHARDS (ex.: SHARDS_SQLITE=2).')
+        shards.verificar_bancos()
+
+        for alias in shards.aliases():
+            call_command('migrate', database=alias, verbosity=0)
+            shards.reservar_faixa_ids(alias)
+
+            if alias != 'default':
+                for nome in shards.MODELOS_REPLICADOS:
+                    modelo = apps.get_model('core', nome)
+                    objetos = list(modelo.objects.using('default').all())
+                    for objeto in objetos:
+                        shards.replicar(objeto, [alias])
+                    # Remove o que foi excluído do default sem passar pelos sinais
+                    modelo.objects.using(alias).exclude(
+                        pk__in=[objeto.pk for objeto in objetos]
+                    ).delete()
+            self.stdout.write(f'Shard {alias} preparado.')
+
+        self.stdout.write(self.style.SUCCESS('Shards prontos.'))
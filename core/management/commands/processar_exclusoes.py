@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from core import exclusao
+from core.models import TarefaExclusao
+
+
+class Command(BaseCommand):
+    help = (
+        "Executa as tarefas de exclusão pendentes (ou interrompidas) de "
+        "condomínios e tipos de resíduo"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repetir-erros', action='store_true',
+            help='Executa novamente as tarefas que terminaram com erro'
+        )
+
+    def handle(self, *args, **options):
+        status = exclusao.ATIVAS + (['erro'] if options['repetir_erros'] else [])
+        tarefas = TarefaExclusao.objects.filter(status__in=status).order_by('criado_em')
+        for tarefa in tarefas:
+            if tarefa.status == 'erro':
+                TarefaExclusao.objects.filter(pk=tarefa.pk, status='erro').update(status='pendente', erro=None)
+            # 'excluindo' só é retomada se estiver parada (ver EXCLUSAO_ABANDONO_SEGUNDOS)
+            tarefa = exclusao.executar(tarefa.pk, retomar=True)
+            if tarefa.status == 'excluindo':
+                self.stdout.write(f'{tarefa}: em andamento em outro processo')
+            else:
+                self.stdout.write(f'{tarefa}: {tarefa.excluidos} coletas excluídas')
+        self.stdout.write(self.style.SUCCESS('Tarefas de exclusão processadas.'))
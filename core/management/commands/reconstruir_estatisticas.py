@@ -0,0 +1,134 @@
+import heapq
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import F
+
+from core import arquivo_frio, shards
+from core.estatisticas import Acumulador
+from core.models import CalculoCredito, EstatisticaResiduo
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstrói em uma única passada pelo histórico (banco e arquivo frio) as "
+        "estatísticas de peso por condomínio e tipo de resíduo"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--marcar-suspeitos', action='store_true',
+            help='Também atualiza o campo suspeito das coletas do banco conforme a reconstrução'
+        )
+        parser.add_argument('--tamanho-lote', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        # Cada shard guarda as coletas e as estatísticas dos seus condomínios
+        reconstruidas, alteradas = 0, {True: 0, False: 0}
+        for alias in shards.aliases():
+            quantidade, alteradas_shard = self.reconstruir(alias, options)
+            reconstruidas += quantidade
+            for suspeito, ids in alteradas_shard.items():
+                alteradas[suspeito] += len(ids)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{reconstruidas} estatísticas reconstruídas; '
+            f'{alteradas[True]} coletas passaram a suspeitas e '
+            f'{alteradas[False]} deixaram de ser'
+            + ('.' if options['marcar_suspeitos'] else ' (não gravado sem --marcar-suspeitos).')
+        ))
+
+    def travar(self, alias):
+        """
+        Bloqueia as gravações nas estatísticas do shard até o fim da
+        reconstrução. As gravações de coletas atualizam as estatísticas na
+        mesma transação (select_for_update), então uma coleta gravada durante
+        a leitura não se perde: ela espera e é somada às estatísticas novas.
+        """
+        conexao = connections[alias]
+        tabela = conexao.ops.quote_name(EstatisticaResiduo._meta.db_table)
+        if conexao.vendor == 'postgresql':
+            # EXCLUSIVE ainda permite leituras simples (avaliar_peso, relatórios)
+            with conexao.cursor() as cursor:
+                cursor.execute(f'LOCK TABLE {tabela} IN EXCLUSIVE MODE')
+        else:
+            # No SQLite a primeira escrita já reserva o banco para esta transação
+            EstatisticaResiduo.objects.using(alias).all().delete()
+
+    def coletas_do_banco(self, alias, tamanho_lote):
+        coletas = CalculoCredito.objects.using(alias).order_by(
+            'condominio_id', 'data_coleta', 'id'
+        ).values_list('id', 'condominio_id', 'tipo_residuo_id', 'data_coleta', 'peso_residuo', 'suspeito')
+        for pk, condominio_id, tipo_residuo_id, data_coleta, peso, suspeito in coletas.iterator(chunk_size=tamanho_lote):
+            yield (condominio_id, arquivo_frio.para_microssegundos(data_coleta), pk), tipo_residuo_id, peso, suspeito, True
+
+    def coletas_arquivadas(self, alias, pasta):
+        """Coletas arquivadas do mês dos condomínios do shard, na mesma ordem do banco"""
+        with arquivo_frio.MesArquivado(pasta) as mes:
+            ids = [int(condominio_id) for condominio_id in mes.manifesto['condominios']]
+            mapa = shards.mapa_de_shards(ids)
+            colunas = [mes.coluna(nome) for nome in ('id', 'tipo_residuo_id', 'data_coleta', 'peso_residuo', 'suspeito')]
+            pks, tipos, datas, pesos, suspeitos = colunas
+            for condominio_id in sorted(ids):
+                if mapa[condominio_id] != alias:
+                    continue
+                primeira, ultima = mes.faixa_condominio(condominio_id)
+                for i in range(primeira, ultima):
+                    yield (condominio_id, datas[i], pks[i]), tipos[i], pesos[i], bool(suspeitos[i]), False
+
+    def reconstruir(self, alias, options):
+        tamanho_lote = options['tamanho_lote']
+        estatisticas = []
+        alteradas = {True: [], False: []}
+        condominio_atual, pares = None, {}
+
+        def fechar_condominio():
+            for tipo_residuo_id, (acumulador, suspeitos) in pares.items():
+                estatistica = EstatisticaResiduo(
+                    condominio_id=condominio_atual, tipo_residuo_id=tipo_residuo_id, suspeitos=suspeitos
+                )
+                acumulador.aplicar_em(estatistica)
+                estatisticas.append(estatistica)
+
+        with transaction.atomic(using=alias):
+            self.travar(alias)
+
+            # As coletas de cada condomínio chegam em ordem de data, intercalando
+            # o banco e os meses arquivados (o arquivo frio não recebe
+            # --marcar-suspeitos, mas entra nas estatísticas como na ingestão)
+            fontes = [self.coletas_do_banco(alias, tamanho_lote)] + [
+                self.coletas_arquivadas(alias, pasta) for pasta in arquivo_frio.meses_arquivados()
+            ]
+            ultimo_pk = None
+            for (condominio_id, _, pk), tipo_residuo_id, peso, suspeito_atual, no_banco in heapq.merge(
+                *fontes, key=lambda linha: linha[0]
+            ):
+                # Coleta no banco e no arquivo (arquivamento interrompido): conta uma vez
+                if pk == ultimo_pk:
+                    continue
+                ultimo_pk = pk
+                if condominio_id != condominio_atual:
+                    fechar_condominio()
+                    condominio_atual, pares = condominio_id, {}
+                acumulador, suspeitos = pares.setdefault(tipo_residuo_id, (Acumulador(), 0))
+                # Avaliada contra o histórico anterior do par, como na ingestão
+                suspeito = acumulador.suspeito(peso)
+                if suspeito:
+                    pares[tipo_residuo_id] = (acumulador, suspeitos + 1)
+                else:
+                    acumulador.adicionar(peso)
+                if no_banco and suspeito != suspeito_atual:
+                    alteradas[suspeito].append(pk)
+            fechar_condominio()
+
+            EstatisticaResiduo.objects.using(alias).all().delete()
+            EstatisticaResiduo.objects.using(alias).bulk_create(estatisticas, batch_size=tamanho_lote)
+            if options['marcar_suspeitos']:
+                for suspeito, ids in alteradas.items():
+                    for i in range(0, len(ids), tamanho_lote):
+                        # Nova versão: ETags lidos antes da marcação deixam de valer
+                        CalculoCredito.objects.using(alias).filter(pk__in=ids[i:i + tamanho_lote]).update(
+                            suspeito=suspeito, versao=F('versao') + 1
+                        )
+
+        return len(estatisticas), alteradas
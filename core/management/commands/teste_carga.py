@@ -0,0 +1,149 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core import carga
+from core.models import Condominio, ParametroCalculo, TipoResiduo
+
+
+class Command(BaseCommand):
+    help = (
+        "Teste de carga HTTP com perfil de tráfego (coletas, logins JWT, relatórios "
+        "e listagens) contra --url ou um servidor local iniciado pelo comando. "
+        "Mede p50/p95/p99, vazão e erros por endpoint e o tempo de inicialização do WSGI."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='URL base de um servidor já em execução (ex.: http://127.0.0.1:8000)')
+        parser.add_argument(
+            '--servidor', choices=['runserver', 'gunicorn', 'uvicorn'], default='runserver',
+            help='Servidor local iniciado quando --url não é informado (uvicorn = ASGI)'
+        )
+        parser.add_argument('--workers', type=int, default=1, help='Workers do gunicorn/uvicorn')
+        parser.add_argument('--usuario', default='carga')
+        parser.add_argument('--senha', default='carga-senha')
+        parser.add_argument(
+            '--preparar', action='store_true',
+            help='Cria no banco local o usuário e dados mínimos (condomínios, tipos e parâmetros)'
+        )
+        parser.add_argument('--condominios', type=int, default=20, help='Condomínios criados por --preparar')
+        parser.add_argument('--usuarios', type=int, default=8, help='Usuários virtuais simultâneos')
+        parser.add_argument('--duracao', type=float, default=30, help='Duração da carga em segundos')
+        parser.add_argument('--pausa', type=float, default=0, help='Pausa em segundos entre requisições de cada usuário')
+        parser.add_argument(
+            '--perfil',
+            help='Pesos das operações, ex.: coleta=60,relatorio=15,listagem=15,login=5,relatorio_lote=5'
+        )
+        parser.add_argument(
+            '--inicializacao', type=int, default=5,
+            help='Processos novos para medir a importação de apiReciclagem.wsgi (0 desativa)'
+        )
+        parser.add_argument('--log-servidor', help='Arquivo para a saída do servidor local')
+        parser.add_argument('--saida-json', help='Grava as métricas neste arquivo JSON')
+
+    def handle(self, *args, **options):
+        perfil = self.ler_perfil(options['perfil'])
+        if options['preparar']:
+            if options['url']:
+                raise CommandError('--preparar só vale para o servidor local (sem --url).')
+            self.preparar(options)
+
+        resultado = {}
+        if options['inicializacao']:
+            try:
+                resultado['inicializacao'] = carga.medir_inicializacao(options['inicializacao'])
+            except RuntimeError as e:
+                raise CommandError(str(e))
+            self.imprimir_inicializacao(resultado['inicializacao'])
+
+        processo, log = None, None
+        url = options['url']
+        if not url:
+            porta = carga.porta_livre()
+            if options['log_servidor']:
+                log = open(options['log_servidor'], 'ab')
+            try:
+                processo = carga.iniciar_servidor(options['servidor'], porta, options['workers'], log)
+            except RuntimeError as e:
+                raise CommandError(str(e))
+            url = f'http://127.0.0.1:{porta}'
+            self.stdout.write(f'{options["servidor"]} iniciado em {url}')
+
+        try:
+            teste = carga.Carga(
+                url, options['usuario'], options['senha'], perfil,
+                options['usuarios'], options['duracao'], options['pausa'],
+            )
+            try:
+                resultado['endpoints'] = teste.executar()
+            except RuntimeError as e:
+                raise CommandError(str(e))
+        finally:
+            if processo:
+                carga.parar_servidor(processo)
+            if log:
+                log.close()
+
+        self.imprimir_endpoints(resultado['endpoints'])
+        if options['saida_json']:
+            with open(options['saida_json'], 'w', encoding='utf-8') as arquivo:
+                json.dump(resultado, arquivo, indent=2)
+
+    def ler_perfil(self, texto):
+        if not texto:
+            return None
+        perfil = {}
+        try:
+            for item in texto.split(','):
+                nome, peso = item.split('=')
+                perfil[nome.strip()] = float(peso)
+        except ValueError:
+            raise CommandError('--perfil deve ter o formato operacao=peso,operacao=peso')
+        desconhecidas = set(perfil) - set(carga.PERFIL_PADRAO)
+        if desconhecidas:
+            raise CommandError(f'Operações desconhecidas no perfil: {", ".join(sorted(desconhecidas))}')
+        if not any(perfil.values()):
+            raise CommandError('O perfil precisa de ao menos uma operação com peso positivo.')
+        return perfil
+
+    def preparar(self, options):
+        usuario, _ = User.objects.get_or_create(username=options['usuario'])
+        usuario.set_password(options['senha'])
+        usuario.save()
+
+        if not ParametroCalculo.objects.exists():
+            for nome, fator, eficiencia in [('Plástico', 2.5, 80), ('Papel', 1.2, 70), ('Vidro', 0.8, 90)]:
+                tipo, _ = TipoResiduo.objects.get_or_create(nome=nome)
+                ParametroCalculo.objects.get_or_create(
+                    tipo_residuo=tipo,
+                    defaults={'fator_emissao_padrao': fator, 'eficiencia_reciclagem': eficiencia},
+                )
+        existentes = Condominio.objects.filter(nome__startswith='Carga ').count()
+        for numero in range(existentes, options['condominios']):
+            Condominio.objects.create(
+                nome=f'Carga {numero + 1}', endereco='Endereço de teste', numero_apartamentos=50
+            )
+        self.stdout.write('Dados de carga preparados.')
+
+    def imprimir_inicializacao(self, tempos):
+        for nome, rotulo in [('importacao_wsgi', 'import apiReciclagem.wsgi'), ('processo', 'processo completo')]:
+            medidas = tempos[nome]
+            self.stdout.write(
+                f'Inicialização ({rotulo}): min {medidas["min"] * 1000:.0f} ms, '
+                f'mediana {medidas["mediana"] * 1000:.0f} ms, max {medidas["max"] * 1000:.0f} ms'
+            )
+
+    def imprimir_endpoints(self, endpoints):
+        cabecalho = f'{"endpoint":<30} {"req":>7} {"req/s":>8} {"erros":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8}'
+        self.stdout.write(cabecalho)
+        self.stdout.write('-' * len(cabecalho))
+        for endpoint, metricas in endpoints.items():
+            linha = (
+                f'{endpoint:<30} {metricas["requisicoes"]:>7} {metricas["vazao"]:>8.1f} '
+                f'{metricas["taxa_erros"]:>6.1%} {metricas["p50"]:>8.1f} {metricas["p95"]:>8.1f} '
+                f'{metricas["p99"]:>8.1f} {metricas["max"]:>8.1f}'
+            )
+            if metricas['erros']:
+                linha = self.style.WARNING(linha)
+            self.stdout.write(linha)
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.20 on 2026-10-19 18:38
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_alter_calculocredito_emissao_carbono_atual'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calculocredito',
+            name='id_ingestao',
+            field=models.UUIDField(blank=True, editable=False, help_text='Identificador devolvido pela ingestão assíncrona', null=True),
+        ),
+        migrations.AlterField(
+            model_name='calculocredito',
+            name='data_coleta',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddConstraint(
+            model_name='calculocredito',
+            constraint=models.UniqueConstraint(fields=('id_ingestao', 'data_coleta'), name='calculocredito_id_ingestao_unico'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-19 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_calculocredito_id_ingestao_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calculocredito',
+            name='versao',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Versão do registro para controle de concorrência otimista'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.20 on 2026-10-19 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_calculocredito_versao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TarefaExclusao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modelo', models.CharField(choices=[('condominio', 'Condomínio'), ('tipo_residuo', 'Tipo de resíduo')], max_length=20)),
+                ('objeto_id', models.BigIntegerField()),
+                ('descricao', models.CharField(help_text='Nome do objeto excluído', max_length=200)),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('excluindo', 'Excluindo'), ('concluida', 'Concluída'), ('erro', 'Erro')], default='pendente', max_length=20)),
+                ('total', models.BigIntegerField(default=0, help_text='Coletas a excluir no início da tarefa')),
+                ('excluidos', models.BigIntegerField(default=0, help_text='Coletas já excluídas')),
+                ('erro', models.TextField(blank=True, null=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Tarefa de Exclusão',
+                'verbose_name_plural': 'Tarefas de Exclusão',
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.20 on 2026-10-19 18:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_tarefaexclusao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calculocredito',
+            name='suspeito',
+            field=models.BooleanField(default=False, editable=False, help_text='Peso muito fora da distribuição do condomínio/tipo (possível erro de balança)'),
+        ),
+        migrations.CreateModel(
+            name='EstatisticaResiduo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('contagem', models.BigIntegerField(default=0)),
+                ('media', models.FloatField(default=0)),
+                ('m2', models.FloatField(default=0, help_text='Soma dos quadrados dos desvios (Welford)')),
+                ('esboco', models.JSONField(default=dict, help_text='Esboço de quantis do peso')),
+                ('suspeitos', models.BigIntegerField(default=0, help_text='Coletas marcadas como suspeitas')),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('condominio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.condominio')),
+                ('tipo_residuo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.tiporesiduo')),
+            ],
+            options={
+                'verbose_name': 'Estatística de Resíduo',
+                'verbose_name_plural': 'Estatísticas de Resíduos',
+                'unique_together': {('condominio', 'tipo_residuo')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.20 on 2026-10-19 18:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_calculocredito_suspeito_estatisticaresiduo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MapaShard',
+            fields=[
+                ('condominio', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='core.condominio')),
+                ('alias', models.CharField(max_length=50)),
+            ],
+            options={
+                'verbose_name': 'Mapa de Shard',
+                'verbose_name_plural': 'Mapa de Shards',
+            },
+        ),
+    ]
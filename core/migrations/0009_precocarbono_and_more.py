@@ -0,0 +1,33 @@
+# Generated by Django 4.2.20 on 2026-10-19 18:50
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_mapashard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrecoCarbono',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('preco_tonelada_usd', models.DecimalField(decimal_places=2, help_text='Preço em USD por tonelada de CO2', max_digits=10, validators=[django.core.validators.MinValueValidator(0)])),
+                ('vigente_de', models.DateField(help_text='Primeiro dia de vigência')),
+                ('vigente_ate', models.DateField(blank=True, help_text='Primeiro dia em que o preço deixa de valer (vazio = sem fim)', null=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Preço do Carbono',
+                'verbose_name_plural': 'Preços do Carbono',
+                'ordering': ['vigente_de'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='precocarbono',
+            constraint=models.CheckConstraint(check=models.Q(('vigente_ate__isnull', True), ('vigente_ate__gt', models.F('vigente_de')), _connector='OR'), name='precocarbono_vigencia_valida'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.20 on 2026-10-19 18:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_precocarbono_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BenchmarkResiduo',
+            fields=[
+                ('tipo_residuo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='core.tiporesiduo')),
+                ('percentis', models.JSONField(help_text='Valores nos percentis 0, 5, ..., 100 (kg CO2 por apartamento a cada 30 dias)')),
+                ('condominios', models.IntegerField(help_text='Condomínios na amostra')),
+                ('periodo_inicio', models.DateTimeField()),
+                ('periodo_fim', models.DateTimeField()),
+                ('calculado_em', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Benchmark de Resíduo',
+                'verbose_name_plural': 'Benchmarks de Resíduos',
+            },
+        ),
+    ]
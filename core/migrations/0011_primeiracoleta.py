@@ -0,0 +1,25 @@
+# Generated by Django 4.2.20 on 2026-10-19 19:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_benchmarkresiduo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrimeiraColeta',
+            fields=[
+                ('condominio', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='core.condominio')),
+                ('data', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Primeira Coleta',
+                'verbose_name_plural': 'Primeiras Coletas',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+RESTRICAO = 'precocarbono_sem_sobreposicao'
+
+
+def criar_restricao(apps, schema_editor):
+    # Só o PostgreSQL tem restrição de exclusão; nos demais bancos vale a
+    # verificação de PrecoCarbono.save()
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f"ALTER TABLE core_precocarbono ADD CONSTRAINT {RESTRICAO} "
+        f"EXCLUDE USING gist (daterange(vigente_de, vigente_ate, '[)') WITH &&)"
+    )
+
+
+def remover_restricao(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f"ALTER TABLE core_precocarbono DROP CONSTRAINT IF EXISTS {RESTRICAO}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_primeiracoleta'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_restricao, remover_restricao),
+    ]
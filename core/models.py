@@ -1,5 +1,7 @@
-from django.db import models
+from django.db import models, transaction
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 
 class TipoResiduo(models.Model):
     """
@@ -23,7 +25,9 @@ class CalculoCredito(models.Model):
         validators=[MinValueValidator(0)],
         help_text="Peso do resíduo em kg"
     )
-    data_coleta = models.DateTimeField(auto_now_add=True)
+    # default em vez de auto_now_add para que a ingestão assíncrona preserve
+    # o momento em que a coleta foi aceita ao gravar em lote
+    data_coleta = models.DateTimeField(default=timezone.now, editable=False)
     
     # Dados de cálculo de crédito de carbono
     emissao_carbono_atual = models.FloatField(
@@ -58,11 +62,34 @@ class CalculoCredito(models.Model):
         null=True,
         help_text="Custo potencial de reciclagem (R$)"
     )
+    id_ingestao = models.UUIDField(
+        blank=True,
+        null=True,
+        editable=False,
+        help_text="Identificador devolvido pela ingestão assíncrona"
+    )
+    versao = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Versão do registro para controle de concorrência otimista"
+    )
+    suspeito = models.BooleanField(
+        default=False,
+        editable=False,
+        help_text="Peso muito fora da distribuição do condomínio/tipo (possível erro de balança)"
+    )
     
     class Meta:
         verbose_name = 'Cálculo de Crédito de Carbono'
         verbose_name_plural = 'Cálculos de Crédito de Carbono'
         unique_together = ['condominio', 'tipo_residuo', 'data_coleta']
+        constraints = [
+            # Inclui data_coleta para ser aceita também com a tabela particionada
+            models.UniqueConstraint(
+                fields=['id_ingestao', 'data_coleta'],
+                name='calculocredito_id_ingestao_unico'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.condominio} - {self.tipo_residuo} ({self.data_coleta.date()})"
@@ -72,6 +99,9 @@ class CalculoCredito(models.Model):
         Calcula automaticamente a economia de carbono ao salvar
         """
         self.economia_carbono = self.emissao_carbono_atual - self.emissao_carbono_reciclagem
+        if not self._state.adding:
+            # Invalida os ETags de quem leu a versão anterior (ex.: edição pelo admin)
+            self.versao += 1
         super().save(*args, **kwargs)
 
 class Condominio(models.Model):
@@ -108,4 +138,192 @@ class ParametroCalculo(models.Model):
     )
     
     def __str__(self):
-        return f"Parâmetros para {self.tipo_residuo}"
\ No newline at end of file
+        return f"Parâmetros para {self.tipo_residuo}"
+
+class PrecoCarbono(models.Model):
+    """
+    Preço de mercado do crédito de carbono vigente em um intervalo de datas,
+    usado para valorar a economia de cada coleta pelo preço do seu dia
+    """
+    preco_tonelada_usd = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        validators=[MinValueValidator(0)],
+        help_text="Preço em USD por tonelada de CO2"
+    )
+    vigente_de = models.DateField(help_text="Primeiro dia de vigência")
+    vigente_ate = models.DateField(
+        blank=True,
+        null=True,
+        help_text="Primeiro dia em que o preço deixa de valer (vazio = sem fim)"
+    )
+    criado_em = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Preço do Carbono'
+        verbose_name_plural = 'Preços do Carbono'
+        ordering = ['vigente_de']
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(vigente_ate__isnull=True) | models.Q(vigente_ate__gt=models.F('vigente_de')),
+                name='precocarbono_vigencia_valida'
+            ),
+        ]
+    
+    def __str__(self):
+        fim = self.vigente_ate or '...'
+        return f"US$ {self.preco_tonelada_usd}/t ({self.vigente_de} a {fim})"
+    
+    def clean(self):
+        """Impede vigências sobrepostas"""
+        if self.vigente_de is None:
+            return
+        if self.vigente_ate is not None and self.vigente_ate <= self.vigente_de:
+            raise ValidationError({'vigente_ate': 'Deve ser posterior ao início da vigência.'})
+        self.validar_sobreposicao()
+    
+    def validar_sobreposicao(self):
+        sobrepostos = PrecoCarbono.objects.exclude(pk=self.pk).filter(
+            models.Q(vigente_ate__isnull=True) | models.Q(vigente_ate__gt=self.vigente_de)
+        )
+        if self.vigente_ate is not None:
+            sobrepostos = sobrepostos.filter(vigente_de__lt=self.vigente_ate)
+        if sobrepostos.exists():
+            raise ValidationError('A vigência se sobrepõe a outro preço cadastrado.')
+    
+    def save(self, *args, **kwargs):
+        """
+        Recusa vigências sobrepostas também fora do admin, pois a valoração
+        supõe um só preço por dia. No PostgreSQL a restrição de exclusão
+        precocarbono_sem_sobreposicao cobre gravações concorrentes.
+        """
+        with transaction.atomic():
+            self.validar_sobreposicao()
+            super().save(*args, **kwargs)
+
+class EstatisticaResiduo(models.Model):
+    """
+    Estatísticas incrementais do peso das coletas por condomínio e tipo de
+    resíduo, usadas para detectar pesos suspeitos na ingestão
+    """
+    condominio = models.ForeignKey(Condominio, on_delete=models.CASCADE)
+    tipo_residuo = models.ForeignKey(TipoResiduo, on_delete=models.CASCADE)
+    contagem = models.BigIntegerField(default=0)
+    media = models.FloatField(default=0)
+    m2 = models.FloatField(default=0, help_text="Soma dos quadrados dos desvios (Welford)")
+    esboco = models.JSONField(default=dict, help_text="Esboço de quantis do peso")
+    suspeitos = models.BigIntegerField(default=0, help_text="Coletas marcadas como suspeitas")
+    atualizado_em = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Estatística de Resíduo'
+        verbose_name_plural = 'Estatísticas de Resíduos'
+        unique_together = ['condominio', 'tipo_residuo']
+    
+    def __str__(self):
+        return f"Estatísticas de {self.tipo_residuo} em {self.condominio}"
+
+class BenchmarkResiduo(models.Model):
+    """
+    Distribuição, entre os condomínios, da economia de carbono por apartamento
+    a cada 30 dias de um tipo de resíduo. Pré-calculada pelo comando
+    calcular_benchmarks e usada nas recomendações dos relatórios.
+    """
+    tipo_residuo = models.OneToOneField(
+        TipoResiduo,
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    percentis = models.JSONField(
+        help_text="Valores nos percentis 0, 5, ..., 100 (kg CO2 por apartamento a cada 30 dias)"
+    )
+    condominios = models.IntegerField(help_text="Condomínios na amostra")
+    periodo_inicio = models.DateTimeField()
+    periodo_fim = models.DateTimeField()
+    calculado_em = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Benchmark de Resíduo'
+        verbose_name_plural = 'Benchmarks de Resíduos'
+    
+    def __str__(self):
+        return f"Benchmark de {self.tipo_residuo}"
+
+class PrimeiraColeta(models.Model):
+    """
+    Data da primeira coleta (banco ou arquivo frio) de cada condomínio, início
+    do período dos relatórios sem data_inicio. Gravada pelo comando
+    calcular_benchmarks; os relatórios só a leem.
+    """
+    condominio = models.OneToOneField(
+        Condominio,
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    data = models.DateTimeField()
+    
+    class Meta:
+        verbose_name = 'Primeira Coleta'
+        verbose_name_plural = 'Primeiras Coletas'
+    
+    def __str__(self):
+        return f"Primeira coleta de {self.condominio}"
+
+class MapaShard(models.Model):
+    """
+    Banco (alias de DATABASES) que guarda as coletas de cada condomínio
+    """
+    condominio = models.OneToOneField(
+        Condominio,
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    alias = models.CharField(max_length=50)
+    
+    class Meta:
+        verbose_name = 'Mapa de Shard'
+        verbose_name_plural = 'Mapa de Shards'
+    
+    def __str__(self):
+        return f"{self.condominio} -> {self.alias}"
+
+class TarefaExclusao(models.Model):
+    """
+    Exclusão em segundo plano de um condomínio ou tipo de resíduo: as coletas
+    dependentes são removidas em lotes antes do próprio objeto
+    """
+    MODELOS = [
+        ('condominio', 'Condomínio'),
+        ('tipo_residuo', 'Tipo de resíduo'),
+    ]
+    STATUS = [
+        ('pendente', 'Pendente'),
+        ('excluindo', 'Excluindo'),
+        ('concluida', 'Concluída'),
+        ('erro', 'Erro'),
+    ]
+    modelo = models.CharField(max_length=20, choices=MODELOS)
+    objeto_id = models.BigIntegerField()
+    descricao = models.CharField(max_length=200, help_text="Nome do objeto excluído")
+    status = models.CharField(max_length=20, choices=STATUS, default='pendente')
+    total = models.BigIntegerField(default=0, help_text="Coletas a excluir no início da tarefa")
+    excluidos = models.BigIntegerField(default=0, help_text="Coletas já excluídas")
+    erro = models.TextField(blank=True, null=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    atualizado_em = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Tarefa de Exclusão'
+        verbose_name_plural = 'Tarefas de Exclusão'
+    
+    def __str__(self):
+        return f"Exclusão de {self.descricao} ({self.get_status_display()})"
+    
+    @property
+    def progresso(self):
+        """Percentual de coletas já excluídas"""
+        if self.status == 'concluida':
+            return 100
+        if not self.total:
+            return 0
+        return min(100, round(self.excluidos * 100 / self.total, 1))
@@ -0,0 +1,278 @@
+"""
+Particionamento mensal da tabela de CalculoCredito por data_coleta (PostgreSQL)
+
+A tabela vira uma tabela particionada por faixa (RANGE) com uma partição por mês
+e uma partição padrão para datas fora das faixas criadas. Assim as consultas
+limitadas por data (ex.: relatorio_economia) só leem as partições do período e
+VACUUM/manutenção de índices trabalham em tabelas pequenas.
+"""
+import re
+from datetime import date, datetime, timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import arquivo_frio
+from .models import CalculoCredito
+
+TABELA = CalculoCredito._meta.db_table
+PARTICAO_PADRAO = f'{TABELA}_padrao'
+SEQUENCIA = f'{TABELA}_id_mensal_seq'
+_PADRAO_NOME = re.compile(rf'^{TABELA}_p(\d{{4}})(\d{{2}})$')
+
+
+def particionamento_disponivel(conexao=connection):
+    """Indica se o modo particionado está habilitado e o banco é PostgreSQL"""
+    return settings.CALCULO_CREDITO_PARTICIONADO and conexao.vendor == 'postgresql'
+
+
+def inicio_mes(data):
+    return date(data.year, data.month, 1)
+
+
+def somar_meses(mes, quantidade):
+    indice = mes.year * 12 + mes.month - 1 + quantidade
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def nome_particao(mes):
+    return f'{TABELA}_p{mes:%Y%m}'
+
+
+def _limite(mes):
+    # data_coleta é timestamptz; os limites são sempre meia-noite UTC
+    return datetime(mes.year, mes.month, 1, tzinfo=timezone.utc)
+
+
+def _q(nome):
+    return connection.ops.quote_name(nome)
+
+
+def tabela_particionada(cursor):
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))",
+        [TABELA]
+    )
+    return cursor.fetchone()[0]
+
+
+def listar_particoes(cursor):
+    """
+    Retorna {mes: nome_da_particao} das partições mensais anexadas
+    (a partição padrão não entra na lista)
+    """
+    cursor.execute(
+        """
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        """,
+        [TABELA]
+    )
+    particoes = {}
+    for (nome,) in cursor.fetchall():
+        encontrado = _PADRAO_NOME.match(nome)
+        if encontrado:
+            particoes[date(int(encontrado.group(1)), int(encontrado.group(2)), 1)] = nome
+    return particoes
+
+
+def criar_particao(cursor, mes):
+    """
+    Cria a partição do mês. Se a partição padrão já tiver linhas nessa faixa,
+    as linhas são movidas para a nova partição antes de anexá-la.
+    """
+    nome = nome_particao(mes)
+    inicio, fim = _limite(mes), _limite(somar_meses(mes, 1))
+
+    cursor.execute(
+        f"SELECT EXISTS (SELECT 1 FROM {_q(PARTICAO_PADRAO)} WHERE data_coleta >= %s AND data_coleta < %s)",
+        [inicio, fim]
+    )
+    if not cursor.fetchone()[0]:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {_q(nome)} PARTITION OF {_q(TABELA)} "
+            f"FOR VALUES FROM (%s) TO (%s)",
+            [inicio, fim]
+        )
+        return nome
+
+    # ATTACH PARTITION exige as mesmas restrições CHECK da tabela particionada
+    cursor.execute(f"CREATE TABLE {_q(nome)} (LIKE {_q(TABELA)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute(
+        f"WITH movidas AS ("
+        f"  DELETE FROM {_q(PARTICAO_PADRAO)} WHERE data_coleta >= %s AND data_coleta < %s RETURNING *"
+        f") INSERT INTO {_q(nome)} SELECT * FROM movidas",
+        [inicio, fim]
+    )
+    cursor.execute(
+        f"ALTER TABLE {_q(TABELA)} ATTACH PARTITION {_q(nome)} FOR VALUES FROM (%s) TO (%s)",
+        [inicio, fim]
+    )
+    return nome
+
+
+def criar_particoes_futuras(cursor, meses_futuros, hoje=None):
+    """Garante partições do mês atual até `meses_futuros` meses à frente"""
+    atual = inicio_mes(hoje or date.today())
+    existentes = listar_particoes(cursor)
+    criadas = []
+    for deslocamento in range(meses_futuros + 1):
+        mes = somar_meses(atual, deslocamento)
+        if mes not in existentes:
+            criadas.append(criar_particao(cursor, mes))
+    return criadas
+
+
+def desanexar_particoes_antigas(cursor, retencao_meses, esquema_arquivo, excluir=False, hoje=None,
+                                arquivar=False):
+    """
+    Desanexa as partições de meses anteriores à janela de retenção. As partições
+    desanexadas são movidas para `esquema_arquivo` (ou excluídas, se `excluir`).
+
+    Só partições vazias são desanexadas: arquivo_frio.arquivar_mes remove do
+    banco as linhas que grava, então linhas restantes ainda não estão no
+    arquivo frio e sumiriam dos relatórios. Com `arquivar`, o mês é arquivado
+    antes. Retorna (desanexadas, pendentes de arquivamento).
+    """
+    limite = somar_meses(inicio_mes(hoje or date.today()), -retencao_meses)
+    removidas = []
+    pendentes = []
+    for mes, nome in sorted(listar_particoes(cursor).items()):
+        if mes >= limite:
+            continue
+        if arquivar:
+            arquivo_frio.arquivar_mes(mes)
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {_q(nome)})")
+        if cursor.fetchone()[0]:
+            pendentes.append(nome)
+            continue
+        cursor.execute(f"ALTER TABLE {_q(TABELA)} DETACH PARTITION {_q(nome)}")
+        if excluir:
+            cursor.execute(f"DROP TABLE {_q(nome)}")
+        else:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {_q(esquema_arquivo)}")
+            cursor.execute(f"ALTER TABLE {_q(nome)} SET SCHEMA {_q(esquema_arquivo)}")
+        removidas.append(nome)
+    return removidas, pendentes
+
+
+def _restricoes(cursor):
+    """
+    (nome, tipo, colunas, definição) da chave primária, das restrições únicas
+    e das chaves estrangeiras da tabela
+    """
+    cursor.execute(
+        """
+        SELECT c.conname, c.contype,
+               ARRAY(
+                   SELECT a.attname::text
+                   FROM unnest(c.conkey) WITH ORDINALITY AS k(numero, ordem)
+                   JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.numero
+                   ORDER BY k.ordem
+               ),
+               pg_get_constraintdef(c.oid)
+        FROM pg_constraint c
+        WHERE c.conrelid = to_regclass(%s) AND c.contype IN ('p', 'u', 'f')
+        ORDER BY c.contype DESC, c.conname
+        """,
+        [TABELA]
+    )
+    return cursor.fetchall()
+
+
+def _indices(cursor):
+    """(nome, CREATE INDEX) dos índices que não pertencem a uma restrição"""
+    cursor.execute(
+        """
+        SELECT i.relname, pg_get_indexdef(i.oid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = to_regclass(%s)
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_constraint c WHERE c.conrelid = x.indrelid AND c.conindid = x.indexrelid
+          )
+        ORDER BY i.relname
+        """,
+        [TABELA]
+    )
+    return cursor.fetchall()
+
+
+def converter_tabela(meses_futuros):
+    """
+    Converte a tabela comum criada pelas migrations em tabela particionada
+    por mês, copiando as linhas existentes.
+
+    As restrições e índices mantêm os nomes dados pelas migrations. A chave
+    primária passa a ser (id, data_coleta), pois o PostgreSQL exige que a
+    chave de partição faça parte de toda restrição única.
+    """
+    legado = f'{TABELA}_legado'
+    with transaction.atomic(), connection.cursor() as cursor:
+        if tabela_particionada(cursor):
+            return []
+
+        cursor.execute(f"LOCK TABLE {_q(TABELA)} IN ACCESS EXCLUSIVE MODE")
+        restricoes = _restricoes(cursor)
+        # As definições lidas antes da troca de nome já apontam para TABELA
+        indices = _indices(cursor)
+        cursor.execute(f"ALTER TABLE {_q(TABELA)} RENAME TO {_q(legado)}")
+        # Libera os nomes (os índices são únicos por esquema); a tabela antiga
+        # só é lida até o fim da conversão
+        for nome, _definicao in indices:
+            cursor.execute(f"DROP INDEX {_q(nome)}")
+        for nome, tipo, _colunas, _definicao in restricoes:
+            if tipo != 'f':
+                cursor.execute(f"ALTER TABLE {_q(legado)} DROP CONSTRAINT {_q(nome)}")
+        cursor.execute(
+            f"CREATE TABLE {_q(TABELA)} (LIKE {_q(legado)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            f"PARTITION BY RANGE (data_coleta)"
+        )
+
+        # Colunas identity só são aceitas em tabelas particionadas a partir do
+        # PostgreSQL 17, então o id passa a usar uma sequência própria.
+        cursor.execute(f"CREATE SEQUENCE {_q(SEQUENCIA)} OWNED BY {_q(TABELA)}.id")
+        cursor.execute(
+            f"ALTER TABLE {_q(TABELA)} ALTER COLUMN id SET DEFAULT nextval(%s::regclass)",
+            [SEQUENCIA]
+        )
+
+        for nome, tipo, colunas, definicao in restricoes:
+            if tipo == 'f':
+                cursor.execute(f"ALTER TABLE {_q(TABELA)} ADD CONSTRAINT {_q(nome)} {definicao}")
+                continue
+            if 'data_coleta' not in colunas:
+                colunas = [*colunas, 'data_coleta']
+            cursor.execute(
+                f"ALTER TABLE {_q(TABELA)} ADD CONSTRAINT {_q(nome)} "
+                f"{'PRIMARY KEY' if tipo == 'p' else 'UNIQUE'} ({', '.join(_q(coluna) for coluna in colunas)})"
+            )
+        for _nome, definicao in indices:
+            cursor.execute(definicao)
+        cursor.execute(
+            f"CREATE INDEX {_q(TABELA + '_condominio_data_mensal')} "
+            f"ON {_q(TABELA)} (condominio_id, data_coleta)"
+        )
+        cursor.execute(f"CREATE TABLE {_q(PARTICAO_PADRAO)} PARTITION OF {_q(TABELA)} DEFAULT")
+
+        # Partições para todo o histórico existente mais os meses futuros
+        cursor.execute(f"SELECT min(data_coleta) FROM {_q(legado)}")
+        mais_antiga = cursor.fetchone()[0]
+        criadas = []
+        if mais_antiga:
+            mes = inicio_mes(mais_antiga.astimezone(timezone.utc))
+            atual = inicio_mes(date.today())
+            while mes < atual:
+                criadas.append(criar_particao(cursor, mes))
+                mes = somar_meses(mes, 1)
+        criadas += criar_particoes_futuras(cursor, meses_futuros)
+
+        cursor.execute(f"INSERT INTO {_q(TABELA)} SELECT * FROM {_q(legado)}")
+        cursor.execute(
+            f"SELECT setval(%s::regclass, COALESCE((SELECT max(id) FROM {_q(TABELA)}), 0) + 1, false)",
+            [SEQUENCIA]
+        )
+        cursor.execute(f"DROP TABLE {_q(legado)}")
+    return criadas
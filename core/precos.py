@@ -0,0 +1,120 @@
+"""
+Preço do crédito de carbono ao longo do tempo
+
+As vigências de PrecoCarbono ficam em memória como uma lista ordenada de
+intervalos [início, fim) com o preço por tonelada. A valoração no banco usa
+esses intervalos em um único Sum(Case(When(...))) — cada coleta é multiplicada
+pelo preço do seu dia, qualquer que seja a extensão do período. Dias sem preço
+cadastrado usam PRECO_CARBONO_PADRAO_USD.
+
+O cache expira após PRECO_CARBONO_CACHE_SEGUNDOS e é invalidado no processo
+que grava ou exclui um preço.
+"""
+import threading
+import time as relogio
+from bisect import bisect_right
+from datetime import datetime, time
+
+from django.conf import settings
+from django.db.models import Case, F, FloatField, Sum, Value, When
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+_cache = None
+_cache_trava = threading.Lock()
+
+
+class Intervalos:
+    """Vigências ordenadas, com busca do preço de um instante por bisect"""
+
+    def __init__(self, vigencias):
+        # vigencias: [(início, fim ou None, preço por tonelada)] sem sobreposição
+        self.vigencias = sorted(vigencias, key=lambda vigencia: vigencia[0])
+        self.inicios = [inicio for inicio, _, _ in self.vigencias]
+        self.carregado_em = relogio.monotonic()
+
+    def preco_em(self, instante):
+        indice = bisect_right(self.inicios, instante) - 1
+        if indice >= 0:
+            _, fim, preco = self.vigencias[indice]
+            if fim is None or instante < fim:
+                return preco
+        return preco_padrao()
+
+    def preco_constante(self, inicio, fim):
+        """Preço único em [inicio, fim), ou None se alguma vigência começa ou termina dentro dele"""
+        for de, ate, _ in self.vigencias:
+            if inicio < de < fim or (ate is not None and inicio < ate < fim):
+                return None
+        return self.preco_em(inicio)
+
+    def no_periodo(self, inicio=None, fim=None):
+        """Vigências que se sobrepõem ao período [inicio, fim]"""
+        return [
+            (de, ate, preco) for de, ate, preco in self.vigencias
+            if (inicio is None or ate is None or ate > inicio) and (fim is None or de <= fim)
+        ]
+
+
+def preco_padrao():
+    return float(settings.PRECO_CARBONO_PADRAO_USD)
+
+
+def _inicio_do_dia(dia):
+    return timezone.make_aware(datetime.combine(dia, time.min))
+
+
+def obter_intervalos():
+    global _cache
+    with _cache_trava:
+        if _cache is None or relogio.monotonic() - _cache.carregado_em > settings.PRECO_CARBONO_CACHE_SEGUNDOS:
+            from .models import PrecoCarbono
+
+            _cache = Intervalos([
+                (
+                    _inicio_do_dia(vigente_de),
+                    _inicio_do_dia(vigente_ate) if vigente_ate else None,
+                    float(preco),
+                )
+                for vigente_de, vigente_ate, preco in PrecoCarbono.objects.using('default').values_list(
+                    'vigente_de', 'vigente_ate', 'preco_tonelada_usd'
+                )
+            ])
+        return _cache
+
+
+def invalidar(**kwargs):
+    global _cache
+    with _cache_trava:
+        _cache = None
+
+
+def expressao_valor(inicio=None, fim=None, filtro=None):
+    """
+    Soma da economia das coletas (kg CO2) valorada pelo preço do dia de cada
+    uma, em USD. Só as vigências que tocam o período entram no CASE; `filtro`
+    (Q) restringe as coletas somadas.
+    """
+    casos = []
+    for de, ate, preco in obter_intervalos().no_periodo(inicio, fim):
+        faixa = {'data_coleta__gte': de}
+        if ate is not None:
+            faixa['data_coleta__lt'] = ate
+        casos.append(When(**faixa, then=F('economia_carbono') * Value(preco / 1000)))
+    return Sum(Case(
+        *casos,
+        default=F('economia_carbono') * Value(preco_padrao() / 1000),
+        output_field=FloatField(),
+    ), filter=filtro)
+
+
+def valorar(economia_kg, instante):
+    """Valor em USD da economia de uma coleta feita em `instante`"""
+    return economia_kg / 1000 * obter_intervalos().preco_em(instante)
+
+
+def conectar_invalidacao():
+    from .models import PrecoCarbono
+
+    post_save.connect(invalidar, sender=PrecoCarbono, dispatch_uid='invalidar_precos')
+    post_delete.connect(invalidar, sender=PrecoCarbono, dispatch_uid='invalidar_precos')
@@ -0,0 +1,120 @@
+"""
+Motor dos relatórios de economia
+
+Soma os agregados das coletas no banco (dados quentes) com os do arquivo frio,
+de forma que os relatórios cubram todo o histórico com o banco guardando só os
+meses recentes.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, Min, Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import arquivo_frio, precos, shards
+from .arquivo_frio import SUSPEITOS, TOTAIS, VALOR, somar
+from .models import CalculoCredito, TipoResiduo
+
+
+def converter_data(valor):
+    """
+    Converte o parâmetro de data do relatório (data ou data/hora ISO) em
+    datetime com fuso; datas sem hora valem a partir da meia-noite
+    """
+    if not valor:
+        return None
+    data = parse_datetime(valor)
+    if data is None:
+        dia = parse_date(valor)
+        if dia is None:
+            raise ValueError(f'Data inválida: {valor}')
+        data = datetime.combine(dia, time.min)
+    if timezone.is_naive(data):
+        data = timezone.make_aware(data)
+    return data
+
+
+def agregar_por_tipo(condominio_ids, inicio=None, fim=None):
+    """
+    Totais por (condominio_id, tipo_residuo_id) no período [inicio, fim],
+    juntando o banco e o arquivo frio, com a economia valorada pelo preço do
+    carbono do dia de cada coleta (VALOR). Coletas com peso suspeito ficam
+    fora dos totais e são contadas em SUSPEITOS.
+    """
+    confiaveis = Q(suspeito=False)
+    valor = precos.expressao_valor(inicio, fim, filtro=confiaveis)
+
+    def agregar_shard(alias, ids):
+        consulta = CalculoCredito.objects.using(alias).filter(condominio_id__in=ids)
+        if inicio:
+            consulta = consulta.filter(data_coleta__gte=inicio)
+        if fim:
+            consulta = consulta.filter(data_coleta__lte=fim)
+        return list(consulta.values('condominio_id', 'tipo_residuo_id').annotate(
+            **{nome: Sum(coluna, filter=confiaveis) for nome, coluna in TOTAIS.items()},
+            **{VALOR: valor, SUSPEITOS: Count('id', filter=Q(suspeito=True))}
+        ).order_by())
+
+    # Uma consulta agrupada por shard, em paralelo
+    resultado = {}
+    for linhas in shards.em_paralelo(agregar_shard, shards.agrupar_por_shard(condominio_ids)).values():
+        for linha in linhas:
+            resultado[(linha['condominio_id'], linha['tipo_residuo_id'])] = {
+                nome: linha[nome] for nome in [*TOTAIS, VALOR, SUSPEITOS]
+            }
+
+    for chave, arquivados in arquivo_frio.agregar(condominio_ids, inicio, fim, valorar=True).items():
+        totais = resultado.setdefault(chave, {**arquivo_frio.totais_vazios(), VALOR: None, SUSPEITOS: 0})
+        for nome, valor_arquivado in arquivados.items():
+            totais[nome] = somar(totais.get(nome), valor_arquivado)
+    return resultado
+
+
+def primeiras_coletas(condominio_ids):
+    """Data da primeira coleta (banco ou arquivo frio) de cada condomínio"""
+    def primeiras_shard(alias, ids):
+        return list(CalculoCredito.objects.using(alias).filter(condominio_id__in=ids).values(
+            'condominio_id'
+        ).annotate(primeira=Min('data_coleta')).values_list('condominio_id', 'primeira').order_by())
+
+    resultado = {}
+    for linhas in shards.em_paralelo(primeiras_shard, shards.agrupar_por_shard(condominio_ids)).values():
+        resultado.update(linhas)
+    for condominio_id, data in arquivo_frio.primeiras_coletas(condominio_ids).items():
+        if condominio_id not in resultado or data < resultado[condominio_id]:
+            resultado[condominio_id] = data
+    return resultado
+
+
+def dias_do_periodo(inicio, fim=None):
+    """Duração em dias (no mínimo 1) do período que começa em `inicio`"""
+    if inicio is None:
+        return None
+    return max((fim or timezone.now()) - inicio, timedelta(days=1)) / timedelta(days=1)
+
+
+def resumir(agregados):
+    """
+    Monta, por condomínio, o resumo por tipo de resíduo (ordenado pelo nome)
+    e o total geral no formato do relatorio_economia
+    """
+    nomes = dict(
+        TipoResiduo.objects.filter(id__in={tipo for _, tipo in agregados}).values_list('id', 'nome')
+    )
+    resumos = {}
+    for (condominio_id, tipo_residuo_id), totais in agregados.items():
+        resumos.setdefault(condominio_id, []).append(
+            {'tipo_residuo__nome': nomes.get(tipo_residuo_id), **totais}
+        )
+
+    resultado = {}
+    for condominio_id, resumo_por_tipo in resumos.items():
+        resumo_por_tipo.sort(key=lambda item: item['tipo_residuo__nome'] or '')
+        total_geral = {
+            nome: sum(item.get(nome) or 0 for item in resumo_por_tipo) for nome in [*TOTAIS, VALOR, SUSPEITOS]
+        }
+        resultado[condominio_id] = {
+            'resumo_por_tipo': resumo_por_tipo,
+            'total_geral': total_geral,
+        }
+    return resultado
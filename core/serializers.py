@@ -1,7 +1,18 @@
 from rest_framework import serializers
-from .models import TipoResiduo, CalculoCredito, Condominio, ParametroCalculo
+from . import exclusao
+from .models import TipoResiduo, CalculoCredito, Condominio, ParametroCalculo, TarefaExclusao
 
-class TipoResiduoSerializer(serializers.ModelSerializer):
+class StatusExclusaoMixin(serializers.Serializer):
+    """status_exclusao: pendente/excluindo enquanto há tarefa de exclusão ativa"""
+    status_exclusao = serializers.SerializerMethodField()
+    
+    def get_status_exclusao(self, obj):
+        # As listagens já trazem o status anotado (exclusao.anotar_status_exclusao)
+        if hasattr(obj, 'status_exclusao'):
+            return obj.status_exclusao
+        return exclusao.status_exclusao(obj)
+
+class TipoResiduoSerializer(StatusExclusaoMixin, serializers.ModelSerializer):
     class Meta:
         model = TipoResiduo
         fields = '__all__'
@@ -11,7 +22,7 @@ class CalculoCreditoSerializer(serializers.ModelSerializer):
         model = CalculoCredito
         fields = '__all__'
 
-class CondominioSerializer(serializers.ModelSerializer):
+class CondominioSerializer(StatusExclusaoMixin, serializers.ModelSerializer):
     class Meta:
         model = Condominio
         fields = '__all__'
@@ -39,8 +50,33 @@ class CalculoCreditoSerializer(serializers.ModelSerializer):
             'emissao_carbono_reciclagem',
             'economia_carbono',
             'custo_descarte_atual',
-            'custo_reciclagem'
+            'custo_reciclagem',
+            'id_ingestao',
+            'versao',
+            'suspeito'
         ]
-        read_only_fields = ['economia_carbono', 'emissao_carbono_atual', 'emissao_carbono_reciclagem']  # Calculado automaticamente no model e na view
+        read_only_fields = ['economia_carbono', 'emissao_carbono_atual', 'emissao_carbono_reciclagem', 'suspeito']  # Calculado automaticamente no model e na view
 
+    def validate(self, attrs):
+        # Condomínio ou tipo em exclusão não recebe novas coletas
+        excluindo = exclusao.em_exclusao(
+            condominio=attrs.get('condominio'), tipo_residuo=attrs.get('tipo_residuo')
+        )
+        if excluindo:
+            raise serializers.ValidationError({
+                campo: f'{attrs[campo]} está sendo excluído.' for campo in excluindo
+            })
+        return attrs
+    
+    def create(self, validated_data):
+        # save() na instância deixa o roteador gravar no shard do condomínio
+        calculo = CalculoCredito(**validated_data)
+        calculo.save()
+        return calculo
 
+class TarefaExclusaoSerializer(serializers.ModelSerializer):
+    progresso = serializers.ReadOnlyField()
+    
+    class Meta:
+        model = TarefaExclusao
+        fields = '__all__'
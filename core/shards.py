@@ -0,0 +1,303 @@
+"""
+Sharding horizontal das coletas por condomínio
+
+As coletas (CalculoCredito) e as estatísticas de peso (EstatisticaResiduo) de
+cada condomínio ficam em um dos bancos listados em SHARDS, escolhido pelo mapa
+MapaShard (guardado no banco default). As tabelas de referência (Condominio,
+TipoResiduo, ParametroCalculo) são mantidas no default e replicadas para os
+demais shards, para que as chaves estrangeiras e os joins continuem locais.
+
+Cada shard recebe uma faixa própria de ids (índice do shard * BLOCO_IDS), de
+modo que o shard de uma coleta é deduzido do próprio id.
+
+Ao configurar os shards, execute preparar_shards antes de cadastrar dados de
+referência. A replicação acontece após o commit no default; se um shard
+falhar, o erro é registrado no log e preparar_shards ressincroniza as cópias.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Count
+from django.db.models.signals import post_delete, post_save
+
+logger = logging.getLogger(__name__)
+
+BLOCO_IDS = 10 ** 15
+
+MODELOS_DO_SHARD = {'calculocredito', 'estatisticaresiduo'}
+# Em ordem de dependência, para a cópia inicial respeitar as chaves estrangeiras
+MODELOS_REPLICADOS = ['tiporesiduo', 'condominio', 'parametrocalculo']
+
+# Bancos em que reservar_faixa_ids sabe ajustar a sequência dos ids
+VENDORS_SUPORTADOS = ('sqlite', 'postgresql')
+
+# Acima disso, mapa_de_shards carrega o mapa inteiro em vez de um IN enorme
+LIMITE_IN = 500
+
+_mapa = {}
+_mapa_trava = threading.Lock()
+
+
+def aliases():
+    return list(settings.SHARDS)
+
+
+def sharding_ativo():
+    return len(settings.SHARDS) > 1
+
+
+def shard_do_id(pk):
+    """Shard de uma coleta pelo id, ou None se o id não pertence a nenhum shard"""
+    try:
+        indice = int(pk) // BLOCO_IDS
+    except (TypeError, ValueError):
+        return None
+    if 0 <= indice < len(settings.SHARDS):
+        return settings.SHARDS[indice]
+    return None
+
+
+def mapa_de_shards(condominio_ids):
+    """
+    {condominio_id: alias} sem gravar nada, com uma consulta para todos os
+    ids fora do cache. Condomínios sem MapaShard (legados, sem coletas desde
+    o sharding ou inexistentes) são lidos do default.
+    """
+    ids = {int(condominio_id) for condominio_id in condominio_ids}
+    if not sharding_ativo():
+        return dict.fromkeys(ids, 'default')
+    faltando = [condominio_id for condominio_id in ids if condominio_id not in _mapa]
+    if faltando:
+        from .models import MapaShard
+
+        consulta = MapaShard.objects.using('default')
+        if len(faltando) <= LIMITE_IN:
+            consulta = consulta.filter(condominio_id__in=faltando)
+        encontrados = dict(consulta.values_list('condominio', 'alias'))
+        with _mapa_trava:
+            _mapa.update(encontrados)
+    return {condominio_id: _mapa.get(condominio_id, 'default') for condominio_id in ids}
+
+
+def shard_do_condominio(condominio_id):
+    """Alias do banco que guarda as coletas do condomínio (somente leitura)"""
+    condominio_id = int(condominio_id)
+    return mapa_de_shards([condominio_id])[condominio_id]
+
+
+def atribuir_shard(condominio_id):
+    """
+    Alias onde gravar as coletas do condomínio, escolhendo um shard na
+    primeira gravação. Usado apenas nos caminhos de escrita.
+    """
+    alias = shard_do_condominio(condominio_id)
+    condominio_id = int(condominio_id)
+    if not sharding_ativo() or condominio_id in _mapa:
+        return alias
+    alias = _atribuir(condominio_id)
+    with _mapa_trava:
+        _mapa[condominio_id] = alias
+    return alias
+
+
+def _atribuir(condominio_id):
+    from .models import CalculoCredito, MapaShard
+
+    if CalculoCredito.objects.using('default').filter(condominio_id=condominio_id).exists():
+        # Condomínio com coletas de antes do sharding continua no default
+        escolhido = 'default'
+    else:
+        # Novo condomínio vai para o shard com menos condomínios
+        ocupacao = dict(
+            MapaShard.objects.using('default').values_list('alias').annotate(Count('condominio'))
+        )
+        escolhido = min(aliases(), key=lambda alias: ocupacao.get(alias, 0))
+    # Savepoint próprio: um condomínio inexistente não invalida a transação de quem chamou
+    with transaction.atomic(using='default'):
+        mapa, _ = MapaShard.objects.using('default').get_or_create(
+            condominio_id=condominio_id, defaults={'alias': escolhido}
+        )
+    return mapa.alias
+
+
+def agrupar_por_shard(condominio_ids):
+    """{alias: [condominio_ids]} para os condomínios informados"""
+    grupos = {}
+    mapa = mapa_de_shards(condominio_ids)
+    for condominio_id in condominio_ids:
+        grupos.setdefault(mapa[int(condominio_id)], []).append(condominio_id)
+    return grupos
+
+
+def em_paralelo(funcao, alvos):
+    """
+    Executa funcao(alias, argumento) para cada item de `alvos` ({alias: argumento})
+    em paralelo, uma thread (e conexão) por shard, e retorna {alias: resultado}
+    """
+    if len(alvos) <= 1:
+        return {alias: funcao(alias, argumento) for alias, argumento in alvos.items()}
+
+    def executar(alias, argumento):
+        try:
+            return funcao(alias, argumento)
+        finally:
+            connections[alias].close()
+
+    with ThreadPoolExecutor(max_workers=len(alvos)) as executor:
+        futuros = {
+            alias: executor.submit(executar, alias, argumento)
+            for alias, argumento in alvos.items()
+        }
+        return {alias: futuro.result() for alias, futuro in futuros.items()}
+
+
+def _valores(objeto):
+    return {
+        campo.attname: getattr(objeto, campo.attname)
+        for campo in type(objeto)._meta.concrete_fields
+        if not campo.primary_key
+    }
+
+
+def replicar(objeto, aliases_destino=None):
+    """Copia (insere ou atualiza) um objeto de referência do default para os shards"""
+    modelo = type(objeto)
+    valores = _valores(objeto)
+    for alias in aliases_destino or aliases():
+        if alias != 'default':
+            modelo.objects.using(alias).update_or_create(pk=objeto.pk, defaults=valores)
+
+
+def reservar_faixa_ids(alias):
+    """
+    Faz a sequência de ids das coletas do shard começar na faixa dele
+    (índice em SHARDS * BLOCO_IDS). Não altera sequências já à frente.
+    """
+    from .models import CalculoCredito
+
+    inicio = aliases().index(alias) * BLOCO_IDS
+    if not inicio:
+        return
+    conexao = connections[alias]
+    tabela = CalculoCredito._meta.db_table
+    with conexao.cursor() as cursor:
+        if conexao.vendor == 'sqlite':
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [tabela])
+            atual = cursor.fetchone()
+            if atual is None:
+                cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [tabela, inicio])
+            elif atual[0] < inicio:
+                cursor.execute("UPDATE sqlite_sequence SET seq = %s WHERE name = %s", [inicio, tabela])
+        elif conexao.vendor == 'postgresql':
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                f"GREATEST(%s, (SELECT COALESCE(max(id), 0) FROM {conexao.ops.quote_name(tabela)})))",
+                [tabela, inicio]
+            )
+        else:
+            raise ImproperlyConfigured(f'Faixa de ids não suportada para {conexao.vendor} (shard {alias})')
+
+
+def verificar_bancos():
+    """
+    Garante que todos os shards usam um banco com faixa de ids suportada,
+    antes de o preparar_shards alterar qualquer um deles
+    """
+    invalidos = [
+        f'{alias} ({connections[alias].vendor})' for alias in aliases()
+        if connections[alias].vendor not in VENDORS_SUPORTADOS
+    ]
+    if invalidos:
+        raise ImproperlyConfigured(
+            f'SHARDS só suporta {", ".join(VENDORS_SUPORTADOS)}; bancos não suportados: {", ".join(invalidos)}'
+        )
+
+
+def _nos_shards(descricao, operacao):
+    """
+    Aplica a operação em cada shard sem derrubar a requisição: a gravação no
+    default já foi confirmada, e uma réplica que falhar é corrigida pelo
+    preparar_shards (que recopia as tabelas de referência)
+    """
+    for alias in aliases():
+        if alias == 'default':
+            continue
+        try:
+            operacao(alias)
+        except DatabaseError:
+            logger.exception(
+                'Falha ao replicar %s no shard %s; execute preparar_shards para ressincronizar',
+                descricao, alias
+            )
+
+
+def _replicar_ao_salvar(sender, instance, using, raw=False, **kwargs):
+    if using != 'default' or raw or not sharding_ativo():
+        return
+    pk, valores = instance.pk, _valores(instance)
+    descricao = f'{sender._meta.model_name} {pk}'
+    transaction.on_commit(
+        lambda: _nos_shards(
+            descricao,
+            lambda alias: sender.objects.using(alias).update_or_create(pk=pk, defaults=valores)
+        ),
+        using='default'
+    )
+
+
+def _replicar_ao_excluir(sender, instance, using, **kwargs):
+    if using != 'default' or not sharding_ativo():
+        return
+    pk = instance.pk
+    if sender._meta.model_name == 'condominio':
+        with _mapa_trava:
+            _mapa.pop(pk, None)
+    transaction.on_commit(
+        lambda: _nos_shards(
+            f'exclusão de {sender._meta.model_name} {pk}',
+            lambda alias: sender.objects.using(alias).filter(pk=pk).delete()
+        ),
+        using='default'
+    )
+
+
+def conectar_replicacao():
+    from django.apps import apps
+
+    for nome in MODELOS_REPLICADOS:
+        modelo = apps.get_model('core', nome)
+        post_save.connect(_replicar_ao_salvar, sender=modelo, dispatch_uid=f'replicar_{nome}')
+        post_delete.connect(_replicar_ao_excluir, sender=modelo, dispatch_uid=f'excluir_{nome}')
+
+
+class RoteadorShards:
+    """
+    Roteia as coletas e estatísticas de um condomínio para o shard dele quando
+    a instância é conhecida (save, acesso a relacionamentos); só a escrita
+    atribui shard. Consultas sem instância devem usar
+    .using(shard_do_condominio(...)) explicitamente.
+    """
+
+    def _condominio(self, model, hints):
+        if model._meta.app_label != 'core' or model._meta.model_name not in MODELOS_DO_SHARD:
+            return None
+        instancia = hints.get('instance')
+        return getattr(instancia, 'condominio_id', None)
+
+    def db_for_read(self, model, **hints):
+        condominio_id = self._condominio(model, hints)
+        return shard_do_condominio(condominio_id) if condominio_id else None
+
+    def db_for_write(self, model, **hints):
+        condominio_id = self._condominio(model, hints)
+        return atribuir_shard(condominio_id) if condominio_id else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # As tabelas de referência existem em todos os shards
+        if obj1._meta.app_label == 'core' and obj2._meta.app_label == 'core':
+            return True
+        return None
@@ -1,3 +1,1258 @@
-from django.test import TestCase
+import asyncio
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.messages import get_messages
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, connections, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import arquivo_frio, benchmarks, carga, eventos, exclusao, ingestao, particionamento, precos, relatorios, shards, views
+from .arquivo_frio import VALOR
+from .management.commands import teste_carga
+from .views import CalculoCreditoViewSet
+from .models import (
+    BenchmarkResiduo, CalculoCredito, Condominio, EstatisticaResiduo, MapaShard, ParametroCalculo, PrecoCarbono,
+    PrimeiraColeta, TarefaExclusao, TipoResiduo,
+)
+
+# Segundo shard dos testes de sharding, criado por apiReciclagem.settings_teste (SHARDS_SQLITE=1)
+SHARD_TESTE = 'shard_1'
+
+
+class DadosMixin:
+    """Dados de referência mínimos e criação de coletas para os testes"""
+
+    def criar_referencias(self, condominios=1):
+        self.tipo = TipoResiduo.objects.create(nome='Plástico')
+        self.condominios = [
+            Condominio.objects.create(nome=f'Condomínio {numero}', endereco='Rua A', numero_apartamentos=10)
+            for numero in range(condominios)
+        ]
+        self.condominio = self.condominios[0]
+
+    def criar_parametro(self):
+        ParametroCalculo.objects.create(tipo_residuo=self.tipo, fator_emissao_padrao=2.5, eficiencia_reciclagem=80)
+
+    def criar_cliente(self):
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(User.objects.create_user('teste'))
+
+    def criar_coleta(self, data_coleta, peso=10, condominio=None, **campos):
+        return CalculoCredito.objects.create(
+            condominio=condominio or self.condominio,
+            tipo_residuo=self.tipo,
+            peso_residuo=peso,
+            emissao_carbono_atual=peso * 2,
+            emissao_carbono_reciclagem=peso,
+            data_coleta=data_coleta,
+            **campos
+        )
+
+    def assertTotaisIguais(self, obtidos, esperados):
+        self.assertEqual(obtidos.keys(), esperados.keys())
+        for chave, totais in esperados.items():
+            for nome, valor in totais.items():
+                if valor is None:
+                    self.assertIsNone(obtidos[chave][nome], (chave, nome))
+                else:
+                    self.assertAlmostEqual(obtidos[chave][nome], valor, msg=(chave, nome))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'O particionamento exige PostgreSQL')
+class ParticionamentoTests(DadosMixin, TransactionTestCase):
+    """
+    DDL do particionamento mensal. A conversão é feita uma vez no banco de
+    teste; os demais testes reaproveitam a tabela já particionada.
+    """
+    ESQUEMA = 'arquivo_teste'
+
+    def setUp(self):
+        self.criar_referencias()
+        self.mes_atual = particionamento.inicio_mes(date.today())
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {connection.ops.quote_name(self.ESQUEMA)} CASCADE')
+
+    def no_meio_do_mes(self, deslocamento):
+        return particionamento._limite(particionamento.somar_meses(self.mes_atual, deslocamento)) + timedelta(days=14)
+
+    def linhas_em(self, cursor, tabela):
+        cursor.execute(f'SELECT count(*) FROM {connection.ops.quote_name(tabela)}')
+        return cursor.fetchone()[0]
+
+    def restricoes(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT conname, contype FROM pg_constraint "
+                "WHERE conrelid = to_regclass(%s) AND contype IN ('p', 'u', 'f', 'c')",
+                [particionamento.TABELA]
+            )
+            return set(cursor.fetchall())
+
+    def indices(self):
+        with connection.cursor() as cursor:
+            return particionamento._indices(cursor)
+
+    def particionar(self, meses=()):
+        """Garante a tabela particionada e as partições dos meses (deslocamentos) pedidos"""
+        particionamento.converter_tabela(1)
+        with transaction.atomic(), connection.cursor() as cursor:
+            existentes = particionamento.listar_particoes(cursor)
+            for deslocamento in meses:
+                mes = particionamento.somar_meses(self.mes_atual, deslocamento)
+                if mes not in existentes:
+                    particionamento.criar_particao(cursor, mes)
+
+    def test_converter_tabela_copia_linhas_para_particoes_mensais(self):
+        antiga = self.criar_coleta(self.no_meio_do_mes(-2))
+        atual = self.criar_coleta(self.no_meio_do_mes(0), peso=20)
+        restricoes = self.restricoes()
+        indices = {nome for nome, _definicao in self.indices()}
+
+        criadas = particionamento.converter_tabela(2)
+
+        meses = [particionamento.somar_meses(self.mes_atual, deslocamento) for deslocamento in range(-2, 3)]
+        self.assertEqual(criadas, [particionamento.nome_particao(mes) for mes in meses])
+        with connection.cursor() as cursor:
+            self.assertTrue(particionamento.tabela_particionada(cursor))
+            self.assertEqual(set(particionamento.listar_particoes(cursor)), set(meses))
+            self.assertEqual(self.linhas_em(cursor, particionamento.nome_particao(meses[0])), 1)
+            self.assertEqual(self.linhas_em(cursor, particionamento.nome_particao(meses[2])), 1)
+            self.assertEqual(self.linhas_em(cursor, particionamento.PARTICAO_PADRAO), 0)
+        self.assertEqual(
+            set(CalculoCredito.objects.values_list('id', 'peso_residuo')),
+            {(antiga.id, 10), (atual.id, 20)}
+        )
+
+        # Mesmos nomes das migrations, inclusive a CHECK de versao (>= 0)
+        self.assertEqual(self.restricoes(), restricoes)
+        self.assertIn('c', {tipo for _nome, tipo in restricoes})
+        self.assertTrue(indices <= {nome for nome, _definicao in self.indices()})
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.criar_coleta(self.no_meio_do_mes(1), versao=-1)
+
+        # A sequência própria continua depois dos ids copiados
+        nova = self.criar_coleta(self.no_meio_do_mes(1))
+        self.assertGreater(nova.id, atual.id)
+        # Já particionada: nada a fazer
+        self.assertEqual(particionamento.converter_tabela(2), [])
+
+    def test_criar_particao_move_linhas_da_particao_padrao(self):
+        self.particionar()
+        mes = particionamento.somar_meses(self.mes_atual, 6)
+        coleta = self.criar_coleta(self.no_meio_do_mes(6))
+        with connection.cursor() as cursor:
+            self.assertEqual(self.linhas_em(cursor, particionamento.PARTICAO_PADRAO), 1)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            nome = particionamento.criar_particao(cursor, mes)
+
+        with connection.cursor() as cursor:
+            self.assertIn(mes, particionamento.listar_particoes(cursor))
+            self.assertEqual(self.linhas_em(cursor, particionamento.PARTICAO_PADRAO), 0)
+            self.assertEqual(self.linhas_em(cursor, nome), 1)
+        self.assertTrue(CalculoCredito.objects.filter(pk=coleta.pk).exists())
+
+    def test_desanexar_particoes_antigas_move_para_esquema_de_arquivo(self):
+        self.particionar(meses=[-3, -2, -1])
+        recente = self.criar_coleta(self.no_meio_do_mes(-1))
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            removidas, pendentes = particionamento.desanexar_particoes_antigas(cursor, 1, self.ESQUEMA)
+
+        self.assertEqual(pendentes, [])
+        antigas = {
+            particionamento.nome_particao(particionamento.somar_meses(self.mes_atual, deslocamento))
+            for deslocamento in (-3, -2)
+        }
+        self.assertTrue(antigas <= set(removidas))
+        with connection.cursor() as cursor:
+            self.assertFalse(antigas & set(particionamento.listar_particoes(cursor).values()))
+            for nome in antigas:
+                cursor.execute('SELECT to_regclass(%s)', [f'{self.ESQUEMA}.{nome}'])
+                self.assertIsNotNone(cursor.fetchone()[0])
+        self.assertTrue(CalculoCredito.objects.filter(pk=recente.pk).exists())
+
+    def test_desanexar_particoes_antigas_exige_o_mes_no_arquivo_frio(self):
+        self.particionar(meses=[-3])
+        antiga = self.criar_coleta(self.no_meio_do_mes(-3))
+        nome = particionamento.nome_particao(particionamento.somar_meses(self.mes_atual, -3))
+        diretorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, diretorio, True)
+
+        with override_settings(ARQUIVO_FRIO_DIR=diretorio, SHARDS=['default']):
+            with transaction.atomic(), connection.cursor() as cursor:
+                removidas, pendentes = particionamento.desanexar_particoes_antigas(cursor, 1, self.ESQUEMA)
+            self.assertNotIn(nome, removidas)
+            self.assertEqual(pendentes, [nome])
+            self.assertTrue(CalculoCredito.objects.filter(pk=antiga.pk).exists())
+
+            with transaction.atomic(), connection.cursor() as cursor:
+                removidas, pendentes = particionamento.desanexar_particoes_antigas(
+                    cursor, 1, self.ESQUEMA, excluir=True, arquivar=True
+                )
+            self.assertIn(nome, removidas)
+            self.assertEqual(pendentes, [])
+            # A coleta saiu do banco, mas continua nos relatórios pelo arquivo frio
+            self.assertFalse(CalculoCredito.objects.filter(pk=antiga.pk).exists())
+            totais = relatorios.agregar_por_tipo([self.condominio.id])
+            self.assertAlmostEqual(totais[(self.condominio.id, self.tipo.id)]['peso_total'], 10)
+
+    def test_desanexar_particoes_antigas_pode_excluir(self):
+        self.particionar(meses=[-2])
+        nome = particionamento.nome_particao(particionamento.somar_meses(self.mes_atual, -2))
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            removidas, _ = particionamento.desanexar_particoes_antigas(cursor, 1, self.ESQUEMA, excluir=True)
+
+        self.assertIn(nome, removidas)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT to_regclass(%s), to_regclass(%s)', [nome, f'{self.ESQUEMA}.{nome}'])
+            self.assertEqual(cursor.fetchone(), (None, None))
+
+
+@override_settings(SHARDS=['default'])
+class ArquivoFrioTests(DadosMixin, TestCase):
+    """Ida e volta das coletas de um mês pelo arquivo frio colunar"""
+
+    def setUp(self):
+        self.diretorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.diretorio, True)
+        configuracao = override_settings(ARQUIVO_FRIO_DIR=self.diretorio)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        precos.invalidar()
+
+        self.criar_referencias(condominios=2)
+        self.ids = [condominio.id for condominio in self.condominios]
+        self.mes = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        for dia in range(6):
+            self.criar_coleta(
+                self.mes + timedelta(days=dia, hours=1), peso=10 + dia, condominio=self.condominios[dia % 2]
+            )
+        self.criar_coleta(self.mes + timedelta(days=7), peso=5000, suspeito=True)
+
+    def test_arquivar_mes_preserva_os_totais_dos_relatorios(self):
+        periodo = (self.mes + timedelta(days=2), self.mes + timedelta(days=4, hours=12))
+        completo = relatorios.agregar_por_tipo(self.ids)
+        parcial = relatorios.agregar_por_tipo(self.ids, *periodo)
+
+        self.assertEqual(arquivo_frio.arquivar_mes(self.mes), 7)
+
+        self.assertFalse(CalculoCredito.objects.exists())
+        self.assertTotaisIguais(relatorios.agregar_por_tipo(self.ids), completo)
+        self.assertTotaisIguais(relatorios.agregar_por_tipo(self.ids, *periodo), parcial)
+        self.assertEqual(completo[(self.condominio.id, self.tipo.id)]['suspeitos'], 1)
+        self.assertEqual(
+            relatorios.primeiras_coletas(self.ids),
+            {condominio.id: self.mes + timedelta(days=dia, hours=1) for dia, condominio in enumerate(self.condominios)}
+        )
+
+        with arquivo_frio.MesArquivado(f'{self.diretorio}/2024-01') as mes:
+            chaves = [
+                (mes.coluna('condominio_id')[i], mes.coluna('data_coleta')[i], mes.coluna('id')[i])
+                for i in range(mes.manifesto['linhas'])
+            ]
+        self.assertEqual(len(chaves), 7)
+        self.assertEqual(chaves, sorted(chaves))
+
+    def test_arquivar_mes_de_novo_mescla_sem_duplicar(self):
+        arquivo_frio.arquivar_mes(self.mes)
+        with arquivo_frio.MesArquivado(f'{self.diretorio}/2024-01') as mes:
+            ja_arquivada = {
+                'id': mes.coluna('id')[0],
+                'data': arquivo_frio.EPOCA + timedelta(microseconds=mes.coluna('data_coleta')[0]),
+                'peso': mes.coluna('peso_residuo')[0],
+            }
+        # Execução anterior interrompida antes da exclusão, mais uma coleta nova
+        self.criar_coleta(ja_arquivada['data'], peso=ja_arquivada['peso'], id=ja_arquivada['id'])
+        self.criar_coleta(self.mes + timedelta(days=20), peso=7)
+
+        self.assertEqual(arquivo_frio.arquivar_mes(self.mes), 2)
+
+        self.assertFalse(CalculoCredito.objects.exists())
+        with arquivo_frio.MesArquivado(f'{self.diretorio}/2024-01') as mes:
+            ids = list(mes.coluna('id'))
+        self.assertEqual(len(ids), 8)
+        self.assertEqual(len(set(ids)), 8)
+        totais = relatorios.agregar_por_tipo(self.ids)
+        self.assertAlmostEqual(
+            sum(item['peso_total'] for item in totais.values()), sum(range(10, 16)) + 7
+        )
+
+    def test_pasta_do_arquivo_sincronizada_antes_de_excluir_do_banco(self):
+        restantes = []
+
+        def sincronizar(diretorio):
+            restantes.append((Path(diretorio), CalculoCredito.objects.count()))
+            ingestao.sincronizar_diretorio(diretorio)
+
+        with mock.patch('core.arquivo_frio.sincronizar_diretorio', side_effect=sincronizar):
+            arquivo_frio.arquivar_mes(self.mes)
+            # Remesclar troca a pasta publicada e remove a antiga (.old)
+            self.criar_coleta(self.mes + timedelta(days=20), peso=7)
+            arquivo_frio.arquivar_mes(self.mes)
+
+        diretorio = Path(self.diretorio)
+        temporaria = diretorio / '.2024-01.tmp'
+        self.assertEqual(restantes, [
+            (temporaria, 7), (diretorio, 7),
+            (temporaria, 1), (diretorio, 1), (diretorio, 1),
+        ])
+
+    def test_arquivar_mes_sem_coletas_nao_altera_o_arquivo(self):
+        self.assertEqual(arquivo_frio.arquivar_mes(self.mes + timedelta(days=40)), 0)
+        self.assertEqual(arquivo_frio.meses_arquivados(self.diretorio), [])
+
+
+@override_settings(SHARDS=['default'])
+class RelatorioLoteTests(DadosMixin, TestCase):
+    """Relatório de vários condomínios com número fixo de consultas"""
+
+    def setUp(self):
+        benchmarks.invalidar()
+        precos.invalidar()
+        self.addCleanup(benchmarks.invalidar)
+        self.criar_referencias(condominios=20)
+        self.criar_parametro()
+        self.criar_cliente()
+        self.vidro = TipoResiduo.objects.create(nome='Vidro')
+        coleta_em = datetime(2024, 3, 10, tzinfo=dt_timezone.utc)
+        for numero, condominio in enumerate(self.condominios):
+            self.criar_coleta(coleta_em, peso=10 + numero, condominio=condominio)
+            CalculoCredito.objects.create(
+                condominio=condominio, tipo_residuo=self.vidro, peso_residuo=5,
+                emissao_carbono_atual=10, emissao_carbono_reciclagem=5, data_coleta=coleta_em,
+            )
+
+    def contar_consultas(self, url):
+        with CaptureQueriesContext(connection) as capturadas:
+            resposta = self.cliente.get(url)
+        self.assertEqual(resposta.status_code, 200)
+        return len(capturadas), len(resposta.data['relatorios'])
+
+    def consultas(self, ids):
+        """(consultas com os caches vazios, consultas com os caches aquecidos)"""
+        benchmarks.invalidar()
+        precos.invalidar()
+        url = '/api/v1/relatorio-economia/lote/?condominio_ids=' + ','.join(map(str, ids))
+        frio, relatorios_frio = self.contar_consultas(url)
+        quente, relatorios_quente = self.contar_consultas(url)
+        self.assertEqual((relatorios_frio, relatorios_quente), (len(ids), len(ids)))
+        return frio, quente
+
+    def test_consultas_nao_crescem_com_o_numero_de_condominios(self):
+        ids = [condominio.id for condominio in self.condominios]
+
+        frio, quente = self.consultas(ids[:2])
+
+        self.assertEqual(self.consultas(ids), (frio, quente))
+        self.assertLessEqual(quente, frio)
+
+
+@override_settings(SHARDS=['default'])
+class IngestaoAssincronaTests(DadosMixin, TestCase):
+    """Drenagem do log write-behind, inclusive após uma falha no meio"""
+
+    def setUp(self):
+        self.diretorio = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.diretorio, True)
+        configuracao = override_settings(INGESTAO_ASSINCRONA=True, INGESTAO_DIR=str(self.diretorio))
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        # O log do processo guarda o diretório de quando foi criado
+        ingestao._log = None
+        self.addCleanup(setattr, ingestao, '_log', None)
+
+        self.criar_referencias()
+        self.criar_parametro()
+        self.criar_cliente()
+
+    def postar(self, *pesos):
+        registros = []
+        for peso in pesos:
+            resposta = self.cliente.post('/api/v1/calculos-credito/', {
+                'condominio': self.condominio.id, 'tipo_residuo': self.tipo.id, 'peso_residuo': peso,
+            }, format='json')
+            self.assertEqual(resposta.status_code, 202)
+            registros.append(resposta.data)
+        return registros
+
+    def estatistica(self):
+        return EstatisticaResiduo.objects.get(condominio=self.condominio, tipo_residuo=self.tipo)
+
+    def test_post_so_grava_no_banco_na_drenagem(self):
+        registro, = self.postar(50)
+        self.assertEqual(registro['status'], 'pendente')
+        self.assertFalse(CalculoCredito.objects.exists())
+
+        self.assertEqual(ingestao.drenar(), 1)
+
+        calculo = CalculoCredito.objects.get()
+        self.assertEqual(str(calculo.id_ingestao), registro['id_ingestao'])
+        self.assertAlmostEqual(calculo.economia_carbono, 50 * 2.5 * 0.2)
+
+    def test_diretorio_sincronizado_quando_o_log_e_criado_ou_rotacionado(self):
+        with mock.patch('core.ingestao.sincronizar_diretorio', wraps=ingestao.sincronizar_diretorio) as sincronizar:
+            self.postar(40)
+            self.postar(50)
+            self.assertEqual(sincronizar.call_count, 1)
+
+            ingestao.rotacionar()
+            self.assertEqual(sincronizar.call_count, 2)
+
+            # O log recriado depois da rotação também tem a entrada sincronizada
+            self.postar(60)
+            self.assertEqual(sincronizar.call_count, 3)
+        sincronizar.assert_called_with(self.diretorio)
+
+    def test_drenar_de_novo_apos_falha_nao_duplica_coletas_nem_estatisticas(self):
+        self.postar(40, 50, 60)
+
+        # Queda depois de gravar no banco e antes de remover o arquivo de drenagem
+        with mock.patch('core.ingestao.os.remove', side_effect=OSError('queda')):
+            with self.assertRaises(OSError):
+                ingestao.drenar()
+        self.assertEqual(CalculoCredito.objects.count(), 3)
+        self.assertEqual(len(list(self.diretorio.glob(f'*{ingestao.SUFIXO_DRENAGEM}'))), 1)
+
+        self.assertEqual(ingestao.drenar(), 0)
+
+        self.assertEqual(CalculoCredito.objects.count(), 3)
+        self.assertEqual(list(self.diretorio.glob(f'*{ingestao.SUFIXO_DRENAGEM}')), [])
+        estatistica = self.estatistica()
+        self.assertEqual(estatistica.contagem, 3)
+        self.assertAlmostEqual(estatistica.media, 50)
+
+    def test_registro_recusado_vai_para_rejeitados_sem_travar_a_drenagem(self):
+        recusado, aceito = self.postar(40, 50)
+        # Outra coleta já ocupa (condomínio, tipo, data_coleta) do primeiro registro
+        self.criar_coleta(datetime.fromisoformat(recusado['data_coleta']), peso=1)
+
+        with self.assertLogs('core.ingestao', 'ERROR') as logs:
+            self.assertEqual(ingestao.drenar(), 1)
+
+        self.assertIn(recusado['id_ingestao'], logs.output[0])
+        self.assertTrue(CalculoCredito.objects.filter(id_ingestao=aceito['id_ingestao']).exists())
+        self.assertEqual(list(self.diretorio.glob(f'*{ingestao.SUFIXO_DRENAGEM}')), [])
+        linhas = (self.diretorio / ingestao.NOME_REJEITADOS).read_text().splitlines()
+        self.assertEqual([json.loads(linha)['registro']['id_ingestao'] for linha in linhas], [recusado['id_ingestao']])
+        self.assertEqual(self.estatistica().contagem, 1)
+
+
+@override_settings(SHARDS=['default'])
+class ConcorrenciaOtimistaTests(DadosMixin, TestCase):
+    """ETag/If-Match e o UPDATE condicionado à versão (compare-and-swap)"""
+
+    def setUp(self):
+        self.criar_referencias()
+        self.criar_parametro()
+        self.criar_cliente()
+        resposta = self.cliente.post('/api/v1/calculos-credito/', {
+            'condominio': self.condominio.id, 'tipo_residuo': self.tipo.id, 'peso_residuo': 50,
+        }, format='json')
+        self.assertEqual(resposta.status_code, 201)
+        self.pk = resposta.data['id']
+        self.url = f'/api/v1/calculos-credito/{self.pk}/'
+        self.etag_inicial = resposta['ETag']
+
+    def alterar(self, peso, **cabecalhos):
+        return self.cliente.patch(self.url, {'peso_residuo': peso}, format='json', **cabecalhos)
+
+    def test_if_match_desatualizado_retorna_412(self):
+        self.assertEqual(self.alterar(60, HTTP_IF_MATCH=self.etag_inicial).status_code, 200)
+
+        resposta = self.alterar(70, HTTP_IF_MATCH=self.etag_inicial)
+
+        self.assertEqual(resposta.status_code, 412)
+        self.assertEqual(resposta['ETag'], f'"{self.pk}-1"')
+        self.assertEqual(CalculoCredito.objects.get(pk=self.pk).peso_residuo, 60)
+
+    def test_if_match_confere_qualquer_tag_da_lista(self):
+        self.alterar(60)
+
+        resposta = self.alterar(70, HTTP_IF_MATCH=f'{self.etag_inicial}, "{self.pk}-1"')
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta['ETag'], f'"{self.pk}-2"')
+
+    def test_if_match_fraco_nunca_confere(self):
+        resposta = self.alterar(60, HTTP_IF_MATCH=f'W/{self.etag_inicial}')
+
+        self.assertEqual(resposta.status_code, 412)
+        self.assertEqual(self.alterar(60, HTTP_IF_MATCH='*').status_code, 200)
+
+    def test_alteracao_concorrente_entre_leitura_e_gravacao_retorna_412(self):
+        obsoleta = CalculoCredito.objects.get(pk=self.pk)
+        self.alterar(60)
+        estatistica = EstatisticaResiduo.objects.get(condominio=self.condominio, tipo_residuo=self.tipo)
+
+        # A requisição leu a versão 0, mas outra já gravou a 1
+        with mock.patch.object(CalculoCreditoViewSet, 'get_object', return_value=obsoleta):
+            resposta = self.alterar(70)
+
+        self.assertEqual(resposta.status_code, 412)
+        calculo = CalculoCredito.objects.get(pk=self.pk)
+        self.assertEqual((calculo.peso_residuo, calculo.versao), (60, 1))
+        # A correção das estatísticas é desfeita junto com o UPDATE recusado
+        depois = EstatisticaResiduo.objects.get(pk=estatistica.pk)
+        self.assertEqual((depois.contagem, depois.media), (estatistica.contagem, estatistica.media))
+
+
+@skipUnless(SHARD_TESTE in settings.DATABASES, f'Configure o banco {SHARD_TESTE} (ex.: SHARDS_SQLITE=1)')
+@override_settings(SHARDS=['default', SHARD_TESTE])
+class ShardsTests(DadosMixin, TransactionTestCase):
+    """Roteamento, faixas de ids, consultas espalhadas e replicação entre dois shards"""
+    databases = {'default', SHARD_TESTE}
+
+    def setUp(self):
+        shards._mapa.clear()
+        self.addCleanup(shards._mapa.clear)
+        benchmarks.invalidar()
+        precos.invalidar()
+        for alias in shards.aliases():
+            shards.reservar_faixa_ids(alias)
+
+        self.criar_referencias(condominios=3)
+        self.criar_parametro()
+        self.criar_cliente()
+
+    def postar(self, condominio, peso):
+        resposta = self.cliente.post('/api/v1/calculos-credito/', {
+            'condominio': condominio.id, 'tipo_residuo': self.tipo.id, 'peso_residuo': peso,
+        }, format='json')
+        self.assertEqual(resposta.status_code, 201)
+        return resposta.data
+
+    def test_primeira_gravacao_escolhe_o_shard_e_a_faixa_de_ids(self):
+        primeira = self.postar(self.condominios[0], 10)
+        segunda = self.postar(self.condominios[1], 20)
+
+        # Cada condomínio novo vai para o shard com menos condomínios
+        self.assertEqual(
+            dict(MapaShard.objects.values_list('condominio_id', 'alias')),
+            {self.condominios[0].id: 'default', self.condominios[1].id: SHARD_TESTE}
+        )
+        self.assertEqual(primeira['id'] // shards.BLOCO_IDS, 0)
+        self.assertEqual(segunda['id'] // shards.BLOCO_IDS, 1)
+        self.assertTrue(CalculoCredito.objects.using(SHARD_TESTE).filter(pk=segunda['id']).exists())
+        self.assertFalse(CalculoCredito.objects.using('default').filter(pk=segunda['id']).exists())
+        self.assertTrue(EstatisticaResiduo.objects.using(SHARD_TESTE).filter(condominio=self.condominios[1]).exists())
+
+        # Rotas de detalhe encontram o shard pelo id
+        resposta = self.cliente.get(f'/api/v1/calculos-credito/{segunda["id"]}/')
+        self.assertEqual((resposta.status_code, resposta.data['peso_residuo']), (200, 20))
+
+    def test_leituras_nao_atribuem_shard(self):
+        resposta = self.cliente.get(f'/api/v1/calculos-credito/?condominio={self.condominios[2].id}')
+        self.assertEqual((resposta.status_code, resposta.data), (200, []))
+        resposta = self.cliente.get(f'/api/v1/relatorio-economia/?condominio_id={self.condominios[2].id}')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn('message', resposta.data)
+
+        self.assertFalse(MapaShard.objects.exists())
+
+    def test_listagem_e_relatorios_juntam_os_shards(self):
+        for condominio, peso in zip(self.condominios, [10, 20, 30]):
+            self.postar(condominio, peso)
+        self.assertEqual(
+            sorted(MapaShard.objects.values_list('alias', flat=True)), ['default', 'default', SHARD_TESTE]
+        )
+
+        resposta = self.cliente.get('/api/v1/calculos-credito/')
+        self.assertEqual(sorted(calculo['peso_residuo'] for calculo in resposta.data), [10, 20, 30])
+
+        agregados = relatorios.agregar_por_tipo([condominio.id for condominio in self.condominios])
+        self.assertEqual(
+            {chave[0]: totais['peso_total'] for chave, totais in agregados.items()},
+            {condominio.id: peso for condominio, peso in zip(self.condominios, [10, 20, 30])}
+        )
+
+        resposta = self.cliente.get('/api/v1/relatorio-economia/lote/')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertAlmostEqual(resposta.data['total_carteira']['peso_total'], 60)
+
+    def test_dashboard_junta_os_shards_em_paralelo(self):
+        for condominio, peso in zip(self.condominios, [10, 20, 30]):
+            self.postar(condominio, peso)
+
+        with mock.patch('core.shards.em_paralelo', wraps=shards.em_paralelo) as espalhar:
+            resposta = self.cliente.get('/api/v1/dashboard-condominios/')
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(set(espalhar.call_args_list[0].args[1]), {'default', SHARD_TESTE})
+        self.assertEqual((resposta.data['total_condominios'], resposta.data['condominios_com_coletas']), (3, 3))
+        self.assertAlmostEqual(resposta.data['total_geral']['peso_total'], 60)
+        self.assertEqual(
+            [(item['tipo_residuo__nome'], item['peso_total']) for item in resposta.data['resumo_por_tipo']],
+            [('Plástico', 60)]
+        )
+        # Economia positiva (sem crédito): o menor valor aparece primeiro
+        self.assertEqual(
+            [item['id'] for item in resposta.data['maior_economia']],
+            [condominio.id for condominio in self.condominios]
+        )
+
+        resposta = self.cliente.get('/api/v1/dashboard-condominios/?data_inicio=2000-01-01&data_fim=2000-02-01')
+        self.assertEqual((resposta.data['condominios_com_coletas'], resposta.data['maior_economia']), (0, []))
+        self.assertEqual(resposta.data['total_geral']['peso_total'], 0)
+        self.assertEqual(self.cliente.get('/api/v1/dashboard-condominios/?data_inicio=x').status_code, 400)
+
+    def test_tabelas_de_referencia_sao_replicadas_apos_o_commit(self):
+        replica = Condominio.objects.using(SHARD_TESTE)
+        self.assertEqual(
+            set(replica.values_list('id', 'nome')),
+            {(condominio.id, condominio.nome) for condominio in self.condominios}
+        )
+
+        condominio = self.condominios[0]
+        condominio.nome = 'Renomeado'
+        condominio.save()
+        self.assertEqual(replica.get(pk=condominio.pk).nome, 'Renomeado')
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Condominio.objects.create(nome='Desfeito', endereco='Rua B', numero_apartamentos=5)
+            raise RuntimeError
+        self.assertFalse(replica.filter(nome='Desfeito').exists())
+
+        tipo = TipoResiduo.objects.create(nome='Vidro')
+        tipo.delete()
+        self.assertFalse(TipoResiduo.objects.using(SHARD_TESTE).filter(nome='Vidro').exists())
+
+    def test_preparar_shards_ressincroniza_replicas(self):
+        # Réplica perdida (ex.: shard fora do ar durante a gravação no default)
+        Condominio.objects.using(SHARD_TESTE).filter(pk=self.condominio.pk).delete()
+
+        call_command('preparar_shards', stdout=StringIO())
+
+        self.assertTrue(Condominio.objects.using(SHARD_TESTE).filter(pk=self.condominio.pk).exists())
+
+    def test_preparar_shards_recusa_banco_sem_faixa_de_ids(self):
+        with mock.patch.object(connections[SHARD_TESTE], 'vendor', 'mysql'):
+            with self.assertRaisesMessage(ImproperlyConfigured, f'{SHARD_TESTE} (mysql)'):
+                call_command('preparar_shards', stdout=StringIO())
+            with self.assertRaises(ImproperlyConfigured):
+                shards.reservar_faixa_ids(SHARD_TESTE)
+
+
+@override_settings(SHARDS=['default'], ESTATISTICA_MIN_AMOSTRAS=5)
+class PesoSuspeitoTests(DadosMixin, TestCase):
+    """Pesos fora da distribuição: reavaliação na edição e exclusão dos totais"""
+
+    def setUp(self):
+        precos.invalidar()
+        self.criar_referencias()
+        self.criar_parametro()
+        self.criar_cliente()
+        for peso in [48, 50, 52, 49, 51, 50]:
+            self.postar(peso)
+
+    def postar(self, peso):
+        resposta = self.cliente.post('/api/v1/calculos-credito/', {
+            'condominio': self.condominio.id, 'tipo_residuo': self.tipo.id, 'peso_residuo': peso,
+        }, format='json')
+        self.assertEqual(resposta.status_code, 201)
+        return resposta.data
+
+    def estatistica(self):
+        return EstatisticaResiduo.objects.get(condominio=self.condominio, tipo_residuo=self.tipo)
+
+    def test_corrigir_o_peso_reavalia_suspeito_e_as_estatisticas(self):
+        digitado = self.postar(5000)
+        self.assertTrue(digitado['suspeito'])
+        self.assertEqual((self.estatistica().contagem, self.estatistica().suspeitos), (6, 1))
+
+        resposta = self.cliente.patch(
+            f'/api/v1/calculos-credito/{digitado["id"]}/', {'peso_residuo': 50}, format='json'
+        )
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertFalse(resposta.data['suspeito'])
+        estatistica = self.estatistica()
+        self.assertEqual((estatistica.contagem, estatistica.suspeitos), (7, 0))
+        self.assertAlmostEqual(estatistica.media, 50)
+
+        resposta = self.cliente.patch(
+            f'/api/v1/calculos-credito/{digitado["id"]}/', {'peso_residuo': 9000}, format='json'
+        )
+
+        self.assertTrue(resposta.data['suspeito'])
+        estatistica = self.estatistica()
+        self.assertEqual((estatistica.contagem, estatistica.suspeitos), (6, 1))
+        self.assertAlmostEqual(estatistica.media, 50)
+
+    def test_relatorio_deixa_suspeitos_fora_dos_totais(self):
+        self.postar(5000)
+
+        resposta = self.cliente.get(f'/api/v1/relatorio-economia/?condominio_id={self.condominio.id}')
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertAlmostEqual(resposta.data['total_geral']['peso_total'], 300)
+        self.assertEqual(resposta.data['total_geral']['suspeitos'], 1)
+        self.assertEqual(resposta.data['resumo_por_tipo'][0]['suspeitos'], 1)
+
+    def test_reconstruir_inclui_os_meses_arquivados(self):
+        diretorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, diretorio, True)
+        self.postar(5000)
+        with override_settings(ARQUIVO_FRIO_DIR=diretorio):
+            arquivo_frio.arquivar_mes(timezone.now())
+            # Coletas do mesmo mês gravadas depois do arquivamento ficam no banco
+            self.postar(53)
+            self.postar(9000)
+            incremental = self.estatistica()
+
+            call_command('reconstruir_estatisticas', stdout=StringIO())
+
+        reconstruida = self.estatistica()
+        self.assertEqual(
+            (reconstruida.contagem, reconstruida.suspeitos), (incremental.contagem, incremental.suspeitos)
+        )
+        self.assertEqual((reconstruida.contagem, reconstruida.suspeitos), (7, 2))
+        self.assertAlmostEqual(reconstruida.media, incremental.media)
+        self.assertAlmostEqual(reconstruida.m2, incremental.m2)
+
+    def test_reconstruir_trava_as_estatisticas_antes_de_ler_as_coletas(self):
+        with CaptureQueriesContext(connection) as consultas:
+            call_command('reconstruir_estatisticas', stdout=StringIO())
+
+        sql = [consulta['sql'] for consulta in consultas.captured_queries]
+        primeira_leitura = next(i for i, texto in enumerate(sql) if 'FROM "core_calculocredito"' in texto)
+        self.assertTrue(sql[primeira_leitura - 1].startswith('DELETE FROM "core_estatisticaresiduo"'))
+        self.assertEqual(self.estatistica().contagem, 6)
+
+    def test_marcar_suspeitos_renova_a_versao_das_coletas_alteradas(self):
+        coleta = CalculoCredito.objects.get(peso_residuo=52)
+        CalculoCredito.objects.filter(pk=coleta.pk).update(suspeito=True)
+        intocada = CalculoCredito.objects.get(peso_residuo=49)
+
+        call_command('reconstruir_estatisticas', '--marcar-suspeitos', stdout=StringIO())
+
+        alterada = CalculoCredito.objects.get(pk=coleta.pk)
+        self.assertFalse(alterada.suspeito)
+        self.assertEqual(alterada.versao, coleta.versao + 1)
+        self.assertEqual(CalculoCredito.objects.get(pk=intocada.pk).versao, intocada.versao)
+
+
+@override_settings(SHARDS=['default'])
+class EventosTests(DadosMixin, TestCase):
+    """Publicação das coletas e totais agrupados por intervalo"""
+
+    def setUp(self):
+        self.criar_referencias()
+        self.criar_coleta(datetime(2024, 1, 1, tzinfo=dt_timezone.utc), peso=30)
+        self.broker = eventos.BrokerMemoria()
+        eventos._broker = self.broker
+        self.addCleanup(setattr, eventos, '_broker', None)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.canal = eventos.canal_condominio(self.condominio.id)
+
+    def assinar(self):
+        async def assinar():
+            return self.broker.assinar(self.canal)
+        return self.loop.run_until_complete(assinar())
+
+    def recebidos(self, assinatura):
+        # Processa os call_soon_threadsafe pendentes no loop do assinante
+        self.loop.run_until_complete(asyncio.sleep(0))
+        eventos_recebidos = []
+        while not assinatura.fila.empty():
+            tipo, dados = assinatura.fila.get_nowait()
+            eventos_recebidos.append((tipo, json.loads(dados)))
+        return eventos_recebidos
+
+    def test_totais_recalculados_uma_vez_por_intervalo(self):
+        assinatura = self.assinar()
+
+        with mock.patch('core.eventos.threading.Timer') as timer:
+            for peso in (1, 2, 3):
+                eventos.publicar_coletas(self.condominio.id, [{'condominio': self.condominio.id, 'peso': peso}])
+            self.assertEqual(timer.call_count, 1)
+
+            with mock.patch('core.relatorios.agregar_por_tipo', wraps=relatorios.agregar_por_tipo) as agregar:
+                self.broker.totais.descarregar()
+            agregar.assert_called_once_with([self.condominio.id])
+
+            recebidos = self.recebidos(assinatura)
+            self.assertEqual([tipo for tipo, _ in recebidos], ['coleta'] * 3 + ['totais'])
+            self.assertEqual(recebidos[-1][1]['total_geral']['peso_total'], 30)
+
+            # Descarregado, a próxima coleta agenda outro cálculo
+            eventos.publicar_coletas(self.condominio.id, [{'condominio': self.condominio.id}])
+            self.assertEqual(timer.call_count, 2)
+
+    def test_sem_assinantes_nada_e_publicado_nem_calculado(self):
+        with mock.patch('core.eventos.threading.Timer') as timer:
+            eventos.publicar_coletas(self.condominio.id, [{'condominio': self.condominio.id}])
+        timer.assert_not_called()
+
+    def test_falha_ao_publicar_nao_propaga(self):
+        self.assinar()
+        with mock.patch.object(self.broker, 'publicar', side_effect=OSError), \
+                self.assertLogs('core.eventos', 'ERROR'):
+            eventos.publicar_coletas(self.condominio.id, [{'condominio': self.condominio.id}])
+
+    def test_broker_em_memoria_avisa_quando_as_coletas_vem_de_outro_processo(self):
+        with override_settings(INGESTAO_ASSINCRONA=True), self.assertLogs('core.eventos', 'WARNING') as logs:
+            eventos.verificar_broker_asgi()
+        self.assertIn('BrokerPostgres', logs.output[0])
+
+        eventos._broker = mock.Mock(entre_processos=True)
+        self.assertFalse(eventos.avisar_broker_local('drenar_ingestao'))
+
+
+class AplicacaoSSETests(SimpleTestCase):
+    """Autenticação, formato text/event-stream e limpeza das assinaturas do endpoint SSE"""
+
+    def setUp(self):
+        self.broker = eventos.BrokerMemoria(tamanho_fila=2)
+        eventos._broker = self.broker
+        self.addCleanup(setattr, eventos, '_broker', None)
+        self.token = str(AccessToken.for_user(User(pk=1, username='painel')))
+
+    def escopo(self, caminho='7/', metodo='GET', token=True):
+        headers = [(b'authorization', f'Bearer {self.token}'.encode())] if token else []
+        return {
+            'type': 'http', 'method': metodo, 'path': eventos.PREFIXO_URL + caminho,
+            'headers': headers, 'query_string': b'',
+        }
+
+    def conversar(self, escopo, durante=None, enviar=None):
+        """Executa o endpoint até o cliente desconectar; retorna as mensagens enviadas"""
+        enviados = []
+
+        async def send(mensagem):
+            if enviar:
+                enviar(mensagem)
+            enviados.append(mensagem)
+
+        async def cenario():
+            entrada = asyncio.Queue()
+            tarefa = asyncio.ensure_future(eventos.aplicacao_sse(escopo, entrada.get, send))
+            while not enviados and not tarefa.done():
+                await asyncio.sleep(0.001)
+            if durante:
+                await durante()
+            await entrada.put({'type': 'http.disconnect'})
+            await asyncio.wait_for(tarefa, 1)
+
+        asyncio.run(cenario())
+        return enviados
+
+    def corpo(self, enviados):
+        return b''.join(mensagem.get('body', b'') for mensagem in enviados[1:])
+
+    def test_sem_token_ou_com_token_invalido_retorna_401(self):
+        enviados = self.conversar(self.escopo(token=False))
+        self.assertEqual(enviados[0]['status'], 401)
+        self.assertIn('erro', json.loads(self.corpo(enviados)))
+
+        escopo = self.escopo(token=False)
+        escopo['query_string'] = b'token=invalido'
+        self.assertEqual(self.conversar(escopo)[0]['status'], 401)
+
+    def test_caminho_ou_metodo_invalido_retorna_404(self):
+        self.assertEqual(self.conversar(self.escopo('abc/'))[0]['status'], 404)
+        self.assertEqual(self.conversar(self.escopo(metodo='POST'))[0]['status'], 404)
+
+    def test_eventos_no_formato_sse_e_assinatura_cancelada_ao_desconectar(self):
+        canal = eventos.canal_condominio(7)
+
+        async def durante():
+            await asyncio.sleep(0.01)
+            self.assertTrue(self.broker.tem_assinantes_locais(canal))
+            self.broker.publicar(canal, 'totais', {'condominio': 7})
+            await asyncio.sleep(0.01)
+
+        enviados = self.conversar(self.escopo(), durante)
+
+        self.assertEqual(enviados[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), enviados[0]['headers'])
+        self.assertEqual(
+            self.corpo(enviados), b': conectado\n\nevent: totais\ndata: {"condominio": 7}\n\n'
+        )
+        self.assertFalse(self.broker.tem_assinantes_locais(canal))
+
+    def test_envio_falho_cancela_assinatura(self):
+        def enviar(mensagem):
+            if mensagem.get('more_body'):
+                raise OSError('conexão fechada')
+
+        self.conversar(self.escopo(), enviar=enviar)
+
+        self.assertFalse(self.broker.tem_assinantes_locais(eventos.canal_condominio(7)))
+
+    def test_fila_cheia_descarta_o_evento_mais_antigo(self):
+        async def cenario():
+            assinatura = self.broker.assinar('condominio:1')
+            for numero in range(3):
+                assinatura.entregar(('coleta', str(numero)))
+            return [assinatura.fila.get_nowait() for _ in range(assinatura.fila.qsize())]
+
+        self.assertEqual(asyncio.run(cenario()), [('coleta', '1'), ('coleta', '2')])
+
+
+@override_settings(SHARDS=['default'], EXCLUSAO_EM_THREAD=False)
+class ExclusaoTests(DadosMixin, TestCase):
+    """Exclusão em segundo plano: agendamento, bloqueio de coletas e execução em lotes"""
+
+    def setUp(self):
+        self.criar_referencias(condominios=2)
+        self.criar_parametro()
+        self.criar_cliente()
+        self.mes = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        for dia in range(5):
+            self.criar_coleta(self.mes + timedelta(days=dia))
+        self.outra = self.criar_coleta(self.mes, condominio=self.condominios[1])
+
+    def test_delete_responde_202_e_bloqueia_novas_coletas(self):
+        resposta = self.cliente.delete(f'/api/v1/condominios/{self.condominio.id}/')
+
+        self.assertEqual(resposta.status_code, 202)
+        self.assertEqual((resposta.data['status'], resposta.data['total']), ('pendente', 5))
+        self.assertEqual(
+            self.cliente.get(f'/api/v1/condominios/{self.condominio.id}/').data['status_exclusao'], 'pendente'
+        )
+        listagem = {item['id']: item['status_exclusao'] for item in self.cliente.get('/api/v1/condominios/').data}
+        self.assertEqual(listagem, {self.condominio.id: 'pendente', self.condominios[1].id: None})
+        # Um segundo DELETE reaproveita a tarefa ativa
+        self.assertEqual(self.cliente.delete(f'/api/v1/condominios/{self.condominio.id}/').data['id'], resposta.data['id'])
+
+        resposta = self.cliente.post('/api/v1/calculos-credito/', {
+            'condominio': self.condominio.id, 'tipo_residuo': self.tipo.id, 'peso_residuo': 10,
+        }, format='json')
+        self.assertEqual(resposta.status_code, 400)
+        self.assertIn('condominio', resposta.data)
+        self.assertEqual(CalculoCredito.objects.filter(condominio=self.condominio).count(), 5)
+
+    def test_executar_exclui_em_lotes_e_depois_o_objeto(self):
+        tarefa = exclusao.agendar_exclusao(self.condominio)
+
+        with CaptureQueriesContext(connection) as consultas:
+            tarefa = exclusao.executar(tarefa.pk, tamanho_lote=2)
+
+        self.assertEqual((tarefa.status, tarefa.excluidos), ('concluida', 5))
+        lotes = [
+            consulta['sql'] for consulta in consultas.captured_queries
+            if consulta['sql'].startswith('DELETE FROM "core_calculocredito" WHERE "core_calculocredito"."id" IN')
+        ]
+        self.assertEqual(len(lotes), 3)
+        self.assertFalse(Condominio.objects.filter(pk=self.condominio.pk).exists())
+        self.assertEqual(list(CalculoCredito.objects.all()), [self.outra])
+        self.assertIsNone(exclusao.status_exclusao(self.condominios[1]))
+
+    def test_tarefa_em_andamento_so_e_retomada_se_estiver_parada(self):
+        tarefa = exclusao.agendar_exclusao(self.condominio)
+        TarefaExclusao.objects.filter(pk=tarefa.pk).update(status='excluindo', atualizado_em=timezone.now())
+
+        # Outro executor está com a tarefa: nem a thread nem o comando a assumem
+        self.assertEqual(exclusao.executar(tarefa.pk).status, 'excluindo')
+        saida = StringIO()
+        call_command('processar_exclusoes', stdout=saida)
+        self.assertIn('em andamento em outro processo', saida.getvalue())
+        self.assertEqual(CalculoCredito.objects.filter(condominio=self.condominio).count(), 5)
+
+        parada = timezone.now() - timedelta(seconds=settings.EXCLUSAO_ABANDONO_SEGUNDOS + 1)
+        TarefaExclusao.objects.filter(pk=tarefa.pk).update(atualizado_em=parada)
+        self.assertEqual(exclusao.executar(tarefa.pk).status, 'excluindo')
+
+        call_command('processar_exclusoes', stdout=StringIO())
+        self.assertEqual(TarefaExclusao.objects.get(pk=tarefa.pk).status, 'concluida')
+        self.assertFalse(CalculoCredito.objects.filter(condominio=self.condominio).exists())
+
+    def test_admin_agenda_a_exclusao_em_vez_do_cascade(self):
+        requisicao = RequestFactory().post('/admin/')
+        requisicao.user = User.objects.create_superuser('admin')
+        requisicao.session = {}
+        requisicao._messages = FallbackStorage(requisicao)
+        modelo_admin = admin.site._registry[Condominio]
+
+        modelo_admin.delete_model(requisicao, self.condominio)
+        modelo_admin.delete_queryset(requisicao, Condominio.objects.filter(pk=self.condominios[1].pk))
+
+        self.assertEqual(CalculoCredito.objects.count(), 6)
+        self.assertEqual(
+            set(TarefaExclusao.objects.values_list('objeto_id', 'status')),
+            {(self.condominio.id, 'pendente'), (self.condominios[1].id, 'pendente')}
+        )
+        self.assertEqual(len(list(get_messages(requisicao))), 2)
+
+
+@override_settings(SHARDS=['default'], PRECO_CARBONO_PADRAO_USD=60)
+class PrecoCarbonoTests(DadosMixin, TestCase):
+    """Vigências do preço do carbono: sobreposição, limites, arquivo frio e cache"""
+
+    def setUp(self):
+        self.diretorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.diretorio, True)
+        configuracao = override_settings(ARQUIVO_FRIO_DIR=self.diretorio)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        precos.invalidar()
+        self.addCleanup(precos.invalidar)
+        self.criar_referencias()
+        # 100 até 15/01 e 200 a partir de 16/01 (vigente_ate é exclusivo)
+        PrecoCarbono.objects.create(preco_tonelada_usd=100, vigente_de=date(2024, 1, 1), vigente_ate=date(2024, 1, 16))
+        PrecoCarbono.objects.create(preco_tonelada_usd=200, vigente_de=date(2024, 1, 16))
+
+    def instante(self, *data):
+        return datetime(*data, tzinfo=dt_timezone.utc)
+
+    def valor(self, inicio=None, fim=None):
+        totais = relatorios.agregar_por_tipo([self.condominio.id], inicio, fim)
+        return totais[(self.condominio.id, self.tipo.id)][VALOR]
+
+    def test_vigencia_sobreposta_e_recusada_ao_gravar(self):
+        with self.assertRaises(ValidationError):
+            PrecoCarbono.objects.create(preco_tonelada_usd=1, vigente_de=date(2024, 3, 1))
+        with self.assertRaises(ValidationError):
+            PrecoCarbono.objects.create(preco_tonelada_usd=1, vigente_de=date(2023, 12, 1), vigente_ate=date(2024, 1, 2))
+        # Termina exatamente onde a primeira começa: não se sobrepõe
+        PrecoCarbono.objects.create(preco_tonelada_usd=50, vigente_de=date(2023, 12, 1), vigente_ate=date(2024, 1, 1))
+
+        primeiro = PrecoCarbono.objects.get(vigente_de=date(2024, 1, 1))
+        primeiro.vigente_ate = date(2024, 1, 20)
+        with self.assertRaises(ValidationError):
+            primeiro.save()
+        self.assertEqual(PrecoCarbono.objects.count(), 3)
+
+    def test_preco_do_dia_nos_limites_das_vigencias(self):
+        intervalos = precos.obter_intervalos()
+        casos = [
+            (self.instante(2023, 12, 31, 23, 59), 60),
+            (self.instante(2024, 1, 1), 100),
+            (self.instante(2024, 1, 15, 23, 59, 59), 100),
+            (self.instante(2024, 1, 16), 200),
+        ]
+        for instante, preco in casos:
+            self.assertEqual(intervalos.preco_em(instante), preco, instante)
+            self.criar_coleta(instante, peso=10)
+
+        # Cada coleta economiza 10 kg; o CASE do banco usa o mesmo preço do dia
+        self.assertAlmostEqual(self.valor(), 10 / 1000 * (60 + 100 + 100 + 200))
+        self.assertAlmostEqual(
+            self.valor(self.instante(2024, 1, 15), self.instante(2024, 1, 16)), 10 / 1000 * (100 + 200)
+        )
+
+    def test_arquivo_frio_valora_linha_a_linha_so_no_mes_em_que_o_preco_muda(self):
+        for dia in (5, 20):
+            self.criar_coleta(self.instante(2024, 1, dia), peso=10)
+            self.criar_coleta(self.instante(2024, 2, dia), peso=10)
+        antes = self.valor()
+        self.assertAlmostEqual(antes, 10 / 1000 * (100 + 200 + 200 + 200))
+
+        arquivo_frio.arquivar_mes(self.instante(2024, 1, 1))
+        arquivo_frio.arquivar_mes(self.instante(2024, 2, 1))
+
+        coluna = arquivo_frio.MesArquivado.coluna
+        with mock.patch.object(arquivo_frio.MesArquivado, 'coluna', autospec=True, side_effect=coluna) as lidas:
+            self.assertAlmostEqual(self.valor(), antes)
+        # Janeiro (dois preços) percorre as linhas; fevereiro usa o manifesto
+        meses = {chamada.args[0].pasta.name for chamada in lidas.call_args_list}
+        self.assertEqual(meses, {'2024-01'})
+
+    def test_cache_invalidado_ao_gravar_ou_excluir_e_expirado(self):
+        instante = self.instante(2024, 6, 1)
+        self.assertEqual(precos.obter_intervalos().preco_em(instante), 200)
+
+        preco = PrecoCarbono.objects.get(vigente_de=date(2024, 1, 16))
+        preco.preco_tonelada_usd = 250
+        preco.save()
+        self.assertEqual(precos.obter_intervalos().preco_em(instante), 250)
+
+        preco.delete()
+        self.assertEqual(precos.obter_intervalos().preco_em(instante), 60)
+
+        # Alterações sem sinal (update) só aparecem quando o cache expira
+        PrecoCarbono.objects.update(preco_tonelada_usd=70)
+        self.assertEqual(precos.obter_intervalos().preco_em(self.instante(2024, 1, 2)), 100)
+        with mock.patch('core.precos.relogio.monotonic', return_value=precos.relogio.monotonic() + 10 ** 6):
+            self.assertEqual(precos.obter_intervalos().preco_em(self.instante(2024, 1, 2)), 70)
+
+
+@override_settings(SHARDS=['default'], BENCHMARK_MIN_CONDOMINIOS=3)
+class BenchmarksTests(DadosMixin, TestCase):
+    """Percentis entre condomínios, recomendações e datas da primeira coleta"""
+
+    def setUp(self):
+        benchmarks.invalidar()
+        self.addCleanup(benchmarks.invalidar)
+        self.criar_referencias(condominios=4)
+        self.vidro = TipoResiduo.objects.create(nome='Vidro')
+        self.fim = datetime(2024, 7, 1, tzinfo=dt_timezone.utc)
+        self.coleta_em = self.fim - timedelta(days=20)
+        # Plástico: economia 10, 20, 30 e 40; vidro: 50 em três dos quatro
+        for numero, condominio in enumerate(self.condominios):
+            self.criar_coleta(self.coleta_em, peso=10 * (numero + 1), condominio=condominio)
+            if numero:
+                CalculoCredito.objects.create(
+                    condominio=condominio, tipo_residuo=self.vidro, peso_residuo=50,
+                    emissao_carbono_atual=100, emissao_carbono_reciclagem=50, data_coleta=self.coleta_em,
+                )
+
+    def metrica(self, economia):
+        return benchmarks.metrica(economia, 10, relatorios.dias_do_periodo(self.coleta_em, self.fim))
+
+    def test_pontos_percentis_interpolam_entre_os_valores(self):
+        self.assertEqual(benchmarks.pontos_percentis(range(21)), list(range(21)))
+        pontos = benchmarks.pontos_percentis([5, 1, 3])
+        self.assertEqual(len(pontos), 21)
+        self.assertEqual((pontos[0], pontos[10], pontos[20]), (1, 3, 5))
+        self.assertAlmostEqual(pontos[1], 1.2)
+        self.assertEqual(benchmarks.pontos_percentis([7]), [7] * 21)
+
+    def test_percentil_de_um_valor_na_distribuicao(self):
+        benchmark = benchmarks.Benchmark(benchmarks.pontos_percentis(range(21)), 21)
+        self.assertEqual(benchmark.mediana, 10)
+        self.assertEqual(benchmark.percentil(-1), 0)
+        self.assertEqual(benchmark.percentil(0), 0)
+        self.assertEqual(benchmark.percentil(10), 50)
+        self.assertAlmostEqual(benchmark.percentil(10.5), 52.5)
+        self.assertEqual(benchmark.percentil(20), 100)
+        self.assertEqual(benchmarks.Benchmark([3] * 21, 4).percentil(3), 100)
+
+    def test_calcular_grava_percentis_e_primeiras_coletas(self):
+        calculados = benchmarks.calcular(janela_dias=30, fim=self.fim)
+
+        self.assertEqual(len(calculados), 2)
+        gravados = {b.tipo_residuo_id: b for b in BenchmarkResiduo.objects.all()}
+        self.assertEqual(gravados[self.tipo.id].condominios, 4)
+        esperados = benchmarks.pontos_percentis([self.metrica(e) for e in (10, 20, 30, 40)])
+        for obtido, esperado in zip(gravados[self.tipo.id].percentis, esperados):
+            self.assertAlmostEqual(obtido, esperado)
+        # Quem não recicla vidro conta como zero
+        self.assertEqual(gravados[self.vidro.id].percentis[0], 0)
+        self.assertEqual(
+            dict(PrimeiraColeta.objects.values_list('condominio_id', 'data')),
+            {condominio.id: self.coleta_em for condominio in self.condominios}
+        )
+
+    def test_gerar_recomendacoes_pelos_percentis(self):
+        benchmarks.calcular(janela_dias=30, fim=self.fim)
+        dias = relatorios.dias_do_periodo(self.coleta_em, self.fim)
+
+        fraco = [{'tipo_residuo__nome': 'Plástico', 'economia_total': 5}]
+        self.assertEqual(views.gerar_recomendacoes(fraco, False, 10, dias), [
+            'A economia por apartamento com Plástico (percentil 0) está entre as 25% menores dos condomínios. '
+            'Reforçar a separação desses materiais com os moradores.',
+            'Implementar coleta seletiva de Vidro, reciclados pela maioria dos condomínios.',
+        ])
+
+        forte = [
+            {'tipo_residuo__nome': 'Plástico', 'economia_total': 400},
+            {'tipo_residuo__nome': 'Vidro', 'economia_total': 50},
+        ]
+        self.assertEqual(views.gerar_recomendacoes(forte, True, 10, dias), [
+            'Bom desempenho com Plástico (percentil 100), Vidro (percentil 100): '
+            'economia por apartamento entre as 25% maiores dos condomínios.',
+            'Manter as práticas atuais e considerar expandir o programa de reciclagem para obter maior crédito de carbono.',
+        ])
+
+        # Sem a duração do período não há como comparar: regras por nome
+        self.assertEqual(
+            views.gerar_recomendacoes(fraco, False), views.recomendacoes_por_nome(fraco, False)
+        )
+
+    def test_relatorio_le_a_primeira_coleta_sem_gravar(self):
+        self.criar_cliente()
+        url = f'/api/v1/relatorio-economia/?condominio_id={self.condominio.id}'
+
+        with mock.patch('core.relatorios.primeiras_coletas', wraps=relatorios.primeiras_coletas) as consultar:
+            self.assertEqual(self.cliente.get(url).status_code, 200)
+            self.assertEqual(self.cliente.get(url).status_code, 200)
+
+        # Consultada uma vez, guardada só no cache do processo
+        consultar.assert_called_once_with([self.condominio.id])
+        self.assertFalse(PrimeiraColeta.objects.exists())
+        self.assertEqual(benchmarks.primeiras_coletas([self.condominio.id]), {self.condominio.id: self.coleta_em})
+
+    @override_settings(BENCHMARK_PRIMEIRAS_CACHE=2)
+    def test_cache_das_primeiras_coletas_e_limitado(self):
+        ids = [condominio.id for condominio in self.condominios]
+
+        self.assertEqual(benchmarks.primeiras_coletas(ids), {i: self.coleta_em for i in ids})
+
+        self.assertEqual(list(benchmarks._primeiras), ids[-2:])
+
+
+class CargaTests(SimpleTestCase):
+    """Métricas e configuração do teste de carga (sem subir servidor)"""
+
+    def test_percentil_pelo_posto_mais_proximo(self):
+        valores = list(range(1, 101))
+
+        self.assertIsNone(carga.percentil([], 50))
+        self.assertEqual(carga.percentil([7], 99), 7)
+        self.assertEqual(carga.percentil(valores, 50), 50)
+        self.assertEqual(carga.percentil(valores, 95), 95)
+        self.assertEqual(carga.percentil(valores, 99), 99)
+        self.assertEqual(carga.percentil(valores, 0), 1)
+        self.assertEqual(carga.percentil([10, 20, 30], 50), 20)
+        self.assertEqual(carga.percentil([10, 20, 30], 95), 30)
+
+    def test_resumo_por_endpoint_e_total(self):
+        resultados = carga.Resultados()
+        for latencia in [30, 10, 20, 40]:
+            resultados.registrar('GET a/', latencia, 200)
+        resultados.registrar('GET a/', 50, 500)
+        resultados.registrar('POST b/', 5, None)
+
+        resumo = resultados.resumo(duracao=2)
+
+        self.assertEqual(list(resumo), ['GET a/', 'POST b/', 'total'])
+        self.assertEqual(resumo['GET a/'], {
+            'requisicoes': 5, 'erros': 1, 'taxa_erros': 0.2, 'vazao': 2.5,
+            'p50': 30, 'p95': 50, 'p99': 50, 'max': 50, 'status': {'200': 4, '500': 1},
+        })
+        self.assertEqual(resumo['POST b/']['status'], {'falha': 1})
+        self.assertEqual(resumo['POST b/']['erros'], 1)
+        total = resumo['total']
+        self.assertEqual((total['requisicoes'], total['erros'], total['vazao']), (6, 2, 3))
+        self.assertEqual((total['p50'], total['max']), (20, 50))
+        self.assertNotIn('status', total)
+        self.assertEqual(carga.Resultados().resumo(duracao=1), {})
+
+    def test_ler_perfil(self):
+        comando = teste_carga.Command()
+
+        self.assertIsNone(comando.ler_perfil(None))
+        self.assertEqual(comando.ler_perfil('coleta=3, login=1'), {'coleta': 3.0, 'login': 1.0})
+        for texto, mensagem in [
+            ('coleta', 'formato'),
+            ('coleta=muito', 'formato'),
+            ('coleta=1,upload=2', 'desconhecidas no perfil: upload'),
+            ('coleta=0,login=0', 'peso positivo'),
+        ]:
+            with self.subTest(texto=texto), self.assertRaisesMessage(CommandError, mensagem):
+                comando.ler_perfil(texto)
+
+    def test_falha_ao_importar_o_wsgi_vira_command_error_com_o_stderr(self):
+        falha = subprocess.CalledProcessError(
+            1, [sys.executable, '-c', carga.CODIGO_INICIALIZACAO],
+            output='', stderr='Traceback...\nImproperlyConfigured: SECRET_KEY ausente\n',
+        )
+        with mock.patch('core.carga.subprocess.run', side_effect=falha), mock.patch('core.carga.Carga') as rodada:
+            with self.assertRaisesMessage(CommandError, 'ImproperlyConfigured: SECRET_KEY ausente'):
+                call_command('teste_carga', '--url', 'http://127.0.0.1:1', stdout=StringIO())
+
+        rodada.assert_not_called()
@@ -9,4 +9,6 @@ urlpatterns = [
     # Exemplos de URLs personalizadas para outras funcionalidades específicas
     path('dashboard-condominios/', views.dashboard_condominios, name='dashboard-condominios'),
     path('relatorio-economia/', views.relatorio_economia, name='relatorio-economia'),
+    path('relatorio-economia/lote/', views.relatorio_economia_lote, name='relatorio-economia-lote'),
+    path('estatisticas-residuos/', views.estatisticas_residuos, name='estatisticas-residuos'),
 ]
\ No newline at end of file
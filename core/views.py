@@ -1,7 +1,10 @@
 from rest_framework import viewsets, status
+from django.conf import settings
 from django.db import transaction
+from django.http import Http404
 from django.shortcuts import render, redirect, get_object_or_404
-from .models import CalculoCredito, ParametroCalculo, TipoResiduo, Condominio
+from .models import CalculoCredito, ParametroCalculo, TipoResiduo, Condominio, TarefaExclusao, EstatisticaResiduo
+from . import benchmarks, estatisticas, eventos, exclusao, ingestao, relatorios, shards
 from django.db.models import Sum, F, FloatField, ExpressionWrapper
 from rest_framework import viewsets
 from rest_framework.decorators import api_view, permission_classes
@@ -11,7 +14,8 @@ from .serializers import (
     TipoResiduoSerializer, 
     CalculoCreditoSerializer, 
     CondominioSerializer, 
-    ParametroCalculoSerializer
+    ParametroCalculoSerializer,
+    TarefaExclusaoSerializer
 )
 
 class CalculoCreditoViewSet(viewsets.ModelViewSet):
@@ -19,7 +23,6 @@ class CalculoCreditoViewSet(viewsets.ModelViewSet):
     queryset = CalculoCredito.objects.all()
     serializer_class = CalculoCreditoSerializer
 
-    @transaction.atomic
     def create(self, request, *args, **kwargs):
         """
         Sobrescreve o método create para realizar o cálculo de crédito de carbono 
@@ -33,45 +36,127 @@ class CalculoCreditoViewSet(viewsets.ModelViewSet):
             tipo_residuo_id = serializer.validated_data.get('tipo_residuo').id
             peso_residuo = serializer.validated_data.get('peso_residuo')
             
-            try:
-                # Busca os parâmetros de cálculo para o tipo de resíduo
-                parametro = ParametroCalculo.objects.get(tipo_residuo_id=tipo_residuo_id)
+            # A coleta e as estatísticas ficam no shard do condomínio
+            alias = shards.atribuir_shard(condominio_id)
+            
+            with transaction.atomic(using=alias):
+                try:
+                    # Busca os parâmetros de cálculo para o tipo de resíduo
+                    parametro = ParametroCalculo.objects.get(tipo_residuo_id=tipo_residuo_id)
                 
-                # Cálculo de emissão de carbono
-                emissao_carbono_atual = peso_residuo * parametro.fator_emissao_padrao
-                emissao_carbono_reciclagem = emissao_carbono_atual - (emissao_carbono_atual * (1 - parametro.eficiencia_reciclagem/100))
+                    # Cálculo de emissão de carbono
+                    emissao_carbono_atual = peso_residuo * parametro.fator_emissao_padrao
+                    emissao_carbono_reciclagem = emissao_carbono_atual - (emissao_carbono_atual * (1 - parametro.eficiencia_reciclagem/100))
                 
-                # Atualiza os valores calculados no serializer
-                serializer.validated_data['emissao_carbono_atual'] = emissao_carbono_atual
-                serializer.validated_data['emissao_carbono_reciclagem'] = emissao_carbono_reciclagem
+                    # Atualiza os valores calculados no serializer
+                    serializer.validated_data['emissao_carbono_atual'] = emissao_carbono_atual
+                    serializer.validated_data['emissao_carbono_reciclagem'] = emissao_carbono_reciclagem
                 
-                # Salva o objeto (o método save do model calculará economia_carbono)
-                self.perform_create(serializer)
+                    if settings.INGESTAO_ASSINCRONA:
+                        # Grava no log local e confirma; o comando drenar_ingestao
+                        # persiste no banco em lotes e atualiza as estatísticas
+                        serializer.validated_data['suspeito'] = estatisticas.avaliar_peso(
+                            condominio_id, tipo_residuo_id, peso_residuo
+                        )
+                        registro = ingestao.registrar(serializer.validated_data)
+                        return Response(
+                            {**registro, 'status': 'pendente'},
+                            status=status.HTTP_202_ACCEPTED
+                        )
                 
-                headers = self.get_success_headers(serializer.data)
-                return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+                    # Pesos muito fora do histórico do condomínio/tipo são marcados
+                    # como suspeitos e não entram nas estatísticas
+                    serializer.validated_data['suspeito'] = estatisticas.registrar_peso(
+                        condominio_id, tipo_residuo_id, peso_residuo
+                    )
                 
-            except ParametroCalculo.DoesNotExist:
-                return Response(
-                    {'erro': 'Parâmetros de cálculo não encontrados para este tipo de resíduo.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            except Exception as e:
-                return Response(
-                    {'erro': f'Erro no cálculo: {str(e)}'},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
+                    # Salva o objeto (o método save do model calculará economia_carbono)
+                    self.perform_create(serializer)
+                
+                    dados = serializer.data
+                    transaction.on_commit(
+                        lambda: eventos.publicar_coletas(condominio_id, [dados]),
+                        using=alias,
+                        robust=True
+                    )
+                
+                    headers = self.get_success_headers(serializer.data)
+                    headers['ETag'] = gerar_etag(serializer.instance)
+                    return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+                
+                except ParametroCalculo.DoesNotExist:
+                    return Response(
+                        {'erro': 'Parâmetros de cálculo não encontrados para este tipo de resíduo.'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                except Exception as e:
+                    return Response(
+                        {'erro': f'Erro no cálculo: {str(e)}'},
+                        status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                    )
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    @transaction.atomic
+    def get_queryset(self):
+        """
+        As coletas ficam no shard do condomínio: nas rotas de detalhe o shard
+        vem do próprio id; na listagem, do filtro ?condominio=
+        """
+        queryset = super().get_queryset()
+        pk = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if pk is not None:
+            alias = shards.shard_do_id(pk)
+            if alias is None:
+                raise Http404
+            return queryset.using(alias)
+        
+        condominio_id = self.request.query_params.get('condominio')
+        if condominio_id:
+            if not condominio_id.isdigit():
+                raise Http404
+            return queryset.using(shards.shard_do_condominio(condominio_id)).filter(condominio_id=condominio_id)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        if not shards.sharding_ativo() or request.query_params.get('condominio'):
+            return super().list(request, *args, **kwargs)
+        
+        # Sem filtro de condomínio, consulta todos os shards em paralelo
+        queryset = self.get_queryset().select_related('condominio', 'tipo_residuo')
+        por_shard = shards.em_paralelo(
+            lambda alias, _: list(queryset.using(alias)),
+            {alias: None for alias in shards.aliases()}
+        )
+        calculos = [calculo for alias in shards.aliases() for calculo in por_shard[alias]]
+        return Response(self.get_serializer(calculos, many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data, headers={'ETag': gerar_etag(instance)})
+
     def update(self, request, *args, **kwargs):
         """
         Sobrescreve o método update para recalcular o crédito de carbono
-        antes de atualizar o objeto
+        antes de atualizar o objeto.
+        
+        Usa controle de concorrência otimista: a gravação é um único UPDATE
+        condicionado à versão lida e responde 412 se o If-Match enviado não
+        confere com a ETag atual ou se o registro foi alterado por outra
+        requisição nesse meio tempo.
         """
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
+        
+        versao_esperada = instance.versao
+        if_match = request.headers.get('If-Match')
+        if if_match and not if_match_confere(if_match, instance):
+            return Response(
+                {'erro': 'O registro foi alterado desde a última leitura.'},
+                status=status.HTTP_412_PRECONDITION_FAILED,
+                headers={'ETag': gerar_etag(instance)}
+            )
+        
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         
         if serializer.is_valid():
@@ -110,28 +195,103 @@ class CalculoCreditoViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_500_INTERNAL_SERVER_ERROR
                     )
             
-            # Salva o objeto (o método save do model calculará economia_carbono)
-            self.perform_update(serializer)
+            campos = dict(serializer.validated_data)
+            alias = instance._state.db
+            if 'condominio' in campos and shards.atribuir_shard(campos['condominio'].id) != alias:
+                return Response(
+                    {'erro': 'Não é possível mover a coleta para um condomínio de outro shard.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            anterior = (instance.condominio_id, instance.tipo_residuo_id, instance.peso_residuo, instance.suspeito)
+            for campo, valor in campos.items():
+                setattr(instance, campo, valor)
+            # update() não chama o save do model, então a economia é calculada aqui
+            instance.economia_carbono = instance.emissao_carbono_atual - instance.emissao_carbono_reciclagem
+            
+            # Compare-and-swap: só grava se ninguém alterou a versão lida.
+            # data_coleta no filtro permite ao PostgreSQL podar as partições.
+            with transaction.atomic(using=alias):
+                if (instance.condominio_id, instance.tipo_residuo_id, instance.peso_residuo) != anterior[:3]:
+                    # O peso editado é reavaliado e as estatísticas do par corrigidas
+                    instance.suspeito = campos['suspeito'] = estatisticas.corrigir_peso(
+                        anterior, instance.condominio_id, instance.tipo_residuo_id, instance.peso_residuo
+                    )
+                atualizados = CalculoCredito.objects.using(alias).filter(
+                    pk=instance.pk,
+                    data_coleta=instance.data_coleta,
+                    versao=versao_esperada
+                ).update(
+                    **campos,
+                    economia_carbono=instance.economia_carbono,
+                    versao=F('versao') + 1
+                )
+                if not atualizados:
+                    # Desfaz a correção das estatísticas
+                    transaction.set_rollback(True, using=alias)
+            
+            if not atualizados:
+                return Response(
+                    {'erro': 'O registro foi alterado por outra requisição; leia-o novamente e repita a alteração.'},
+                    status=status.HTTP_412_PRECONDITION_FAILED
+                )
+            instance.versao = versao_esperada + 1
             
             if getattr(instance, '_prefetched_objects_cache', None):
                 # Se a instância tiver objetos pré-carregados, limpe-os.
                 instance._prefetched_objects_cache = {}
             
-            return Response(serializer.data)
+            eventos.publicar_coletas(instance.condominio_id, [serializer.data])
+            
+            return Response(serializer.data, headers={'ETag': gerar_etag(instance)})
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def gerar_etag(calculo):
+    """ETag de um CalculoCredito, derivado do id e da versão"""
+    return f'"{calculo.pk}-{calculo.versao}"'
+
+def if_match_confere(if_match, calculo):
+    """
+    Avalia o If-Match com comparação forte: confere se é * ou se alguma das
+    tags listadas é a ETag atual do registro; tags fracas (W/) nunca conferem
+    """
+    if if_match.strip() == '*':
+        return True
+    atual = gerar_etag(calculo)
+    return any(valor.strip() == atual for valor in if_match.split(','))
 
-class TipoResiduoViewSet(viewsets.ModelViewSet):
+
+class ExclusaoEmSegundoPlanoMixin:
+    """
+    Troca o DELETE com cascata do Django por uma tarefa de exclusão em lotes.
+    Responde 202 com a tarefa, cujo progresso é consultado em tarefas-exclusao/
+    """
+    modelo_exclusao = None
+    
+    def get_queryset(self):
+        return exclusao.anotar_status_exclusao(super().get_queryset(), self.modelo_exclusao)
+    
+    def destroy(self, request, *args, **kwargs):
+        tarefa = exclusao.agendar_exclusao(self.get_object())
+        return Response(TarefaExclusaoSerializer(tarefa).data, status=status.HTTP_202_ACCEPTED)
+
+class TipoResiduoViewSet(ExclusaoEmSegundoPlanoMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     queryset = TipoResiduo.objects.all()
     serializer_class = TipoResiduoSerializer
+    modelo_exclusao = 'tipo_residuo'
 
-class CondominioViewSet(viewsets.ModelViewSet):
+class CondominioViewSet(ExclusaoEmSegundoPlanoMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     queryset = Condominio.objects.all()
     serializer_class = CondominioSerializer
+    modelo_exclusao = 'condominio'
+
+class TarefaExclusaoViewSet(viewsets.ReadOnlyModelViewSet):
+    permission_classes = [IsAuthenticated]
+    queryset = TarefaExclusao.objects.order_by('-criado_em')
+    serializer_class = TarefaExclusaoSerializer
 
 class ParametroCalculoViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
@@ -142,8 +302,78 @@ class ParametroCalculoViewSet(viewsets.ModelViewSet):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def dashboard_condominios(request):
-    # Lógica para gerar dados do dashboard
-    return Response({"message": "Dados do dashboard"})
+    """
+    Visão geral de todos os condomínios no período: totais da carteira, totais
+    por tipo de resíduo e os condomínios com maior economia. Os agregados vêm
+    de uma consulta agrupada por shard, em paralelo, mais o arquivo frio.
+    """
+    data_inicio = request.query_params.get('data_inicio')
+    data_fim = request.query_params.get('data_fim')
+    try:
+        inicio = relatorios.converter_data(data_inicio)
+        fim = relatorios.converter_data(data_fim)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+    
+    condominios = dict(Condominio.objects.values_list('id', 'nome'))
+    agregados = relatorios.agregar_por_tipo(list(condominios), inicio, fim)
+    resumos = relatorios.resumir(agregados)
+    nomes = [*relatorios.TOTAIS, relatorios.VALOR, relatorios.SUSPEITOS]
+    
+    # Mesmo formato do resumo de um condomínio, somando todos eles por tipo
+    por_tipo = {}
+    for (_, tipo_residuo_id), totais in agregados.items():
+        soma = por_tipo.setdefault(tipo_residuo_id, dict.fromkeys(nomes, 0))
+        for nome in nomes:
+            soma[nome] += totais.get(nome) or 0
+    carteira = relatorios.resumir({(None, tipo): totais for tipo, totais in por_tipo.items()}).get(None)
+    
+    # Os dez primeiros; economia negativa é crédito de carbono, então os menores valores vêm antes
+    ranking = sorted(resumos.items(), key=lambda item: item[1]['total_geral']['economia_total'] or 0)
+    
+    return Response({
+        'periodo': {
+            'data_inicio': data_inicio,
+            'data_fim': data_fim
+        },
+        'total_condominios': len(condominios),
+        'condominios_com_coletas': len(resumos),
+        'total_geral': carteira['total_geral'] if carteira else dict.fromkeys(nomes, 0),
+        'resumo_por_tipo': carteira['resumo_por_tipo'] if carteira else [],
+        'maior_economia': [
+            {
+                'id': condominio_id,
+                'nome': condominios[condominio_id],
+                **{nome: relatorio['total_geral'][nome] for nome in nomes}
+            }
+            for condominio_id, relatorio in ranking[:10]
+        ]
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def estatisticas_residuos(request):
+    """
+    Estatísticas do peso das coletas por condomínio e tipo de resíduo
+    (contagem, média, desvio padrão, quantis e coletas suspeitas)
+    """
+    consulta = EstatisticaResiduo.objects.select_related('tipo_residuo').order_by('condominio_id', 'tipo_residuo__nome')
+    condominio_id = request.query_params.get('condominio_id')
+    if condominio_id:
+        if not condominio_id.isdigit():
+            return Response({"error": "condominio_id inválido"}, status=400)
+        alias = shards.shard_do_condominio(condominio_id)
+        consulta = consulta.using(alias).filter(condominio_id=condominio_id)
+        return Response([estatisticas.resumo(estatistica) for estatistica in consulta])
+
+    # Sem filtro, junta as estatísticas de todos os shards
+    por_shard = shards.em_paralelo(
+        lambda alias, _: [estatisticas.resumo(estatistica) for estatistica in consulta.using(alias)],
+        {alias: None for alias in shards.aliases()}
+    )
+    resultado = [item for alias in shards.aliases() for item in por_shard[alias]]
+    resultado.sort(key=lambda item: (item['condominio'], item['tipo_residuo_nome']))
+    return Response(resultado)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -176,16 +406,17 @@ def relatorio_economia(request):
     data_inicio = request.query_params.get('data_inicio')
     data_fim = request.query_params.get('data_fim')
     
-    # Filtrar resíduos por condomínio e período (se especificado)
-    residuos_query = CalculoCredito.objects.filter(condominio=condominio)
+    try:
+        inicio = relatorios.converter_data(data_inicio)
+        fim = relatorios.converter_data(data_fim)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
     
-    if data_inicio:
-        residuos_query = residuos_query.filter(data_coleta__gte=data_inicio)
-    if data_fim:
-        residuos_query = residuos_query.filter(data_coleta__lte=data_fim)
+    # Totais por tipo de resíduo do banco somados aos do arquivo frio
+    agregados = relatorios.agregar_por_tipo([condominio.id], inicio, fim)
     
     # Verificar se existem resíduos para este condomínio no período
-    if not residuos_query.exists():
+    if not agregados:
         return Response({
             "condominio": {
                 "id": condominio.id,
@@ -195,30 +426,98 @@ def relatorio_economia(request):
             "message": "Não há dados de resíduos disponíveis para este condomínio no período especificado."
         })
     
-    # O restante da função permanece igual...
-    # Agrupar por tipo de resíduo e calcular as somas
-    resumo_por_tipo = residuos_query.values('tipo_residuo__nome').annotate(
-        peso_total=Sum('peso_residuo'),
-        emissao_total=Sum('emissao_carbono_atual'),
-        emissao_reciclagem_total=Sum('emissao_carbono_reciclagem'),
-        economia_total=Sum('economia_carbono')
-    ).order_by('tipo_residuo__nome')
-    
-    # Calcular o total geral
-    total_geral = {
-        'peso_total': residuos_query.aggregate(Sum('peso_residuo'))['peso_residuo__sum'] or 0,
-        'emissao_total': residuos_query.aggregate(Sum('emissao_carbono_atual'))['emissao_carbono_atual__sum'] or 0,
-        'emissao_reciclagem_total': residuos_query.aggregate(Sum('emissao_carbono_reciclagem'))['emissao_carbono_reciclagem__sum'] or 0,
-        'economia_total': residuos_query.aggregate(Sum('economia_carbono'))['economia_carbono__sum'] or 0
+    relatorio = relatorios.resumir(agregados)[condominio.id]
+    
+    # Duração do período para comparar com os benchmarks; sem data_inicio,
+    # o período começa na primeira coleta do condomínio (pré-calculada)
+    primeira = inicio or benchmarks.primeiras_coletas([condominio.id]).get(condominio.id)
+    dias = relatorios.dias_do_periodo(primeira, fim)
+    return Response(montar_relatorio(condominio, relatorio, data_inicio, data_fim, dias))
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def relatorio_economia_lote(request):
+    """
+    Relatórios de economia de vários condomínios em uma única consulta agrupada
+    por (condomínio, tipo de resíduo), mais o total da carteira.
+    Sem condominio_ids, considera todos os condomínios.
+    """
+    ids = request.query_params.getlist('condominio_ids')
+    try:
+        condominio_ids = {int(i) for valor in ids for i in valor.split(',') if i.strip()}
+    except ValueError:
+        return Response({"error": "condominio_ids deve ser uma lista de IDs numéricos"}, status=400)
+    
+    data_inicio = request.query_params.get('data_inicio')
+    data_fim = request.query_params.get('data_fim')
+    try:
+        inicio = relatorios.converter_data(data_inicio)
+        fim = relatorios.converter_data(data_fim)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+    
+    condominios = Condominio.objects.order_by('id')
+    if condominio_ids:
+        condominios = condominios.filter(id__in=condominio_ids)
+    condominios = list(condominios)
+    if not condominios:
+        return Response({"error": "Nenhum condomínio encontrado"}, status=404)
+    
+    resumos = relatorios.resumir(
+        relatorios.agregar_por_tipo([c.id for c in condominios], inicio, fim)
+    )
+    
+    primeiras = {} if inicio else benchmarks.primeiras_coletas(list(resumos))
+    
+    resultados = []
+    for condominio in condominios:
+        relatorio = resumos.get(condominio.id)
+        if relatorio is None:
+            resultados.append({
+                'condominio': {
+                    'id': condominio.id,
+                    'nome': condominio.nome,
+                    'endereco': condominio.endereco
+                },
+                'message': 'Não há dados de resíduos disponíveis para este condomínio no período especificado.'
+            })
+        else:
+            dias = relatorios.dias_do_periodo(inicio or primeiras.get(condominio.id), fim)
+            resultados.append(montar_relatorio(condominio, relatorio, data_inicio, data_fim, dias))
+    
+    total_carteira = {
+        nome: sum(r['total_geral'][nome] for r in resumos.values())
+        for nome in [*relatorios.TOTAIS, relatorios.VALOR, relatorios.SUSPEITOS]
     }
+    total_carteira['valor_estimado_credito_usd'] = round(sum(
+        r['valor_estimado_credito_usd'] for r in resultados if 'valor_estimado_credito_usd' in r
+    ), 2)
+    
+    return Response({
+        'periodo': {
+            'data_inicio': data_inicio,
+            'data_fim': data_fim
+        },
+        'relatorios': resultados,
+        'total_carteira': total_carteira
+    })
+
+def montar_relatorio(condominio, relatorio, data_inicio, data_fim, dias=None):
+    """
+    Monta a resposta do relatório de economia de um condomínio; `dias` é a
+    duração do período, usada para comparar com os benchmarks
+    """
+    resumo_por_tipo = relatorio['resumo_por_tipo']
+    total_geral = relatorio['total_geral']
     
     # Verificar se gerou crédito de carbono (economia total negativa)
     credito_carbono = total_geral['economia_total'] < 0
     
-    # Estimar valor de mercado do crédito, se aplicável (usando um valor médio de $60 por tonelada)
-    valor_credito = abs(total_geral['economia_total'] / 1000) * 60 if credito_carbono else 0
+    # Valor de mercado do crédito, se aplicável: cada coleta valorada pelo
+    # preço do carbono vigente no seu dia (PrecoCarbono)
+    valor_credito = abs(total_geral['valor_economia_usd']) if credito_carbono else 0
     
-    resultado = {
+    return {
         'condominio': {
             'id': condominio.id,
             'nome': condominio.nome,
@@ -232,13 +531,68 @@ def relatorio_economia(request):
         'total_geral': total_geral,
         'status_ambiental': 'Crédito de Carbono' if credito_carbono else 'Redução de Emissões',
         'valor_estimado_credito_usd': round(valor_credito, 2) if credito_carbono else 0,
-        'recomendacoes': gerar_recomendacoes(resumo_por_tipo, credito_carbono)
+        'recomendacoes': gerar_recomendacoes(
+            resumo_por_tipo, credito_carbono, condominio.numero_apartamentos, dias
+        )
     }
+
+def gerar_recomendacoes(resumo_por_tipo, credito_carbono, numero_apartamentos=None, dias=None):
+    """
+    Gera recomendações comparando a economia por apartamento de cada tipo de
+    resíduo com os benchmarks dos demais condomínios (calcular_benchmarks).
+    Sem benchmarks, usa as regras fixas por nome de resíduo.
+    """
+    tabela = benchmarks.obter() if numero_apartamentos and dias else {}
+    if not tabela:
+        return recomendacoes_por_nome(resumo_por_tipo, credito_carbono)
     
-    return Response(resultado)
+    recomendacoes = []
+    por_nome = {r['tipo_residuo__nome']: r for r in resumo_por_tipo}
+    abaixo, acima, ausentes = [], [], []
+    for nome, benchmark in sorted(tabela.items()):
+        item = por_nome.get(nome)
+        if item is None:
+            # Tipo que a maioria dos condomínios recicla e este não
+            if benchmark.mediana > 0:
+                ausentes.append(nome)
+            continue
+        economia = benchmarks.metrica(item['economia_total'], numero_apartamentos, dias)
+        percentil = benchmark.percentil(economia)
+        if percentil < 25:
+            abaixo.append(f"{nome} (percentil {percentil:.0f})")
+        elif percentil >= 75:
+            acima.append(f"{nome} (percentil {percentil:.0f})")
+    
+    if abaixo:
+        recomendacoes.append(
+            f"A economia por apartamento com {', '.join(abaixo)} está entre as 25% menores dos condomínios. "
+            "Reforçar a separação desses materiais com os moradores."
+        )
+    
+    if ausentes:
+        recomendacoes.append(
+            f"Implementar coleta seletiva de {', '.join(ausentes)}, reciclados pela maioria dos condomínios."
+        )
+    
+    if acima:
+        recomendacoes.append(
+            f"Bom desempenho com {', '.join(acima)}: economia por apartamento entre as 25% maiores dos condomínios."
+        )
+    
+    # Recomendação geral
+    if credito_carbono:
+        recomendacoes.append(
+            "Manter as práticas atuais e considerar expandir o programa de reciclagem para obter maior crédito de carbono."
+        )
+    elif not recomendacoes:
+        recomendacoes.append(
+            "Economia por apartamento na média dos condomínios; aumentar a separação dos materiais recicláveis para se destacar."
+        )
+    
+    return recomendacoes
 
-def gerar_recomendacoes(resumo_por_tipo, credito_carbono):
-    """Gera recomendações baseadas nos dados do relatório"""
+def recomendacoes_por_nome(resumo_por_tipo, credito_carbono):
+    """Recomendações por regras fixas, usadas enquanto não há benchmarks"""
     recomendacoes = []
     
     # Converter para lista para manipulação
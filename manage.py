@@ -6,6 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
+    if sys.argv[1:2] == ['test']:
+        # Os testes de sharding precisam de um segundo banco (SHARDS_SQLITE=1)
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'apiReciclagem.settings_teste')
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'apiReciclagem.settings')
     try:
         from django.core.management import execute_from_command_line